@@ -0,0 +1,94 @@
+"""
+  Compares the throughput of the order list endpoints served under WSGI and under
+  ASGI (order/asgi.py, with the async list views) for the same number of concurrent
+  clients, using the load generator of load_test.py.
+
+  Each server is started with its command, the load test runs against it once it
+  accepts connections, then it is stopped. The report has the load test report of
+  both servers and the ratio of their throughputs. e.g.
+    python bench_asgi.py --token <token> --concurrency 64 --requests 5000 --output asgi.json
+
+  The default commands use gunicorn and uvicorn, one process each, so the comparison
+  is between one WSGI process with a fixed number of threads and one ASGI process.
+  Neither is a dependency of the project, install them first:
+    pip install gunicorn uvicorn
+"""
+import argparse
+import json
+import shlex
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+from load_test import LoadTest, parse_mix
+from send_order import TOKEN
+
+SERVERS = {
+  'wsgi': ('http://127.0.0.1:8010/api', 'gunicorn order.wsgi:application --bind 127.0.0.1:8010 --workers 1 --threads 8'),
+  'asgi': ('http://127.0.0.1:8011/api', 'uvicorn order.asgi:application --host 127.0.0.1 --port 8011 --workers 1'),
+}
+
+
+def wait_for_port(url, timeout):
+  address = urlparse(url)
+  deadline = time.monotonic() + timeout
+
+  while time.monotonic() < deadline:
+    try:
+      with socket.create_connection((address.hostname, address.port), timeout=1):
+        return
+    except OSError:
+      time.sleep(0.1)
+
+  raise RuntimeError(f'Nothing is listening on {address.netloc} after {timeout}s')
+
+
+def run_server(name, url, command, args):
+  server = subprocess.Popen(shlex.split(command))
+  try:
+    wait_for_port(url, args.startup_timeout)
+    print(f'{name}: {command}', file=sys.stderr)
+
+    load_args = argparse.Namespace(
+      url=url, token=args.token, concurrency=args.concurrency, requests=args.requests,
+      duration=args.duration, mix=args.mix, customers=args.customers, timeout=args.timeout, seed=args.seed)
+    return LoadTest(load_args).run()
+  finally:
+    server.terminate()
+    server.wait()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Compare the list endpoints throughput under WSGI and ASGI')
+  parser.add_argument('--token', default=TOKEN, help='Authentication token')
+  parser.add_argument('--wsgi-command', default=SERVERS['wsgi'][1], help='Command that starts the WSGI server')
+  parser.add_argument('--wsgi-url', default=SERVERS['wsgi'][0], help='Base URL of the API on the WSGI server')
+  parser.add_argument('--asgi-command', default=SERVERS['asgi'][1], help='Command that starts the ASGI server')
+  parser.add_argument('--asgi-url', default=SERVERS['asgi'][0], help='Base URL of the API on the ASGI server')
+  parser.add_argument('--concurrency', type=int, default=64, help='Number of concurrent clients')
+  parser.add_argument('--requests', type=int, default=2000, help='Total number of requests per server')
+  parser.add_argument('--duration', type=float, default=0, help='Stop after this many seconds (0 means no limit)')
+  parser.add_argument('--mix', type=parse_mix, default='list_customer=4,list_status=1',
+    help='Weights of the load test scenarios, the list endpoints by default')
+  parser.add_argument('--customers', type=int, default=1000, help='Customer ids used by the list requests are in 1..N')
+  parser.add_argument('--timeout', type=float, default=60, help='Timeout of each request in seconds')
+  parser.add_argument('--seed', type=int, default=1, help='Seed of the scenario mix')
+  parser.add_argument('--startup-timeout', type=float, default=30, help='Seconds to wait for a server to start')
+  parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+  args = parser.parse_args()
+
+  reports = {
+    'wsgi': run_server('wsgi', args.wsgi_url, args.wsgi_command, args),
+    'asgi': run_server('asgi', args.asgi_url, args.asgi_command, args),
+  }
+  wsgi_throughput = reports['wsgi']['throughput']
+  reports['asgi_vs_wsgi_throughput'] = round(reports['asgi']['throughput'] / wsgi_throughput, 3) if wsgi_throughput else None
+
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump(reports, output, indent=2)
+  else:
+    json.dump(reports, sys.stdout, indent=2)
+    print()
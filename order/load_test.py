@@ -0,0 +1,233 @@
+"""
+  Load generator for the order API, built on send_order.py.
+
+  Runs a mix of requests against the create, list and status transition endpoints
+  from a pool of threads and prints a JSON report with the throughput and the
+  latency percentiles/histogram of every endpoint, so two runs can be compared.
+
+  e.g. against the local dev server (python manage.py runserver):
+    python load_test.py --token <token> --concurrency 16 --requests 5000 --output run.json
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from send_order import API_URL, TOKEN, get_headers, random_order
+
+# Upper bound of each latency bucket in milliseconds, the last one catches everything else
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+
+STATUS_RECEIVED = 1
+
+
+class LatencyRecorder:
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._latencies = defaultdict(list)
+    self._errors = defaultdict(int)
+
+  def record(self, endpoint, seconds, ok):
+    with self._lock:
+      self._latencies[endpoint].append(seconds * 1000)
+      if not ok:
+        self._errors[endpoint] += 1
+
+  def report(self, elapsed):
+    endpoints = {}
+
+    for endpoint, latencies in sorted(self._latencies.items()):
+      latencies = sorted(latencies)
+      endpoints[endpoint] = {
+        'requests': len(latencies),
+        'errors': self._errors[endpoint],
+        'throughput': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+          'min': round(latencies[0], 3),
+          'p50': round(percentile(latencies, 50), 3),
+          'p95': round(percentile(latencies, 95), 3),
+          'p99': round(percentile(latencies, 99), 3),
+          'max': round(latencies[-1], 3),
+        },
+        'histogram_ms': histogram(latencies),
+      }
+
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {
+      'elapsed_seconds': round(elapsed, 3),
+      'requests': total,
+      'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+      'throughput': round(total / elapsed, 2) if elapsed else 0.0,
+      'endpoints': endpoints,
+    }
+
+
+# Nearest-rank percentile of a sorted list, None when it is empty
+def percentile(values, rank):
+  if not values:
+    return None
+
+  index = max(0, math.ceil(rank * len(values) / 100) - 1)
+  return values[min(index, len(values) - 1)]
+
+
+def histogram(values):
+  counts = dict.fromkeys(HISTOGRAM_BUCKETS_MS, 0)
+  buckets = iter(HISTOGRAM_BUCKETS_MS)
+  bucket = next(buckets)
+
+  for value in values: # values are sorted
+    while value > bucket:
+      bucket = next(buckets)
+    counts[bucket] += 1
+
+  return {('+Inf' if bucket == float('inf') else f'le_{bucket}'): count for bucket, count in counts.items()}
+
+
+class LoadTest:
+
+  def __init__(self, args):
+    self.args = args
+    self.rng = random.Random(args.seed)
+    self.rng_lock = threading.Lock()
+    self.recorder = LatencyRecorder()
+    self.headers = get_headers(args.token)
+    self.local = threading.local()
+
+    # Ids of the orders created during the run, used by the status transitions
+    self.order_ids = []
+    self.order_ids_lock = threading.Lock()
+
+    self.scenarios = {
+      'create': self.create_order,
+      'list_customer': self.list_customer_orders,
+      'list_status': self.list_orders_by_status,
+      'next_status': self.set_next_status,
+    }
+
+  # One connection pool per thread, requests.Session is not thread safe
+  def session(self):
+    if not hasattr(self.local, 'session'):
+      self.local.session = requests.Session()
+      self.local.session.headers.update(self.headers)
+    return self.local.session
+
+  def request(self, endpoint, method, path, **kwargs):
+    start = time.perf_counter()
+    try:
+      response = self.session().request(method, f'{self.args.url}{path}', timeout=self.args.timeout, **kwargs)
+      ok = response.status_code < 400
+    except requests.RequestException:
+      response, ok = None, False
+
+    self.recorder.record(endpoint, time.perf_counter() - start, ok)
+    return response
+
+  def create_order(self):
+    # order_id is the idempotency key of the request, it must not repeat across runs
+    with self.rng_lock:
+      data = random_order(self.rng, order_id=uuid.uuid4().hex)
+
+    response = self.request('create', 'POST', '/order/add/', data=json.dumps(data))
+
+    if response is not None and response.status_code == 201:
+      with self.order_ids_lock:
+        self.order_ids.append(response.json()['order_id'])
+
+  def list_customer_orders(self):
+    with self.rng_lock:
+      customer_id = self.rng.randint(1, self.args.customers)
+
+    self.request('list_customer', 'GET', f'/customer/{customer_id}/orders/get/')
+
+  def list_orders_by_status(self):
+    self.request('list_status', 'GET', f'/order/{STATUS_RECEIVED}/get/')
+
+  def set_next_status(self):
+    with self.order_ids_lock:
+      created = len(self.order_ids)
+
+    if not created:
+      return self.create_order()
+
+    with self.rng_lock:
+      order_id = self.order_ids[self.rng.randrange(created)]
+
+    self.request('next_status', 'POST', f'/order/{order_id}/status/next/')
+
+  def next_scenario(self):
+    names, weights = zip(*self.args.mix.items())
+    with self.rng_lock:
+      return self.scenarios[self.rng.choices(names, weights)[0]]
+
+  def worker(self, deadline, counter):
+    while time.perf_counter() < deadline:
+      with counter['lock']:
+        if counter['remaining'] <= 0:
+          return
+        counter['remaining'] -= 1
+
+      self.next_scenario()()
+
+  def run(self):
+    counter = { 'lock': threading.Lock(), 'remaining': self.args.requests }
+    start = time.perf_counter()
+    deadline = start + self.args.duration if self.args.duration else float('inf')
+
+    with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+      for future in [executor.submit(self.worker, deadline, counter) for _ in range(self.args.concurrency)]:
+        future.result()
+
+    report = self.recorder.report(time.perf_counter() - start)
+    report['config'] = {
+      'url': self.args.url,
+      'concurrency': self.args.concurrency,
+      'mix': self.args.mix,
+      'seed': self.args.seed,
+    }
+    return report
+
+
+# create=1,list_customer=3 -> {'create': 1, 'list_customer': 3}
+def parse_mix(value):
+  mix = {}
+  for part in value.split(','):
+    name, _, weight = part.partition('=')
+    if name not in ('create', 'list_customer', 'list_status', 'next_status'):
+      raise argparse.ArgumentTypeError(f'Unknown scenario {name}')
+    mix[name] = float(weight or 1)
+  return mix
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Run a load test against the order API')
+  parser.add_argument('--url', default=API_URL, help='Base URL of the API')
+  parser.add_argument('--token', default=TOKEN, help='Authentication token')
+  parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients')
+  parser.add_argument('--requests', type=int, default=1000, help='Total number of requests')
+  parser.add_argument('--duration', type=float, default=0, help='Stop after this many seconds (0 means no limit)')
+  parser.add_argument('--mix', type=parse_mix, default='create=2,list_customer=4,list_status=1,next_status=2',
+    help='Weights of the scenarios: create, list_customer, list_status, next_status')
+  parser.add_argument('--customers', type=int, default=1000, help='Customer ids used by the list requests are in 1..N')
+  parser.add_argument('--timeout', type=float, default=30, help='Timeout of each request in seconds')
+  parser.add_argument('--seed', type=int, default=1, help='Seed of the random orders and scenario mix')
+  parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+  args = parser.parse_args()
+
+  report = LoadTest(args).run()
+
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump(report, output, indent=2)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,107 @@
+"""
+  Async versions of the order list views, served by the ASGI entry point (order/asgi.py).
+
+  Under ASGI, Django runs every synchronous view in one shared thread, so a slow list
+  request holds up all the others. These views are async: the event loop holds the
+  client connections, and each request runs its list view (authentication, cache,
+  page query, serialization and rendering) in a thread from a bounded pool. At most
+  ASYNC_VIEW_THREADS requests use the database at once, each on the connections of
+  its own thread.
+
+  With ASYNC_VIEW_THREADS = 0 the work goes through Django's sync_to_async in the
+  shared thread instead, the way the async ORM methods run their queries.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.template.response import SimpleTemplateResponse
+from django.views import View
+
+from .metrics import track_queries
+from .views import (
+  CompletedOrdersByCustomerView,
+  IncompleteOrdersByCustomerView,
+  OrderByStatusView,
+  OrderSearchView,
+  OrdersByCustomerView,
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+  global _executor
+
+  with _executor_lock:
+    if _executor is None:
+      _executor = ThreadPoolExecutor(
+        max_workers=getattr(settings, 'ASYNC_VIEW_THREADS', 16), thread_name_prefix='order-async-view')
+
+  return _executor
+
+
+def _close_connections(function):
+  def wrapper(*args, **kwargs):
+    try:
+      return function(*args, **kwargs)
+    finally:
+      close_old_connections() # the pool threads never see request_finished
+
+  return wrapper
+
+
+# Runs function(*args, **kwargs) in a thread of the pool and waits for it without blocking the loop
+async def run_in_thread(function, *args, **kwargs):
+  if not getattr(settings, 'ASYNC_VIEW_THREADS', 16):
+    return await sync_to_async(function)(*args, **kwargs)
+
+  return await sync_to_async(_close_connections(function), thread_sensitive=False, executor=_get_executor())(*args, **kwargs)
+
+
+# Serves GET with the rest_framework list view in view_class, off the event loop
+class AsyncOrderListView(View):
+  view_class = None
+  http_method_names = ['get']
+
+  async def get(self, request, *args, **kwargs):
+    return await run_in_thread(self._respond, request, *args, **kwargs)
+
+  # Rendered here and returned as a plain HttpResponse: the handler renders deferred
+  # responses in the shared thread, even when they are already rendered. A 304 is
+  # already a plain response
+  def _respond(self, request, *args, **kwargs):
+    with track_queries():
+      response = self.view_class.as_view()(request, *args, **kwargs)
+      if isinstance(response, SimpleTemplateResponse):
+        response.render()
+
+    rendered = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+      rendered[header] = value
+
+    return rendered
+
+
+class AsyncOrdersByCustomerView(AsyncOrderListView):
+  view_class = OrdersByCustomerView
+
+
+class AsyncIncompleteOrdersByCustomerView(AsyncOrderListView):
+  view_class = IncompleteOrdersByCustomerView
+
+
+class AsyncCompletedOrdersByCustomerView(AsyncOrderListView):
+  view_class = CompletedOrdersByCustomerView
+
+
+class AsyncOrderByStatusView(AsyncOrderListView):
+  view_class = OrderByStatusView
+
+
+class AsyncOrderSearchView(AsyncOrderListView):
+  view_class = OrderSearchView
@@ -0,0 +1,128 @@
+"""
+  Token authentication without the per-request query.
+
+  rest_framework's TokenAuthentication reads authtoken_token joined to auth_user on
+  every call. CachedTokenAuthentication keeps the (user, token) pair of the keys it
+  has seen in an in-process LRU with a TTL, optionally backed by one of the caches
+  in CACHES so several processes share the entries.
+
+  Entries are dropped when a token is deleted (that is also how DRF rotates a token,
+  the key is the primary key) and when its user is saved, e.g. deactivated. Other
+  processes only see the change through SHARED_CACHE, or once the TTL expires.
+
+  Configured with the TOKEN_AUTH_CACHE setting:
+    SIZE: max entries in the in-process LRU
+    TTL: seconds an entry is trusted
+    SHARED_CACHE: alias of a cache in CACHES, or None to use the LRU only
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+class TokenCache:
+
+  def __init__(self, size=10000, ttl=300, shared_cache=None):
+    self.size = size
+    self.ttl = ttl
+    self.shared_cache = shared_cache
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_settings(cls):
+    return cls(**{key.lower(): value for key, value in getattr(settings, 'TOKEN_AUTH_CACHE', {}).items()})
+
+  def _shared_key(self, key):
+    return f'auth:token:{key}'
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+
+      if entry is not None:
+        expires, credentials = entry
+        if expires > time.monotonic():
+          self._entries.move_to_end(key)
+          return credentials
+
+        del self._entries[key]
+
+    if self.shared_cache is not None:
+      credentials = caches[self.shared_cache].get(self._shared_key(key))
+      if credentials is not None:
+        self._set_local(key, credentials)
+        return credentials
+
+    return None
+
+  def set(self, key, credentials):
+    self._set_local(key, credentials)
+
+    if self.shared_cache is not None:
+      caches[self.shared_cache].set(self._shared_key(key), credentials, timeout=self.ttl)
+
+  def _set_local(self, key, credentials):
+    with self._lock:
+      self._entries[key] = (time.monotonic() + self.ttl, credentials)
+      self._entries.move_to_end(key)
+
+      while len(self._entries) > self.size:
+        self._entries.popitem(last=False)
+
+  def delete(self, key):
+    with self._lock:
+      self._entries.pop(key, None)
+
+    if self.shared_cache is not None:
+      caches[self.shared_cache].delete(self._shared_key(key))
+
+  # Keys of the user's tokens that are in the LRU, plus the ones in the database
+  # for the entries that only live in the shared cache
+  def delete_user(self, user_id):
+    with self._lock:
+      keys = {key for key, (_, (user, _)) in self._entries.items() if user.pk == user_id}
+
+    if self.shared_cache is not None:
+      keys.update(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+
+    for key in keys:
+      self.delete(key)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+
+token_cache = TokenCache.from_settings()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+  def authenticate_credentials(self, key):
+    credentials = token_cache.get(key)
+
+    if credentials is None:
+      credentials = super().authenticate_credentials(key)
+      token_cache.set(key, credentials)
+
+    return credentials
+
+
+@receiver(post_delete, sender=Token)
+def _token_deleted(sender, instance, **kwargs):
+  token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def _user_saved(sender, instance, created, **kwargs):
+  if not created:
+    token_cache.delete_user(instance.pk)
@@ -0,0 +1,276 @@
+"""
+  Benchmark suite of the order API, used by the benchmark command.
+
+  There is a case for every public OrderManager method and for every route of
+  main/urls.py, run against the orders in the database (see generate_orders). Each
+  case runs once to warm up, then `repeat` times; the report has the min, median and
+  p95 time in milliseconds and the number of queries of one run.
+
+  The suite runs in a transaction that is rolled back at the end, and every run of a
+  case that writes is rolled back on its own, so each run sees the same data and the
+  database is left as it was. The customer lists cache is cleared before every run,
+  the lists are timed on the database path.
+
+  compare() flags the cases whose median got slower than a saved baseline report by
+  more than threshold (0.25 = 25%) and more than min_delta_ms.
+"""
+import inspect
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Manager
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .cache import ORDERS_CACHE
+from .managers import OrderManager
+from .models import ArchivedOrder, CustomerOrderSummary, Order, OrderCustomer
+from .status import Status
+from . import urls
+
+PAGE_SIZE = 50
+BULK_SIZE = 100
+
+ORDER = {
+  'order_customer': {'customer_id': 1, 'email': 'benchmark@mail.com', 'name': 'Benchmark'},
+  'items': [
+    {'name': 'Product 1', 'price_per_unit': '10.00', 'product_id': 1, 'quantity': 2},
+    {'name': 'Product 2', 'price_per_unit': '5.50', 'product_id': 2, 'quantity': 1},
+  ],
+}
+
+
+class BenchmarkError(Exception):
+  pass
+
+
+class _Rollback(Exception):
+  pass
+
+
+# What the cases run against: the customer with the most orders, the newest Received
+# orders for the transitions, and the date ranges
+class Fixture:
+
+  def __init__(self):
+    self.customer_id = CustomerOrderSummary.objects.order_by('-orders', 'pk').values_list('pk', flat=True).first()
+    self.received_ids = list(Order.objects.filter(status=Status.Received.value).order_by('-created_at', 'id').values_list('id', flat=True)[:BULK_SIZE])
+    if self.customer_id is None or not self.received_ids:
+      raise BenchmarkError('No customer summaries or Received orders, generate a dataset first')
+
+    self.order_id = self.received_ids[0]
+    self.now = timezone.now()
+
+    # the requests need a host that passes ALLOWED_HOSTS, 'testserver' doesn't outside the tests
+    host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+    self.client = APIClient(SERVER_NAME=host)
+    self.client.force_authenticate(user=User.objects.get_or_create(username='benchmark')[0])
+
+  def order(self):
+    return Order.objects.get(pk=self.order_id)
+
+  def dates(self, days):
+    return (self.now - timedelta(days=days)).date().isoformat(), self.now.date().isoformat()
+
+
+# run(fixture, *setup(fixture)) is timed, setup is not
+class Case:
+
+  def __init__(self, name, run, writes=False, setup=None):
+    self.name = name
+    self.run = run
+    self.writes = writes
+    self.setup = setup
+
+
+def _page(queryset):
+  return list(queryset[:PAGE_SIZE])
+
+
+def _manager_cases():
+  manager = Order.objects
+  week = timedelta(days=7)
+
+  # the bookkeeping of a batch of new orders, inserted by the setup
+  def new_orders(fixture):
+    customer = OrderCustomer.objects.create(customer_id=1, name='Benchmark', email='benchmark@mail.com')
+    return [Order.objects.bulk_create([Order(order_customer=customer) for _ in range(BULK_SIZE)])]
+
+  return [
+    Case('with_details', lambda fixture: _page(manager.with_details().order_by('-id'))),
+    Case('get_all_orders_by_customer', lambda fixture: _page(manager.get_all_orders_by_customer(fixture.customer_id))),
+    Case('get_customer_incomplete_orders', lambda fixture: _page(manager.get_customer_incomplete_orders(fixture.customer_id))),
+    Case('get_customer_completed_orders', lambda fixture: _page(manager.get_customer_completed_orders(fixture.customer_id))),
+    Case('get_orders_by_status', lambda fixture: _page(manager.get_orders_by_status(Status.Received))),
+    Case('get_orders_by_period', lambda fixture: _page(manager.get_orders_by_period(fixture.now - week, fixture.now))),
+    Case('search', lambda fixture: _page(manager.search(fixture.customer_id, [Status.Received, Status.Processing], start_date=fixture.now - week))),
+    Case('with_archive', lambda fixture: [_page(orders) for orders in manager.with_archive('get_orders_by_status', Status.Completed).sources]),
+    Case('select_for_transition', lambda fixture: list(manager.select_for_transition(status=Status.Received, start_date=fixture.now - week).values_list('id', flat=True))),
+    Case('set_status', lambda fixture: manager.set_status(fixture.order(), Status.Shipping), writes=True),
+    Case('set_next_status', lambda fixture: manager.set_next_status(fixture.order()), writes=True),
+    Case('cancel_order', lambda fixture: manager.cancel_order(fixture.order()), writes=True),
+    Case('bulk_set_status', lambda fixture: manager.bulk_set_status(manager.select_for_transition(order_ids=fixture.received_ids), Status.Shipping), writes=True),
+    Case('bulk_set_next_status', lambda fixture: manager.bulk_set_next_status(manager.select_for_transition(order_ids=fixture.received_ids)), writes=True),
+    Case('bulk_cancel_orders', lambda fixture: manager.bulk_cancel_orders(manager.select_for_transition(order_ids=fixture.received_ids)), writes=True),
+    Case('orders_created', lambda fixture, orders: manager.orders_created(orders), writes=True, setup=new_orders),
+  ]
+
+
+def _get(path):
+  def run(fixture):
+    response = fixture.client.get('/api/' + path(fixture))
+    if response.streaming:
+      b''.join(response.streaming_content)
+    return response
+  return run
+
+
+def _post(path, body=None):
+  return lambda fixture: fixture.client.post('/api/' + path(fixture), body(fixture) if body else None, format='json')
+
+
+# by route of main.urls.urlpatterns
+def _url_cases():
+  def ids(fixture):
+    return {'order_ids': fixture.received_ids}
+
+  cases = {
+    'order/add/': (_post(lambda fixture: 'order/add/', lambda fixture: ORDER), True),
+    'order/batch/add/': (_post(lambda fixture: 'order/batch/add/', lambda fixture: [ORDER] * BULK_SIZE), True),
+    'customer/<int:customer_id>/orders/get/': (_get(lambda fixture: f'customer/{fixture.customer_id}/orders/get/'), False),
+    'customer/<int:customer_id>/orders/incomplet/get': (_get(lambda fixture: f'customer/{fixture.customer_id}/orders/incomplet/get'), False),
+    'customer/<int:customer_id>/orders/complete/get': (_get(lambda fixture: f'customer/{fixture.customer_id}/orders/complete/get'), False),
+    'customer/<int:customer_id>/summary': (_get(lambda fixture: f'customer/{fixture.customer_id}/summary'), False),
+    'order/<int:order_id>/cancel': (_post(lambda fixture: f'order/{fixture.order_id}/cancel'), True),
+    'order/<int:status_id>/get/': (_get(lambda fixture: f'order/{Status.Received.value}/get/'), False),
+    'order/<int:order_id>/status/<int:status_id>/set/': (_post(lambda fixture: f'order/{fixture.order_id}/status/{Status.Shipping.value}/set/'), True),
+    'order/<int:order_id>/status/next/': (_post(lambda fixture: f'order/{fixture.order_id}/status/next/'), True),
+    'order/status/counts/': (_get(lambda fixture: 'order/status/counts/'), False),
+    'order/search/': (_get(lambda fixture: f'order/search/?customer_id={fixture.customer_id}&status=1,2&start_date={fixture.dates(7)[0]}'), False),
+    'order/changes/': (_get(lambda fixture: 'order/changes/?limit=500'), False),
+    'order/export/': (_get(lambda fixture: 'order/export/?start_date={}&end_date={}'.format(*fixture.dates(1))), False),
+    'report/orders/': (_get(lambda fixture: 'report/orders/?start_date={}&end_date={}'.format(*fixture.dates(90))), False),
+    'order/bulk/cancel/': (_post(lambda fixture: 'order/bulk/cancel/', ids), True),
+    'order/bulk/status/<int:status_id>/set/': (_post(lambda fixture: f'order/bulk/status/{Status.Shipping.value}/set/', ids), True),
+    'order/bulk/status/next/': (_post(lambda fixture: 'order/bulk/status/next/', ids), True),
+    'cache/orders/stats/': (_get(lambda fixture: 'cache/orders/stats/'), False),
+    'metrics': (_get(lambda fixture: 'metrics'), False),
+  }
+
+  return [Case(route, _checked(route, request), writes=writes) for route, (request, writes) in cases.items()]
+
+
+def _checked(route, request):
+  def run(fixture):
+    response = request(fixture)
+    if response.status_code >= 400:
+      raise BenchmarkError(f'{route} answered {response.status_code}')
+  return run
+
+
+def cases():
+  return [Case(f'manager.{case.name}', case.run, case.writes, case.setup) for case in _manager_cases()] + \
+    [Case(f'url.{case.name}', case.run, case.writes, case.setup) for case in _url_cases()]
+
+
+# The OrderManager methods and the routes that have no case, a new one must get a case
+def uncovered():
+  names = {case.name for case in cases()}
+  own = OrderManager.__mro__[:OrderManager.__mro__.index(Manager)] # with the read methods of OrderQueries
+  methods = [
+    name for klass in own for name, member in vars(klass).items()
+    if inspect.isfunction(member) and not name.startswith('_') and f'manager.{name}' not in names
+  ]
+  routes = [str(pattern.pattern) for pattern in urls.urlpatterns if f'url.{pattern.pattern}' not in names]
+  return methods + routes
+
+
+@contextmanager
+def _rolled_back(writes):
+  if not writes:
+    yield
+    return
+
+  with transaction.atomic():
+    yield
+    transaction.set_rollback(True)
+
+
+def _time(case, fixture, repeat):
+  samples = []
+
+  for index in range(repeat + 1): # the first run warms up
+    caches[ORDERS_CACHE].clear()
+    with _rolled_back(case.writes):
+      args = case.setup(fixture) if case.setup is not None else ()
+      with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        case.run(fixture, *args)
+        elapsed = time.perf_counter() - started
+    if index:
+      samples.append(elapsed * 1000)
+
+  samples.sort()
+  return {
+    'min_ms': round(samples[0], 3),
+    'median_ms': round(statistics.median(samples), 3),
+    'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    'queries': len(queries),
+  }
+
+
+"""
+  Runs the cases whose name contains only (all of them by default), repeat times each.
+  on_case(name, result) is called after each case. Returns the report
+"""
+def run(repeat=5, only=None, on_case=None):
+  report = {
+    'dataset': {'orders': Order.objects.count(), 'archived_orders': ArchivedOrder.objects.count(), 'customers': OrderCustomer.objects.count()},
+    'repeat': repeat,
+    'cases': {},
+  }
+
+  try:
+    with transaction.atomic():
+      fixture = Fixture()
+      for case in cases():
+        if only and only not in case.name:
+          continue
+        report['cases'][case.name] = _time(case, fixture, repeat)
+        if on_case is not None:
+          on_case(case.name, report['cases'][case.name])
+      raise _Rollback()
+  except _Rollback:
+    pass
+
+  return report
+
+
+# The cases of the report slower than in the baseline, as
+# {case, baseline_ms, median_ms, change} with change the relative slowdown, None when
+# the baseline median is 0. The cases without a median in the baseline are skipped
+def compare(report, baseline, threshold=0.25, min_delta_ms=1.0):
+  regressions = []
+
+  for name, result in report['cases'].items():
+    before = baseline.get('cases', {}).get(name)
+    if before is None or before.get('median_ms') is None:
+      continue
+
+    delta = result['median_ms'] - before['median_ms']
+    if delta > min_delta_ms and result['median_ms'] > before['median_ms'] * (1 + threshold):
+      regressions.append({
+        'case': name,
+        'baseline_ms': before['median_ms'],
+        'median_ms': result['median_ms'],
+        'change': round(delta / before['median_ms'], 3) if before['median_ms'] else None,
+      })
+
+  return regressions
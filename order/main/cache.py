@@ -0,0 +1,117 @@
+"""
+  Response cache for the per-customer order lists.
+
+  Entries live in the 'orders' cache (see CACHES in settings) and are keyed by
+  view, customer, request URL and renderer, so every page, page size and format is
+  cached on its own (the ETag of a list names its format).
+  Every key also contains a per-customer version number. When one of the customer's
+  orders is created or changes status the version is incremented, which makes all
+  the cached lists of that customer unreachable at once; the old entries are
+  evicted by the backend when it reaches MAX_ENTRIES or the TIMEOUT expires.
+"""
+import hashlib
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+ORDERS_CACHE = 'orders'
+
+
+# In-process hit/miss counters, used to size the cache
+class CacheStats:
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def hit(self):
+    with self._lock:
+      self.hits += 1
+
+  def miss(self):
+    with self._lock:
+      self.misses += 1
+
+  def as_dict(self):
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+      }
+
+  def reset(self):
+    with self._lock:
+      self.hits = 0
+      self.misses = 0
+
+
+stats = CacheStats()
+
+
+def _cache():
+  return caches[ORDERS_CACHE]
+
+
+def _version_key(customer_id):
+  return f'orders:customer:{customer_id}:version'
+
+
+# A missing version starts at the current time in microseconds rather than 1, so a version
+# evicted by the backend can never come back as a number used by stale entries
+def _customer_version(customer_id):
+  cache = _cache()
+  key = _version_key(customer_id)
+
+  version = cache.get(key)
+  if version is None:
+    cache.add(key, int(time.time() * 1000000), timeout=None)
+    version = cache.get(key)
+
+  return version
+
+
+def _entry_key(view_name, customer_id, request):
+  url = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+  return f'orders:{view_name}:{customer_id}:{_customer_version(customer_id)}:{request.accepted_renderer.format}:{url}'
+
+
+# (key, cached data or None). On a miss the response is stored under that key, which
+# holds the customer version read before the orders: a change committed while they are
+# read increments the version, and the response stored under the old one is never served
+def get_customer_orders(view_name, customer_id, request):
+  key = _entry_key(view_name, customer_id, request)
+  data = _cache().get(key)
+
+  if data is None:
+    stats.miss()
+  else:
+    stats.hit()
+
+  return key, data
+
+
+def set_customer_orders(key, data):
+  _cache().set(key, data)
+
+
+def _increment_versions(customer_ids):
+  cache = _cache()
+
+  for customer_id in set(customer_ids):
+    try:
+      cache.incr(_version_key(customer_id))
+    except ValueError: # no version yet, nothing cached for this customer
+      pass
+
+
+# Runs once the transaction commits, otherwise a concurrent request could cache
+# the lists again before our changes are visible
+def invalidate_customer_orders(customer_ids):
+  customer_ids = list(customer_ids)
+  if customer_ids:
+    transaction.on_commit(lambda: _increment_versions(customer_ids))
@@ -0,0 +1,171 @@
+"""
+  Deterministic dataset for the benchmarks, used by the generate_orders command.
+
+  The same seed, sizes and end date always give the same rows. The orders are
+  skewed like production traffic:
+    customers: the customer of rank r gets a share of the orders proportional to
+      1 / r ** alpha, a few customers have thousands of orders and most have a handful
+    products: skewed the same way, each product has a fixed price
+    created_at: spread over the `days` days before end, fewer orders at night and on
+      weekends
+    status: the orders older than two weeks are Completed or Cancelled, the recent
+      ones are spread over every status like a live fulfilment queue
+
+  The rows are inserted with bulk_create, batch_size orders per transaction, without
+  the per-order bookkeeping. The customer summaries, the status counters and the
+  rollups are rebuilt once at the end; the change feed is left empty.
+"""
+import bisect
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import transaction
+
+from . import rollups
+from .models import (
+  ArchivedOrderCustomer, CustomerOrderSummary, DailyOrderRollup, HourlyOrderRollup, Order, OrderChange, OrderCustomer,
+  OrderItems, RollupWatermark, StatusCounter,
+)
+from .status import Status
+
+# Relative number of orders per hour of the day, UTC
+HOUR_WEIGHTS = (1, 1, 1, 1, 1, 2, 3, 5, 7, 8, 8, 8, 9, 9, 8, 8, 8, 8, 7, 6, 5, 4, 3, 2)
+WEEKEND_WEIGHT = 0.6
+
+ITEM_COUNTS = (1, 2, 3, 4, 5)
+ITEM_COUNT_WEIGHTS = (40, 30, 15, 10, 5)
+
+OPEN_STATUSES = [status.value for status in Status]
+OPEN_STATUS_WEIGHTS = (30, 20, 15, 15, 15, 5)
+RECENT = timedelta(days=14)
+CANCELLED_SHARE = 0.1
+
+CENTS = Decimal('0.01')
+
+
+# Draws ranks 0..size-1 with probability proportional to 1 / (rank + 1) ** alpha
+class PowerLaw:
+
+  def __init__(self, size, alpha):
+    self.cumulative = []
+    total = 0.0
+    for rank in range(size):
+      total += 1 / (rank + 1) ** alpha
+      self.cumulative.append(total)
+
+  def draw(self, rng):
+    return bisect.bisect_left(self.cumulative, rng.random() * self.cumulative[-1])
+
+
+# auto_now and auto_now_add would overwrite the generated timestamps on insert
+@contextmanager
+def _timestamps_as_given():
+  fields = [Order._meta.get_field('created_at'), Order._meta.get_field('last_updated')]
+  flags = [(field.auto_now, field.auto_now_add) for field in fields]
+
+  for field in fields:
+    field.auto_now = field.auto_now_add = False
+  try:
+    yield
+  finally:
+    for field, (auto_now, auto_now_add) in zip(fields, flags):
+      field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def clear():
+  with transaction.atomic():
+    OrderCustomer.objects.all().delete() # and the orders, items and summaries
+    ArchivedOrderCustomer.objects.all().delete()
+    for model in (StatusCounter, HourlyOrderRollup, DailyOrderRollup, RollupWatermark, OrderChange):
+      model.objects.all().delete()
+
+
+class DatasetGenerator:
+
+  def __init__(self, orders, customers, products=5000, days=730, alpha=1.1, seed=1, end=None, batch_size=5000):
+    self.orders = orders
+    self.customers = customers
+    self.products = products
+    self.days = days
+    self.seed = seed
+    self.end = end or datetime.combine(datetime.now(dt_timezone.utc).date(), time.min, tzinfo=dt_timezone.utc)
+    self.batch_size = batch_size
+    self.customer_ranks = PowerLaw(customers, alpha)
+    self.product_ranks = PowerLaw(products, alpha)
+
+  """
+    Inserts the customers and the orders, then rebuilds the derived tables.
+    on_batch(orders written so far) is called after every batch
+  """
+  def run(self, on_batch=None):
+    rng = random.Random(self.seed)
+    customer_ids = self._create_customers()
+
+    written = 0
+    with _timestamps_as_given():
+      while written < self.orders:
+        size = min(self.batch_size, self.orders - written)
+        with transaction.atomic():
+          self._create_orders(rng, customer_ids, size)
+        written += size
+        if on_batch is not None:
+          on_batch(written)
+
+    CustomerOrderSummary.objects.rebuild()
+    StatusCounter.objects.reconcile()
+    rollups.refresh(full=True)
+
+  def _create_customers(self):
+    customers = []
+    for offset in range(0, self.customers, self.batch_size):
+      customers += OrderCustomer.objects.bulk_create([
+        OrderCustomer(customer_id=number, name=f'Customer {number}', email=f'customer{number}@example.com')
+        for number in range(offset + 1, min(offset + self.batch_size, self.customers) + 1)
+      ])
+    return [customer.id for customer in customers]
+
+  def _create_orders(self, rng, customer_ids, size):
+    orders, items = [], []
+
+    for _ in range(size):
+      created_at = self._created_at(rng)
+      status, last_updated = self._status(rng, created_at)
+      lines = [self._item(rng) for _ in range(rng.choices(ITEM_COUNTS, ITEM_COUNT_WEIGHTS)[0])]
+
+      orders.append(Order(
+        order_customer_id=customer_ids[self.customer_ranks.draw(rng)],
+        totals=sum(item.quantity * item.price_per_unit for item in lines),
+        created_at=created_at, last_updated=last_updated, status=status))
+      items.append(lines)
+
+    Order.objects.bulk_create(orders)
+    for order, lines in zip(orders, items):
+      for item in lines:
+        item.order = order
+    OrderItems.objects.bulk_create([item for lines in items for item in lines])
+
+  def _created_at(self, rng):
+    while True:
+      day = self.end - timedelta(days=rng.randrange(self.days) + 1)
+      if day.weekday() < 5 or rng.random() < WEEKEND_WEIGHT:
+        break
+
+    hour = rng.choices(range(24), HOUR_WEIGHTS)[0]
+    return day + timedelta(hours=hour, seconds=rng.randrange(3600), microseconds=rng.randrange(1000000))
+
+  def _status(self, rng, created_at):
+    if self.end - created_at > RECENT:
+      status = Status.Cancelled.value if rng.random() < CANCELLED_SHARE else Status.Completed.value
+      return status, created_at + timedelta(hours=rng.randrange(1, 240))
+
+    status = rng.choices(OPEN_STATUSES, OPEN_STATUS_WEIGHTS)[0]
+    last_updated = created_at if status == Status.Received.value else created_at + timedelta(minutes=rng.randrange(1, 600))
+    return status, min(last_updated, self.end)
+
+  def _item(self, rng):
+    product = self.product_ranks.draw(rng) + 1
+    return OrderItems(
+      product_id=product, name=f'Product {product}', quantity=rng.choice((1, 1, 1, 2, 3)),
+      price_per_unit=(Decimal(100 + product * 7919 % 20000) / 100).quantize(CENTS))
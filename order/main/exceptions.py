@@ -23,4 +23,15 @@ class OrderCancellationError(Exception):
   pass
 
 class OrderNotFoundError(Exception):
-  pass
\ No newline at end of file
+  pass
+
+# Raised when the order was changed by another request after we read it
+class OrderConcurrentUpdateError(Exception):
+
+  def __init__(self, order):
+    message = f'The order with ID {order} was modified by another request'
+    super().__init__(message)
+
+# Raised when a search has no criterion an index can serve (see search.py)
+class SearchPlanError(Exception):
+  pass
@@ -0,0 +1,66 @@
+"""
+  Generators used to stream an export of orders to the client.
+
+  The orders are read from the database in chunks with .iterator(), the items of
+  each chunk are prefetched with one query, and every order is written out as
+  soon as it is read. Memory use therefore depends on the chunk size only, not on
+  how many orders the export covers.
+"""
+import csv
+import heapq
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from .managers import OrdersWithArchive
+from .serializers import OrderSerializer
+
+EXPORT_CHUNK_SIZE = 2000
+
+CSV_HEADER = (
+  'order_id', 'created_at', 'status', 'totals',
+  'customer_id', 'customer_name', 'customer_email',
+  'product_id', 'item_name', 'quantity', 'price_per_unit',
+)
+
+
+# csv.writer wants a file object, this one hands the formatted line back
+# to us instead of buffering it
+class _Echo:
+  def write(self, value):
+    return value
+
+
+# The live and archived orders of an OrdersWithArchive are merged, both are ordered by created_at and id
+def _iter_orders(queryset):
+  if isinstance(queryset, OrdersWithArchive):
+    return heapq.merge(*(_iter_orders(source) for source in queryset.sources), key=lambda order: (order.created_at, order.id))
+
+  return queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+# One JSON document per line, with the same shape as the list endpoints
+def iter_ndjson(queryset):
+  encoder = JSONEncoder()
+
+  for order in _iter_orders(queryset):
+    yield encoder.encode(OrderSerializer(order).data) + '\n'
+
+
+# One row per order item, orders without items get a single row with empty item columns
+def iter_csv(queryset):
+  writer = csv.writer(_Echo())
+  yield writer.writerow(CSV_HEADER)
+
+  for order in _iter_orders(queryset):
+    customer = order.order_customer
+    columns = (
+      order.id, order.created_at.isoformat(), order.get_status_display(), order.totals,
+      customer.customer_id, customer.name, customer.email,
+    )
+
+    items = order.items.all()
+    if not items:
+      yield writer.writerow(columns + ('',) * 4)
+
+    for item in items:
+      yield writer.writerow(columns + (item.product_id, item.name, item.quantity, item.price_per_unit))
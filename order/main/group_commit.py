@@ -0,0 +1,133 @@
+"""
+  Group commit for order creation.
+
+  SQLite has a single writer and every commit syncs to disk, so concurrent
+  CreateOrderView requests that each commit their own transaction queue up on the
+  database lock. With ORDER_GROUP_COMMIT enabled, the requests hand their validated
+  orders to one writer thread instead. It inserts everything that is queued with the
+  bulk path of OrderListSerializer, in one transaction, as soon as MAX_BATCH orders
+  are waiting or MAX_DELAY_MS after the first one arrived, and every request gets
+  its own order id back.
+
+  When a batch fails its orders are retried one at a time, so only the request
+  whose order can't be written gets the error. A request that waited TIMEOUT for an
+  order still queued cancels it and gets a 503, the writer skips it, so a retry
+  can't create it twice. An order already taken by the writer is waited for.
+
+  Configured with the ORDER_GROUP_COMMIT setting:
+    ENABLED: off by default, the request thread creates its order
+    MAX_BATCH: max orders per transaction
+    MAX_DELAY_MS: how long the first order of a batch waits for others
+    TIMEOUT: seconds a request waits for its order id
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework import status
+
+from . import idempotency
+from .models import IdempotencyKey
+from .serializers import OrderSerializer
+
+
+# (validated_data of OrderSerializer, unsaved IdempotencyKey or None) pairs -> ids of the
+# new orders, in the same order. The keys are saved in the same transaction as the orders
+def create_orders(batch):
+  keys = [key.key for _, key in batch if key is not None]
+
+  with transaction.atomic():
+    orders = OrderSerializer(many=True).create([validated_data for validated_data, _ in batch])
+    if keys:
+      idempotency.delete_expired(keys)
+    IdempotencyKey.objects.bulk_create([
+      idempotency.record(key, status.HTTP_201_CREATED, { 'order_id': order.id })
+      for (_, key), order in zip(batch, orders) if key is not None
+    ])
+
+  return [order.id for order in orders]
+
+
+class GroupCommitWriter:
+
+  def __init__(self, flush=create_orders, enabled=False, max_batch=100, max_delay_ms=5, timeout=30):
+    self.flush = flush
+    self.enabled = enabled
+    self.max_batch = max_batch
+    self.max_delay = max_delay_ms / 1000
+    self.timeout = timeout
+    self._queue = queue.Queue()
+    self._thread = None
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_settings(cls):
+    return cls(**{key.lower(): value for key, value in getattr(settings, 'ORDER_GROUP_COMMIT', {}).items()})
+
+  # Queues one order and waits for the batch it ends up in, order is what flush takes
+  # a list of. Returns the result of flush for it (the order id), or raises its error.
+  # TimeoutError only when the order was not written and never will be: it is cancelled
+  # while still queued, and once the writer took it the wait goes on until it is written
+  def submit(self, order):
+    future = Future()
+    self._start()
+    self._queue.put((order, future))
+
+    try:
+      return future.result(timeout=self.timeout)
+    except TimeoutError:
+      if future.cancel():
+        raise
+      return future.result()
+
+  def _start(self):
+    with self._lock:
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='order-group-commit', daemon=True)
+        self._thread.start()
+
+  def _run(self):
+    while True:
+      self._write(self._next_batch())
+
+  def _next_batch(self):
+    batch = [self._queue.get()]
+    deadline = time.monotonic() + self.max_delay
+
+    while len(batch) < self.max_batch:
+      remaining = deadline - time.monotonic()
+      try:
+        batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+      except queue.Empty:
+        break
+
+    return batch
+
+  def _write(self, batch):
+    # the orders whose request timed out are skipped, the others can't be cancelled anymore
+    batch = [(data, future) for data, future in batch if future.set_running_or_notify_cancel()]
+    if not batch:
+      return
+
+    try:
+      results = self.flush([data for data, _ in batch])
+    except Exception:
+      connection.close() # it may be left unusable, the next batch opens a new one
+      for data, future in batch:
+        self._write_one(data, future)
+    else:
+      for (_, future), result in zip(batch, results):
+        future.set_result(result)
+
+  def _write_one(self, data, future):
+    try:
+      future.set_result(self.flush([data])[0])
+    except Exception as err:
+      connection.close()
+      future.set_exception(err)
+
+
+writer = GroupCommitWriter.from_settings()
@@ -0,0 +1,125 @@
+"""
+  Idempotency keys for order creation.
+
+  A client retrying a create request sends the same Idempotency-Key header, or the
+  same order_id in the body as send_order.py does. The first request stores its
+  response in IdempotencyKey, in the transaction that creates the order. The unique
+  index on (user, key) makes a concurrent duplicate fail and roll back instead of
+  creating a second order. Retries are answered from the stored response with one
+  query, without validating or inserting anything. Reusing a key for a different
+  body is rejected with 422. Only successful responses are stored, a request that
+  failed validation can be fixed and sent again with the same key.
+
+  Stored responses are replayed for TTL seconds. The expired keys are deleted by a
+  background thread every PURGE_INTERVAL seconds, or by the purge_idempotency_keys
+  command.
+
+  Configured with the IDEMPOTENCY_KEYS setting:
+    TTL: seconds a stored response is replayed
+    PURGE_INTERVAL: seconds between two purges in the background, 0 to rely on the command
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .exceptions import InvalidArgumentError
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+_purger = None
+_purger_lock = threading.Lock()
+
+
+def _settings():
+  return {'TTL': 86400, 'PURGE_INTERVAL': 600, **getattr(settings, 'IDEMPOTENCY_KEYS', {})}
+
+
+# The header, or the order_id of the body. None when the request has neither
+def get_key(request):
+  key = request.headers.get(HEADER)
+
+  if key is None and isinstance(request.data, dict) and request.data.get('order_id') is not None:
+    key = str(request.data['order_id'])
+
+  if key is not None and not 0 < len(key) <= MAX_KEY_LENGTH:
+    raise InvalidArgumentError('Idempotency-Key')
+
+  return key
+
+
+def fingerprint(request):
+  data = dict(request.data.lists()) if hasattr(request.data, 'lists') else request.data
+  return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+# The stored response of the key, or None when it has none (or it expired)
+def replay(user, key, request_fingerprint):
+  stored = IdempotencyKey.objects.filter(user=user, key=key, expires_at__gt=timezone.now()).first()
+
+  if stored is None:
+    return None
+
+  if stored.fingerprint != request_fingerprint:
+    return Response(f'The {HEADER} {key} was used for another request.', status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+  response = Response(json.loads(stored.response), status=stored.status_code)
+  response[REPLAYED_HEADER] = 'true'
+  return response
+
+
+# Unsaved key, saved with its response by record()
+def new_key(user, key, request_fingerprint):
+  return IdempotencyKey(
+    user=user, key=key, fingerprint=request_fingerprint,
+    expires_at=timezone.now() + timedelta(seconds=_settings()['TTL']))
+
+
+def record(idempotency_key, status_code, data):
+  idempotency_key.status_code = status_code
+  idempotency_key.response = json.dumps(data)
+  return idempotency_key
+
+
+# An expired key still holds its place in the unique index until it is purged, this
+# frees the keys about to be saved (the expired ones of any user, they are of no use)
+def delete_expired(keys):
+  return IdempotencyKey.objects.filter(key__in=keys, expires_at__lte=timezone.now()).delete()[0]
+
+
+def purge_expired():
+  return IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+def start_purger():
+  global _purger
+  interval = _settings()['PURGE_INTERVAL']
+
+  if not interval:
+    return
+
+  with _purger_lock:
+    if _purger is None:
+      _purger = threading.Thread(target=_purge_forever, args=(interval,), name='idempotency-purge', daemon=True)
+      _purger.start()
+
+
+def _purge_forever(interval):
+  while True:
+    time.sleep(interval)
+    try:
+      purge_expired()
+    except DatabaseError: # e.g. the database is locked, there is always a next time
+      pass
+    finally:
+      close_old_connections()
@@ -0,0 +1,204 @@
+"""
+  Bulk import of historical orders, used by the import_orders command.
+
+  The input is read as a stream, one record at a time:
+    ndjson: one order per line, shaped like the list endpoints and the NDJSON export
+    csv: one row per item with the columns of the CSV export, the rows of an order
+      one after the other
+
+  Every record is validated with the OrderSerializer field rules, plus its status
+  (display name or value, Received when missing) and created_at (ISO 8601, the import
+  time when missing). The ids of the source system are not kept. The valid orders are
+  written chunk_size at a time by the bulk path of OrderListSerializer, in one
+  transaction per chunk, so the customer summaries, the status counters and the change
+  feed are kept up to date as for new orders. Only one chunk is held in memory
+  whatever the size of the input. last_updated is the import time, the next
+  refresh_order_rollups picks the imported hours up.
+
+  The transaction of a chunk also saves the position reached in the input to the
+  ImportCheckpoint of the import. Run again under the same name after an
+  interruption, the import skips the records consumed by the chunks already
+  committed, so no order is written twice.
+"""
+import csv
+import json
+import time
+
+from django.db import reset_queries, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ImportCheckpoint, Order
+from .serializers import OrderSerializer
+from .status import Status
+
+CHUNK_SIZE = 1000
+
+CSV_COLUMNS = (
+  'order_id', 'created_at', 'status', 'totals',
+  'customer_id', 'customer_name', 'customer_email',
+  'product_id', 'item_name', 'quantity', 'price_per_unit',
+)
+
+STATUSES = {label.lower(): value for value, label in Order.ORDER_STATUS}
+
+
+# (record, None) per line, or (None, error) when the line is not JSON
+def iter_ndjson(stream):
+  for line in stream:
+    if not line.strip():
+      continue
+
+    try:
+      yield json.loads(line), None
+    except ValueError:
+      yield None, 'invalid JSON'
+
+
+# (record, None) per order, built from its consecutive rows. An order without items
+# has one row with empty item columns, as the CSV export writes it
+def iter_csv(stream):
+  reader = csv.DictReader(stream)
+  missing = [column for column in CSV_COLUMNS if column not in (reader.fieldnames or ())]
+  if missing:
+    raise ValueError(f'Missing CSV columns: {", ".join(missing)}')
+
+  order, key = None, None
+
+  for row in reader:
+    if order is not None and (row['order_id'] != key or not key):
+      yield order, None
+      order = None
+
+    if order is None:
+      key = row['order_id']
+      order = {
+        'created_at': row['created_at'] or None,
+        'status': row['status'] or None,
+        'totals': row['totals'],
+        'order_customer': {'customer_id': row['customer_id'], 'name': row['customer_name'], 'email': row['customer_email']},
+        'items': [],
+      }
+
+    if row['product_id']:
+      order['items'].append({
+        'product_id': row['product_id'], 'name': row['item_name'],
+        'quantity': row['quantity'], 'price_per_unit': row['price_per_unit'],
+      })
+
+  if order is not None:
+    yield order, None
+
+
+# Status value from its display name or value, None when invalid
+def _status(value):
+  if value is None:
+    return Status.Received.value
+
+  if isinstance(value, str) and value.lower() in STATUSES:
+    return STATUSES[value.lower()]
+
+  try:
+    return Status(int(value)).value
+  except (TypeError, ValueError):
+    return None
+
+
+# Aware datetime from ISO 8601, naive ones are in the current time zone. None when invalid
+def _created_at(value):
+  try:
+    created_at = parse_datetime(value) if isinstance(value, str) else None
+  except ValueError:
+    return None
+
+  if created_at is None or timezone.is_aware(created_at):
+    return created_at
+
+  return timezone.make_aware(created_at)
+
+
+# (validated data for OrderListSerializer, None) or (None, errors)
+def validate(record):
+  if not isinstance(record, dict):
+    return None, 'not an object'
+
+  serializer = OrderSerializer(data=record)
+  if not serializer.is_valid():
+    return None, serializer.errors
+
+  data = dict(serializer.validated_data)
+
+  data['status'] = _status(record.get('status'))
+  if data['status'] is None:
+    return None, {'status': ['Not a valid status.']}
+
+  if record.get('created_at') is not None:
+    data['created_at'] = _created_at(record['created_at'])
+    if data['created_at'] is None:
+      return None, {'created_at': ['Not a valid ISO 8601 datetime.']}
+
+  return data, None
+
+
+class OrderImport:
+
+  def __init__(self, name, chunk_size=CHUNK_SIZE, restart=False):
+    self.chunk_size = chunk_size
+    self.checkpoint, _ = ImportCheckpoint.objects.get_or_create(name=name)
+    self.imported = 0 # by this run
+
+    if restart:
+      self.checkpoint.position = self.checkpoint.imported = self.checkpoint.rejected = 0
+      self.checkpoint.save()
+
+  """
+    Imports the (record, error) pairs of iter_ndjson or iter_csv, from the checkpoint on.
+    on_chunk(self) is called after each chunk is committed, on_reject(position, errors)
+    for each invalid record. Returns the checkpoint
+  """
+  def run(self, records, on_chunk=None, on_reject=None):
+    self.started = time.monotonic()
+    skip = self.checkpoint.position
+    chunk, position = [], 0
+
+    for record, error in records:
+      position += 1
+      if position <= skip:
+        continue
+
+      data, error = (None, error) if error is not None else validate(record)
+      if error is not None:
+        self.checkpoint.rejected += 1
+        if on_reject is not None:
+          on_reject(position, error)
+      else:
+        chunk.append(data)
+
+      if len(chunk) >= self.chunk_size:
+        self._write(chunk, position, on_chunk)
+        chunk = []
+
+    if position > self.checkpoint.position:
+      self._write(chunk, position, on_chunk)
+
+    return self.checkpoint
+
+  # Orders imported per second by this run
+  @property
+  def rate(self):
+    elapsed = time.monotonic() - self.started
+    return self.imported / elapsed if elapsed > 0 else 0.0
+
+  def _write(self, chunk, position, on_chunk):
+    with transaction.atomic():
+      if chunk:
+        OrderSerializer(many=True).create(chunk)
+
+      self.checkpoint.position = position
+      self.checkpoint.imported += len(chunk)
+      self.checkpoint.save()
+
+    self.imported += len(chunk)
+    reset_queries() # with DEBUG the connection keeps the SQL of every insert
+    if on_chunk is not None:
+      on_chunk(self)
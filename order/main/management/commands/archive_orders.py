@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main.models import ArchivedOrder
+
+
+# Moves the Completed and Cancelled orders that have not changed for --days days to the
+# archive tables. Meant to run periodically, e.g. nightly from cron
+class Command(BaseCommand):
+  help = 'Move old Completed and Cancelled orders, with their items and customers, to the archive tables'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--days', type=int, default=90, help='Archive the orders last updated more than this many days ago')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Orders moved per transaction')
+
+  def handle(self, *args, **options):
+    if options['days'] < 0 or options['chunk_size'] <= 0:
+      raise CommandError('--days must be positive or zero and --chunk-size positive')
+
+    before = timezone.now() - timedelta(days=options['days'])
+    archived = ArchivedOrder.objects.archive(before, chunk_size=options['chunk_size'])
+    self.stdout.write(self.style.SUCCESS(f'Archived {archived} orders'))
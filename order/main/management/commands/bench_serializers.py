@@ -0,0 +1,96 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from main.models import Order, OrderCustomer, OrderItems
+from main.serializers import OrderSerializer, OrderValuesSerializer
+
+
+class _Rollback(Exception):
+  pass
+
+
+"""
+  Compares OrderSerializer with the OrderValuesSerializer fast path on lists of
+  N orders (query + serialization + JSON rendering). The orders are created in a
+  transaction that is rolled back at the end, the database is left untouched.
+
+  e.g. python manage.py bench_serializers --sizes 1000,10000,100000
+"""
+class Command(BaseCommand):
+  help = 'Benchmark OrderSerializer against the values() based OrderValuesSerializer'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma separated numbers of orders')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per size, the best one is reported')
+    parser.add_argument('--seed', type=int, default=1)
+
+  def handle(self, *args, **options):
+    sizes = [int(size) for size in options['sizes'].split(',')]
+    results = []
+
+    try:
+      with transaction.atomic():
+        created = 0
+        rng = random.Random(options['seed'])
+
+        for size in sorted(sizes):
+          self._create_orders(rng, size - created)
+          created = size
+
+          orders = Order.objects.with_details().order_by('id')[:size]
+          results.append(self._compare(size, orders, options['repeat']))
+
+        raise _Rollback()
+    except _Rollback:
+      pass
+
+    self.stdout.write(json.dumps(results, indent=2))
+
+  def _compare(self, size, orders, repeat):
+    renderer = JSONRenderer()
+
+    serializer_time, serializer_output = self._best(repeat, lambda: renderer.render(OrderSerializer(orders, many=True).data))
+    values_time, values_output = self._best(
+      repeat, lambda: renderer.render(OrderValuesSerializer(list(OrderValuesSerializer.prepare(orders))).data))
+
+    return {
+      'orders': size,
+      'order_serializer_seconds': round(serializer_time, 4),
+      'values_serializer_seconds': round(values_time, 4),
+      'speedup': round(serializer_time / values_time, 2),
+      'identical_output': serializer_output == values_output,
+    }
+
+  @staticmethod
+  def _best(repeat, run):
+    best = None
+    for _ in range(repeat):
+      start = time.perf_counter()
+      output = run()
+      elapsed = time.perf_counter() - start
+      best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+  @staticmethod
+  def _create_orders(rng, count, batch_size=5000):
+    for offset in range(0, count, batch_size):
+      batch = min(batch_size, count - offset)
+
+      customers = OrderCustomer.objects.bulk_create([
+        OrderCustomer(customer_id=rng.randint(1, 100000), name='Customer', email='customer@mail.com')
+        for _ in range(batch)
+      ])
+      orders = Order.objects.bulk_create([
+        Order(order_customer=customer, totals=rng.randint(1, 100000) / 100, status=rng.randint(1, 6))
+        for customer in customers
+      ])
+      OrderItems.objects.bulk_create([
+        OrderItems(order=order, product_id=rng.randint(1, 1000), name='Product', quantity=rng.randint(1, 5), price_per_unit=rng.randint(1, 10000) / 100)
+        for order in orders
+        for _ in range(rng.randint(1, 4))
+      ])
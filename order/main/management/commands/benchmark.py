@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import benchmarks
+
+
+# Times the OrderManager methods and the API routes on the current database, e.g.
+#   python manage.py generate_orders --orders 1000000 --clear
+#   python manage.py benchmark --output baseline.json
+#   python manage.py benchmark --baseline baseline.json --output current.json
+# With --baseline it fails when a case got slower than --threshold. See benchmarks.py
+class Command(BaseCommand):
+  help = 'Benchmark every OrderManager method and API route, and compare with a saved baseline'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case, after a warm up run')
+    parser.add_argument('--only', help='Run the cases whose name contains this')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--baseline', help='Report of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Relative slowdown of the median flagged as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='Slowdowns of less than this many ms are ignored')
+
+  def handle(self, *args, **options):
+    if options['repeat'] <= 0:
+      raise CommandError('--repeat must be positive')
+
+    missing = benchmarks.uncovered()
+    if missing:
+      self.stderr.write(f'No benchmark case for: {", ".join(missing)}')
+
+    baseline = None
+    if options['baseline']:
+      with open(options['baseline']) as source:
+        baseline = json.load(source)
+
+    try:
+      report = benchmarks.run(repeat=options['repeat'], only=options['only'], on_case=self._progress)
+    except benchmarks.BenchmarkError as err:
+      raise CommandError(str(err))
+
+    if baseline is not None:
+      report['regressions'] = benchmarks.compare(report, baseline, options['threshold'], options['min_delta_ms'])
+
+    if options['output']:
+      with open(options['output'], 'w') as output:
+        json.dump(report, output, indent=2)
+    else:
+      self.stdout.write(json.dumps(report, indent=2))
+
+    for regression in report.get('regressions', []):
+      change = 'n/a' if regression['change'] is None else f'+{regression["change"]:.0%}'
+      self.stderr.write(f'{regression["case"]}: {regression["baseline_ms"]} ms -> {regression["median_ms"]} ms ({change})')
+    if report.get('regressions'):
+      raise CommandError(f'{len(report["regressions"])} cases are slower than the baseline')
+
+    self.stderr.write(self.style.SUCCESS(f'Ran {len(report["cases"])} benchmark cases'))
+
+  def _progress(self, name, result):
+    self.stderr.write(f'{name}: {result["median_ms"]} ms, {result["queries"]} queries')
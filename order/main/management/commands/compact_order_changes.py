@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main.models import OrderChange
+
+
+# Deletes the change feed entries older than the retention. Meant to run periodically,
+# e.g. nightly from cron; consumers further behind than that get a 410 and resync
+class Command(BaseCommand):
+  help = 'Delete the order change feed entries older than the retention period'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--days', type=int, default=getattr(settings, 'ORDER_CHANGE_FEED', {}).get('RETENTION_DAYS', 7),
+      help='Keep the changes of the last this many days')
+
+  def handle(self, *args, **options):
+    if options['days'] < 0:
+      raise CommandError('--days must be positive or zero')
+
+    deleted = OrderChange.objects.compact(timezone.now() - timedelta(days=options['days']))
+    self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} order changes'))
@@ -0,0 +1,55 @@
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from main import dataset
+from main.models import ArchivedOrder, Order
+
+
+# Fills the database with a deterministic, skewed dataset for the benchmark command, e.g.
+#   python manage.py generate_orders --orders 2000000 --customers 100000 --clear
+# The same options always give the same rows, see dataset.py
+class Command(BaseCommand):
+  help = 'Generate a large deterministic dataset of orders for benchmarks'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--orders', type=int, default=1000000, help='Number of orders')
+    parser.add_argument('--customers', type=int, default=50000, help='Number of customers')
+    parser.add_argument('--products', type=int, default=5000, help='Number of products')
+    parser.add_argument('--days', type=int, default=730, help='The orders are created over this many days')
+    parser.add_argument('--alpha', type=float, default=1.1, help='Exponent of the power law of the orders per customer')
+    parser.add_argument('--end-date', help='Day after the last order, YYYY-MM-DD, today (UTC) by default')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=5000, help='Orders inserted per transaction')
+    parser.add_argument('--clear', action='store_true', help='Delete all the orders and the data derived from them first')
+
+  def handle(self, *args, **options):
+    if min(options['orders'], options['customers'], options['products'], options['days'], options['batch_size']) <= 0:
+      raise CommandError('--orders, --customers, --products, --days and --batch-size must be positive')
+
+    end = None
+    if options['end_date']:
+      day = parse_date(options['end_date'])
+      if day is None:
+        raise CommandError('--end-date must be a date, YYYY-MM-DD')
+      end = datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
+
+    if options['clear']:
+      dataset.clear()
+    elif Order.objects.exists() or ArchivedOrder.objects.exists():
+      raise CommandError('The database already has orders, use --clear to replace them')
+
+    generator = dataset.DatasetGenerator(
+      options['orders'], options['customers'], products=options['products'], days=options['days'],
+      alpha=options['alpha'], seed=options['seed'], end=end, batch_size=options['batch_size'])
+
+    started = time.monotonic()
+
+    def progress(written):
+      self.stdout.write(f'{written} orders, {written / (time.monotonic() - started):.0f} orders/s')
+
+    generator.run(on_batch=progress)
+    self.stdout.write(self.style.SUCCESS(
+      f'Generated {options["orders"]} orders of {options["customers"]} customers in {time.monotonic() - started:.1f}s'))
@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importer import CHUNK_SIZE, OrderImport, iter_csv, iter_ndjson
+
+READERS = {
+  'ndjson': iter_ndjson,
+  'csv': iter_csv,
+}
+
+
+# Backfills historical orders in chunked transactions, e.g.
+#   python manage.py import_orders orders.ndjson
+#   gunzip -c orders.csv.gz | python manage.py import_orders - --format csv --name orders-2019
+# After an interruption, run it again with the same name and it carries on from the
+# last chunk written. See importer.py
+class Command(BaseCommand):
+  help = 'Import historical orders from an NDJSON or CSV file, or from stdin'
+
+  def add_arguments(self, parser):
+    parser.add_argument('path', help='File to import, - for stdin')
+    parser.add_argument('--format', choices=sorted(READERS),
+      help='Input format, from the file extension by default (ndjson for stdin)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Orders written per transaction')
+    parser.add_argument('--name', help='Name of the checkpoint, the absolute path of the file by default (stdin for stdin)')
+    parser.add_argument('--restart', action='store_true',
+      help='Ignore the checkpoint and import from the first record, orders already imported are imported again')
+
+  def handle(self, *args, **options):
+    if options['chunk_size'] <= 0:
+      raise CommandError('--chunk-size must be positive')
+
+    path = options['path']
+    input_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    name = options['name'] or ('stdin' if path == '-' else os.path.abspath(path))
+
+    stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+      job = OrderImport(name, chunk_size=options['chunk_size'], restart=options['restart'])
+      if job.checkpoint.position:
+        self.stdout.write(f'Resuming {name} after record {job.checkpoint.position}')
+
+      checkpoint = job.run(READERS[input_format](stream), on_chunk=self._progress, on_reject=self._reject)
+    except ValueError as err: # missing CSV columns, or not text in the encoding
+      raise CommandError(str(err))
+    finally:
+      if stream is not sys.stdin:
+        stream.close()
+
+    self.stdout.write(self.style.SUCCESS(
+      f'Imported {checkpoint.imported} orders, rejected {checkpoint.rejected} of {checkpoint.position} records'))
+
+  def _progress(self, job):
+    checkpoint = job.checkpoint
+    self.stdout.write(
+      f'{checkpoint.position} records read, {checkpoint.imported} imported, {checkpoint.rejected} rejected, {job.rate:.0f} orders/s')
+
+  def _reject(self, position, errors):
+    self.stderr.write(f'Record {position} rejected: {json.dumps(errors)}')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from main.idempotency import purge_expired
+
+
+# The server purges the expired keys in the background, this does it on demand,
+# e.g. from cron when IDEMPOTENCY_KEYS['PURGE_INTERVAL'] is 0
+class Command(BaseCommand):
+  help = 'Delete the expired idempotency keys of the create order requests'
+
+  def handle(self, *args, **options):
+    self.stdout.write(self.style.SUCCESS(f'Deleted {purge_expired()} expired idempotency keys'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from main.models import CustomerOrderSummary
+
+
+# The summaries are maintained incrementally, this recomputes all of them from the
+# orders, e.g. after loading orders directly into the database
+class Command(BaseCommand):
+  help = 'Rebuild the per-customer order summaries from scratch'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--chunk-size', type=int, default=2000, help='Customers written per bulk insert')
+
+  def handle(self, *args, **options):
+    rebuilt = CustomerOrderSummary.objects.rebuild(chunk_size=options['chunk_size'])
+    self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} customer summaries'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from main.models import StatusCounter
+
+
+# The counters are maintained incrementally, this compares them with the orders
+# and repairs the ones that drifted, e.g. after orders were changed directly in the database
+class Command(BaseCommand):
+  help = 'Check the per-status order counters against the orders and repair any drift'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--dry-run', action='store_true', help='Only report the drift, leave the counters as they are')
+
+  def handle(self, *args, **options):
+    drift = StatusCounter.objects.reconcile(repair=not options['dry_run'])
+
+    if not drift:
+      self.stdout.write(self.style.SUCCESS('The status counters match the orders'))
+      return
+
+    for status, recorded, actual in drift:
+      recorded = 'missing' if recorded is None else recorded
+      self.stdout.write(f'{status.name}: counter {recorded}, orders {actual}')
+
+    if options['dry_run']:
+      self.stdout.write(self.style.WARNING(f'{len(drift)} status counters drifted'))
+    else:
+      self.stdout.write(self.style.SUCCESS(f'Repaired {len(drift)} status counters'))
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from main import rollups
+
+
+# Meant to run periodically, e.g. every few minutes from cron. Each run only
+# recomputes the hours with orders created or transitioned since the previous one
+class Command(BaseCommand):
+  help = 'Refresh the hourly and daily order rollups from the orders changed since the last run'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--lag', type=float, default=60,
+      help='Seconds the watermark stays behind the start of the run, to catch slow transactions')
+    parser.add_argument('--full', action='store_true', help='Recompute every bucket instead of the changed ones')
+
+  def handle(self, *args, **options):
+    hours, days = rollups.refresh(lag=timedelta(seconds=options['lag']), full=options['full'])
+    self.stdout.write(self.style.SUCCESS(f'Refreshed {hours} hourly and {days} daily buckets'))
@@ -1,42 +1,39 @@
+from collections import defaultdict
 from datetime import datetime
-from django.db.models import Q, Manager
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from django.db import transaction
+from django.db.models import BooleanField, Case, Count, DateTimeField, F, Manager, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 
-from .models import models
+from . import search
+from .cache import invalidate_customer_orders
 from .status import Status
 from .exceptions import InvalidArgumentError
+from .exceptions import OrderAlreadyCancelledError
 from .exceptions import OrderAlreadyCompletedError
 from .exceptions import OrderCancellationError
+from .exceptions import OrderConcurrentUpdateError
 
-class OrderManager(Manager):
+"""
+  The read methods of the orders, shared by OrderManager and ArchivedOrderManager: on
+  ArchivedOrder.objects they return the archived orders matching the same arguments,
+  with the same ordering. OrderManager.with_archive puts the two together.
+"""
+class OrderQueries:
 
-  # order is instance of Order and status is Item of Enum class Status
-  def set_status(self, order, status):
-    if status is None or not isinstance(status, Status):
-      raise InvalidArgumentError('status')
-
-    if order is None or not isinstance(order, models.Order):
-      raise InvalidArgumentError('order')
-
-    if order.status is Status.Completed.value: #Cant Modify already completed order
-      raise OrderAlreadyCompletedError()
-
-    order.status = status.value
-    order.save()
-
-  # allow orders to be canceled only if the status is Received
-  def cancel_order(self, order):
-    if order is None or not isinstance(order, models.Order):
-      raise InvalidArgumentError('order')
-    
-    if order.status != Status.Received.value:
-      raise OrderCancellationError()
-    
-    self.set_status(order, Status.Cancelled)
+  # Querysets shaped for OrderSerializer: the customer is joined in the same query
+  # and the items of every order are fetched with one extra query, instead of
+  # two queries per order when the serializer walks the relations
+  def with_details(self):
+    return self.select_related('order_customer').prefetch_related('items')
 
   # get a list of all orders for a given customer
   def get_all_orders_by_customer(self, customer_id):
     try:
-      return self.filter(order_customer_id=customer_id).order_by('status', '-created_at')
+      return self.with_details().filter(order_customer_id=customer_id).order_by('status', '-created_at', 'id')
     except ValueError:
       raise InvalidArgumentError('customer_id')
 
@@ -44,23 +41,23 @@ class OrderManager(Manager):
   def get_customer_incomplete_orders(self, customer_id):
     try:
       # ~ rep the NOT operator
-      return self.filter(~Q(status=Status.Completed.value), order_customer_id=customer_id).order_by('status')
+      return self.with_details().filter(~Q(status=Status.Completed.value), order_customer_id=customer_id).order_by('status', '-created_at', 'id')
     except:
       raise InvalidArgumentError('customer_id')
 
   # Get list of all complete orders
   def get_customer_completed_orders(self, customer_id):
     try:
-      return self.filter(status=Status.Completed.value, order_customer_id=customer_id)
+      return self.with_details().filter(status=Status.Completed.value, order_customer_id=customer_id).order_by('-created_at', 'id')
     except:
       raise InvalidArgumentError('customer_id')
 
   # Fetch orders at a given status
   def get_orders_by_status(self, status):
-    if status is None or not isinstance(status):
+    if status is None or not isinstance(status, Status):
       raise InvalidArgumentError('status')
 
-    return self.filter(status=status.value)
+    return self.with_details().filter(status=status.value).order_by('-created_at', 'id')
 
   # Get list of orders by a given date range
   def get_orders_by_period(self, start_date, end_date):
@@ -71,16 +68,550 @@ class OrderManager(Manager):
       raise InvalidArgumentError('end_date')
 
     # created_at__range means that we are going to pass a date range and it will be used as a filter
-    result = self.filter(created_at__range=[start_date, end_date])
+    result = self.with_details().filter(created_at__range=[start_date, end_date]).order_by('created_at', 'id')
     return result
 
-  # automatically changes the order to the next status:
-  def set_next_status(self, order):
-    if order is None or not isinstance(order, models.Order):
+  # Orders matching every given criterion, statuses is a list of Status items and the
+  # totals bounds are Decimals. The ordering follows the index picked by search.plan
+  def search(self, customer_id=None, statuses=None, start_date=None, end_date=None, min_totals=None, max_totals=None,
+             newest_first=True):
+    condition = Q()
+
+    if customer_id is not None:
+      if not isinstance(customer_id, int):
+        raise InvalidArgumentError('customer_id')
+      condition &= Q(order_customer_id=customer_id)
+
+    if statuses is not None:
+      if not statuses or not all(isinstance(status, Status) for status in statuses):
+        raise InvalidArgumentError('status')
+      statuses = sorted({status.value for status in statuses})
+      condition &= Q(status=statuses[0]) if len(statuses) == 1 else Q(status__in=statuses)
+
+    for name, value, lookup in (('start_date', start_date, 'created_at__gte'), ('end_date', end_date, 'created_at__lte')):
+      if value is not None:
+        if not isinstance(value, datetime):
+          raise InvalidArgumentError(name)
+        condition &= Q(**{lookup: value})
+
+    for name, value, lookup in (('min_totals', min_totals, 'totals__gte'), ('max_totals', max_totals, 'totals__lte')):
+      if value is not None:
+        if not isinstance(value, Decimal) or not value.is_finite():
+          raise InvalidArgumentError(name)
+        condition &= Q(**{lookup: value})
+
+    plan = search.plan(customer_id, statuses, start_date, end_date, newest_first)
+    return self.with_details().filter(condition).order_by(*plan.ordering)
+
+
+# The live and the archived orders of OrderManager.with_archive, two querysets with the
+# same filter and ordering: the list views page through both at once (see
+# OrderKeysetPagination) and the export merges them
+class OrdersWithArchive:
+
+  def __init__(self, live, archived):
+    self.live = live
+    self.archived = archived
+
+  @property
+  def sources(self):
+    return self.live, self.archived
+
+  # function applied to both querysets, e.g. map(lambda orders: orders.values('id'))
+  def map(self, function):
+    return OrdersWithArchive(function(self.live), function(self.archived))
+
+
+class OrderManager(OrderQueries, Manager):
+
+  # order is instance of Order and status is Item of Enum class Status
+  def set_status(self, order, status):
+    if status is None or not isinstance(status, Status):
+      raise InvalidArgumentError('status')
+
+    self._check_can_transition(order)
+    self._compare_and_set(order, status.value)
+
+  # allow orders to be canceled only if the status is Received
+  def cancel_order(self, order):
+    if order is None or not isinstance(order, self.model):
       raise InvalidArgumentError('order')
     
-    if order.status is Status.Completed.value:
-      raise OrderAlreadyCompletedError()
+    if order.status != Status.Received.value:
+      raise OrderCancellationError()
     
-    order.status += 1
-    order.save()
+    self.set_status(order, Status.Cancelled)
+
+  # The orders that the read method name returns for the arguments, live and archived,
+  # e.g. with_archive('get_orders_by_status', Status.Completed)
+  def with_archive(self, name, *args, **kwargs):
+    if name.startswith('_') or not callable(getattr(OrderQueries, name, None)):
+      raise InvalidArgumentError('name')
+
+    ArchivedOrder = self._related_model('ArchivedOrder')
+    return OrdersWithArchive(getattr(self, name)(*args, **kwargs), getattr(ArchivedOrder.objects, name)(*args, **kwargs))
+
+  # automatically changes the order to the next status:
+  def set_next_status(self, order):
+    self._check_can_transition(order)
+    self._compare_and_set(order, order.status + 1)
+
+  def _check_can_transition(self, order):
+    if order is None or not isinstance(order, self.model):
+      raise InvalidArgumentError('order')
+
+    if order.status == Status.Completed.value: #Cant Modify already completed order
+      raise OrderAlreadyCompletedError(order.pk)
+
+    if order.status == Status.Cancelled.value:
+      raise OrderAlreadyCancelledError(order.pk)
+
+  """
+    Optimistic concurrency: the UPDATE only matches while the row still has the status
+    and last_updated we read, so a concurrent transition can't be lost or skip past
+    Completed. It is also one query instead of the read-modify-write of order.save()
+  """
+  def _compare_and_set(self, order, status):
+    last_updated = timezone.now()
+
+    with transaction.atomic():
+      updated = self.filter(
+        pk=order.pk, status=order.status, last_updated=order.last_updated
+      ).update(status=status, last_updated=last_updated)
+
+      if not updated:
+        raise OrderConcurrentUpdateError(order.pk)
+
+      self._orders_transitioned([(order.pk, order.order_customer_id, order.totals, order.status, status)])
+
+    order.status = status
+    order.last_updated = last_updated
+
+  ### Bookkeeping of the data derived from the orders
+  # Both run in the transaction that changed the orders
+
+  # orders are Order instances that were just inserted
+  def orders_created(self, orders):
+    CustomerOrderSummary = self._related_model('CustomerOrderSummary')
+
+    CustomerOrderSummary.objects.record_created(orders)
+    self._related_model('StatusCounter').objects.record_created(orders)
+    self._related_model('OrderChange').objects.record_created(orders)
+    invalidate_customer_orders(order.order_customer_id for order in orders)
+
+  # transitions are (order id, customer id, order totals, previous status, new status) tuples
+  def _orders_transitioned(self, transitions):
+    CustomerOrderSummary = self._related_model('CustomerOrderSummary')
+
+    CustomerOrderSummary.objects.record_transitions(transitions)
+    self._related_model('StatusCounter').objects.record_transitions(transitions)
+    self._related_model('OrderChange').objects.record_transitions(transitions)
+    invalidate_customer_orders(customer_id for _, customer_id, _, _, _ in transitions)
+
+  def _related_model(self, name):
+    return self.model._meta.apps.get_model(self.model._meta.app_label, name)
+
+  ### Bulk transitions
+  # Each one is a single UPDATE over the selected orders, the guards of the single
+  # order methods are part of the WHERE clause. They return a tuple with the ids
+  # of the orders that transitioned and the ids of the ones that were rejected.
+
+  # Selects the orders for a bulk transition by ids, or by status and/or creation date range
+  def select_for_transition(self, order_ids=None, status=None, start_date=None, end_date=None):
+    if order_ids is not None:
+      if not isinstance(order_ids, (list, tuple, set)) or not all(isinstance(order_id, int) for order_id in order_ids):
+        raise InvalidArgumentError('order_ids')
+
+      return self.filter(id__in=order_ids)
+
+    if status is None and start_date is None and end_date is None: # never transition the whole table by mistake
+      raise InvalidArgumentError('order_ids')
+
+    orders = self.all()
+
+    if status is not None:
+      if not isinstance(status, Status):
+        raise InvalidArgumentError('status')
+      orders = orders.filter(status=status.value)
+
+    if start_date is not None:
+      if not isinstance(start_date, datetime):
+        raise InvalidArgumentError('start_date')
+      orders = orders.filter(created_at__gte=start_date)
+
+    if end_date is not None:
+      if not isinstance(end_date, datetime):
+        raise InvalidArgumentError('end_date')
+      orders = orders.filter(created_at__lte=end_date)
+
+    return orders
+
+  def bulk_set_status(self, orders, status):
+    if status is None or not isinstance(status, Status):
+      raise InvalidArgumentError('status')
+
+    if status is Status.Cancelled:
+      return self.bulk_cancel_orders(orders)
+
+    # Completed and cancelled orders cant be modified
+    guard = ~Q(status__in=(Status.Completed.value, Status.Cancelled.value))
+    return self._bulk_transition(orders, guard, status.value)
+
+  def bulk_set_next_status(self, orders):
+    return self._bulk_transition(orders, Q(status__lt=Status.Completed.value), None)
+
+  def bulk_cancel_orders(self, orders):
+    return self._bulk_transition(orders, Q(status=Status.Received.value), Status.Cancelled.value)
+
+  """
+    status is the new status, or None to move every order to its next status. Like
+    _compare_and_set the UPDATE only matches the orders still at the status we read,
+    when another request changed one of them in between nothing is transitioned
+  """
+  def _bulk_transition(self, orders, guard, status):
+    with transaction.atomic():
+      candidates = orders.annotate(
+        allowed=Case(When(guard, then=Value(True)), default=Value(False), output_field=BooleanField())
+      ).values_list('id', 'allowed', 'order_customer_id', 'totals', 'status')
+
+      transitioned, rejected, transitions = [], [], []
+      for order_id, allowed, customer_id, totals, previous in candidates:
+        if allowed:
+          transitioned.append(order_id)
+          transitions.append((order_id, customer_id, totals, previous, previous + 1 if status is None else status))
+        else:
+          rejected.append(order_id)
+
+      if transitioned:
+        read = defaultdict(list)
+        for order_id, _, _, previous, _ in transitions:
+          read[previous].append(order_id)
+
+        last_updated = timezone.now()
+        updated = self.filter(reduce(or_, (Q(status=previous, id__in=order_ids) for previous, order_ids in read.items()))).update(
+          status=F('status') + 1 if status is None else status,
+          last_updated=last_updated)
+
+        if updated != len(transitioned):
+          raise OrderConcurrentUpdateError(self._first_missed(transitioned, last_updated))
+
+        self._orders_transitioned(transitions)
+
+    return transitioned, rejected
+
+  # id of the first of the order ids that the UPDATE setting last_updated missed
+  def _first_missed(self, order_ids, last_updated):
+    updated = set(self.filter(id__in=order_ids, last_updated=last_updated).values_list('id', flat=True))
+    return next(order_id for order_id in order_ids if order_id not in updated)
+
+
+"""
+  Keeps CustomerOrderSummary up to date. Each method applies the changes of one
+  transaction as deltas (F() expressions), rows missing for a customer are created,
+  the rebuild_customer_summaries command recomputes everything from the orders.
+"""
+class CustomerOrderSummaryManager(Manager):
+  APPLY_CHUNK = 500
+
+  # Name of the counter column of a status: Status.Payment_Complete -> payment_complete
+  @staticmethod
+  def status_field(status):
+    return Status(status).name.lower()
+
+  def record_created(self, orders):
+    summaries = {}
+
+    for order in orders:
+      summary = summaries.get(order.order_customer_id)
+      if summary is None:
+        summary = summaries[order.order_customer_id] = self.model(customer_id=order.order_customer_id)
+
+      field = self.status_field(order.status)
+      setattr(summary, field, getattr(summary, field) + 1)
+      summary.orders += 1
+      if order.status != Status.Cancelled.value:
+        summary.lifetime_totals += Decimal(order.totals)
+      summary.last_order_at = max(filter(None, (summary.last_order_at, order.created_at)), default=None)
+
+    existing = set(self.filter(pk__in=summaries).values_list('pk', flat=True))
+    self.bulk_create([summary for customer_id, summary in summaries.items() if customer_id not in existing])
+
+    # customers that already had orders, e.g. created directly in the database
+    self._apply(
+      {
+        customer_id: {field: getattr(summaries[customer_id], field) for field in self._counter_fields() + ['lifetime_totals']}
+        for customer_id in existing
+      },
+      {customer_id: summaries[customer_id].last_order_at for customer_id in existing})
+
+  # transitions are (order id, customer id, order totals, previous status, new status) tuples
+  def record_transitions(self, transitions):
+    deltas = {}
+
+    for _, customer_id, totals, previous, status in transitions:
+      delta = deltas.setdefault(customer_id, defaultdict(int))
+      delta[self.status_field(previous)] -= 1
+      delta[self.status_field(status)] += 1
+
+      if status == Status.Cancelled.value:
+        delta['lifetime_totals'] -= Decimal(totals)
+
+    self._apply(deltas)
+
+  """
+    One UPDATE per APPLY_CHUNK customers rather than one per customer: deltas is
+    {customer id: {field: delta}}, and last_order_at {customer id: datetime} moves
+    last_order_at forward. Every field gets a CASE on the customer id, the way
+    StatusCounter does; the chunks keep the statement under the SQLite variable limit
+  """
+  def _apply(self, deltas, last_order_at=None):
+    deltas = {customer_id: {field: value for field, value in delta.items() if value} for customer_id, delta in deltas.items()}
+    deltas = {customer_id: delta for customer_id, delta in deltas.items() if delta}
+    last_order_at = {customer_id: value for customer_id, value in (last_order_at or {}).items() if value is not None}
+    customer_ids = sorted(set(deltas) | set(last_order_at))
+
+    for start in range(0, len(customer_ids), self.APPLY_CHUNK):
+      chunk = customer_ids[start:start + self.APPLY_CHUNK]
+      self._apply_chunk(
+        {customer_id: deltas[customer_id] for customer_id in chunk if customer_id in deltas},
+        {customer_id: last_order_at[customer_id] for customer_id in chunk if customer_id in last_order_at})
+
+  def _apply_chunk(self, deltas, last_order_at):
+    changes = {}
+    for field in {field for delta in deltas.values() for field in delta}:
+      changes[field] = F(field) + Case(
+        *(When(pk=customer_id, then=Value(delta[field])) for customer_id, delta in deltas.items() if field in delta),
+        default=Value(0), output_field=self.model._meta.get_field(field))
+
+    if last_order_at:
+      newest = Case(
+        *(When(pk=customer_id, then=Value(value)) for customer_id, value in last_order_at.items()),
+        default=F('last_order_at'), output_field=DateTimeField())
+      changes['last_order_at'] = Coalesce(Greatest('last_order_at', newest), newest)
+
+    self.filter(pk__in=set(deltas) | set(last_order_at)).update(**changes)
+
+  def _counter_fields(self):
+    return ['orders'] + [self.status_field(status.value) for status in Status]
+
+  # Recomputes every summary from the live and the archived orders, in chunks of customers
+  def rebuild(self, chunk_size=2000):
+    models = self.model._meta.apps.get_app_config(self.model._meta.app_label)
+    counters = {
+      self.status_field(status.value): Count('id', filter=Q(status=status.value))
+      for status in Status
+    }
+
+    def aggregate(model):
+      return model.objects.order_by().values('order_customer_id').annotate(
+        orders=Count('id'),
+        lifetime_totals=Coalesce(Sum('totals', filter=~Q(status=Status.Cancelled.value)), Value(Decimal(0))),
+        last_order_at=Max('created_at'),
+        **counters)
+
+    # per customer, merged into the rows of the live orders as they are read
+    archived = {row.pop('order_customer_id'): row for row in aggregate(models.get_model('ArchivedOrder'))}
+
+    def merged():
+      for row in aggregate(models.get_model('Order')).iterator(chunk_size=chunk_size):
+        customer_id = row.pop('order_customer_id')
+        yield customer_id, self._merge_rows(row, archived.pop(customer_id, None))
+
+      # customers without live orders, unless their live row is gone
+      existing = models.get_model('OrderCustomer').objects.filter(id__in=archived).values_list('id', flat=True)
+      for customer_id in existing.iterator(chunk_size=chunk_size):
+        yield customer_id, archived[customer_id]
+
+    with transaction.atomic():
+      self.all().delete()
+
+      rebuilt = 0
+      batch = []
+      for customer_id, row in merged():
+        batch.append(self.model(customer_id=customer_id, **row))
+
+        if len(batch) >= chunk_size:
+          self.bulk_create(batch)
+          rebuilt += len(batch)
+          batch = []
+
+      self.bulk_create(batch)
+      rebuilt += len(batch)
+
+    return rebuilt
+
+  @staticmethod
+  def _merge_rows(row, other):
+    if other is None:
+      return row
+
+    merged = {field: row[field] + other[field] for field in row if field != 'last_order_at'}
+    merged['last_order_at'] = max(row['last_order_at'], other['last_order_at'])
+    return merged
+
+
+"""
+  Keeps StatusCounter up to date. The deltas of a transaction are applied with a
+  single UPDATE whatever the number of statuses involved; reconcile() compares the
+  counters with a COUNT over the orders and repairs them.
+"""
+class StatusCounterManager(Manager):
+
+  def record_created(self, orders):
+    deltas = defaultdict(int)
+    for order in orders:
+      deltas[order.status] += 1
+
+    self._apply(deltas)
+
+  # transitions are (order id, customer id, order totals, previous status, new status) tuples
+  def record_transitions(self, transitions):
+    deltas = defaultdict(int)
+    for _, _, _, previous, status in transitions:
+      deltas[previous] -= 1
+      deltas[status] += 1
+
+    self._apply(deltas)
+
+  def _apply(self, deltas):
+    deltas = {status: delta for status, delta in deltas.items() if delta}
+    if not deltas:
+      return
+
+    self.filter(status__in=deltas).update(count=F('count') + Case(
+      *(When(status=status, then=Value(delta)) for status, delta in deltas.items()),
+      default=Value(0)))
+
+  # {Status: count} of all the statuses, a missing row counts as 0
+  def depths(self):
+    counts = dict(self.values_list('status', 'count'))
+    return {status: counts.get(status.value, 0) for status in Status}
+
+  """
+    Returns the (Status, recorded count or None when the row is missing, actual count)
+    of the counters that drifted from the orders, and writes the actual counts unless
+    repair is False. Both run in one transaction, so writers can't change the orders
+    between the COUNT and the fix.
+  """
+  def reconcile(self, repair=True):
+    models = self.model._meta.apps.get_app_config(self.model._meta.app_label)
+
+    with transaction.atomic():
+      actual = defaultdict(int)
+      for model in (models.get_model('Order'), models.get_model('ArchivedOrder')): # archived orders still count
+        for status, count in model.objects.order_by().values('status').annotate(count=Count('id')).values_list('status', 'count'):
+          actual[status] += count
+      recorded = dict(self.values_list('status', 'count'))
+      drift = [
+        (status, recorded.get(status.value), actual.get(status.value, 0))
+        for status in Status if recorded.get(status.value) != actual.get(status.value, 0)
+      ]
+
+      if repair:
+        for status, _, count in drift:
+          self.update_or_create(status=status.value, defaults={'count': count})
+
+    return drift
+
+
+"""
+  Hot/cold archival. Completed and Cancelled orders no longer change, archive() moves
+  them with their items to the archive tables so the Order indexes only hold the live
+  orders. The customer rows are copied; the live row is deleted once it has no live
+  orders and no summary left, the summaries and the status counters keep counting the
+  archived orders.
+"""
+class ArchivedOrderManager(OrderQueries, Manager):
+
+  # Archives the terminal orders last updated before `before`, chunk_size orders per
+  # transaction. Returns the number of orders archived
+  def archive(self, before, chunk_size=1000):
+    archived = 0
+
+    while True:
+      moved = self._archive_chunk(before, chunk_size)
+      if not moved:
+        return archived
+      archived += moved
+
+  def _archive_chunk(self, before, chunk_size):
+    models = self.model._meta.apps.get_app_config(self.model._meta.app_label)
+    Order, OrderCustomer, OrderItems = models.get_model('Order'), models.get_model('OrderCustomer'), models.get_model('OrderItems')
+    ArchivedOrderCustomer, ArchivedOrderItems = models.get_model('ArchivedOrderCustomer'), models.get_model('ArchivedOrderItems')
+
+    with transaction.atomic():
+      orders = list(Order.objects.filter(
+        status__in=(Status.Completed.value, Status.Cancelled.value), last_updated__lt=before
+      ).order_by('id').values('id', 'order_customer_id', 'totals', 'created_at', 'last_updated', 'status')[:chunk_size])
+
+      if not orders:
+        return 0
+
+      order_ids = [order['id'] for order in orders]
+      customer_ids = {order['order_customer_id'] for order in orders}
+      archived_at = timezone.now()
+
+      ArchivedOrderCustomer.objects.bulk_create([
+        ArchivedOrderCustomer(**customer)
+        for customer in OrderCustomer.objects.filter(id__in=customer_ids).values('id', 'customer_id', 'name', 'email')
+      ], ignore_conflicts=True) # already there for the customers archived before
+      self.bulk_create([self.model(archived_at=archived_at, **order) for order in orders])
+      ArchivedOrderItems.objects.bulk_create([
+        ArchivedOrderItems(**item)
+        for item in OrderItems.objects.filter(order_id__in=order_ids).values('id', 'product_id', 'name', 'quantity', 'price_per_unit', 'order_id')
+      ])
+
+      Order.objects.filter(id__in=order_ids).delete() # and the items
+      OrderCustomer.objects.filter(id__in=customer_ids, order__isnull=True, summary__isnull=True).delete()
+      invalidate_customer_orders(customer_ids)
+
+    return len(orders)
+
+
+"""
+  The change feed: OrderChange rows are appended by the OrderManager bookkeeping,
+  one INSERT per transaction, and read back in id order after a consumer's cursor.
+  Writers are serialized by SQLite (the transactions start IMMEDIATE, see settings),
+  so the ids are committed in increasing order and a reader can never skip past a
+  change that commits later.
+"""
+class OrderChangeManager(Manager):
+
+  def record_created(self, orders):
+    changed_at = timezone.now()
+    self.bulk_create([
+      self.model(order_id=order.pk, customer_id=order.order_customer_id, status=order.status, changed_at=changed_at)
+      for order in orders
+    ])
+
+  # transitions are (order id, customer id, order totals, previous status, new status) tuples
+  def record_transitions(self, transitions):
+    changed_at = timezone.now()
+    self.bulk_create([
+      self.model(order_id=order_id, customer_id=customer_id, previous_status=previous, status=status, changed_at=changed_at)
+      for order_id, customer_id, _, previous, status in transitions
+    ])
+
+  # (up to limit changes after the cursor, True when there are more)
+  def since(self, cursor, limit):
+    changes = list(self.filter(id__gt=cursor).order_by('id')[:limit + 1])
+    return changes[:limit], len(changes) > limit
+
+  # True when changes after the cursor were already compacted, the consumer missed them.
+  # compact() always keeps the newest change, so the first one left follows the last deleted.
+  # Cursor 0 is a new consumer, it starts from the oldest change left
+  def expired(self, cursor):
+    if not cursor:
+      return False
+
+    oldest = self.order_by('id').values_list('id', flat=True).first()
+    return oldest is not None and cursor < oldest - 1
+
+  # Deletes the changes older than before, except the newest one. Returns the number deleted
+  def compact(self, before):
+    newest = self.order_by('-id').values_list('id', flat=True).first()
+    if newest is None:
+      return 0
+
+    deleted, _ = self.filter(changed_at__lt=before, id__lt=newest).delete()
+    return deleted
@@ -0,0 +1,230 @@
+"""
+  Per-request performance metrics.
+
+  RequestMetricsMiddleware measures, for every resolved URL pattern, the total
+  latency, the number of SQL queries, the time spent in the database and the time
+  spent rendering OrderSerializer data. The values are aggregated in in-process
+  histograms and exposed in the Prometheus text format by the metrics view.
+
+  Settings:
+    METRICS_ENABLED: turns the middleware off entirely (default True)
+    METRICS_SAMPLE_RATE: fraction of the requests that are measured (default 1.0)
+"""
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+
+from .cache import stats as cache_stats
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Metrics of the request being handled, None when it is not sampled
+_current = ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+    self.sum = 0
+    self.count = 0
+
+  def observe(self, value):
+    self.counts[bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+  # (le, cumulative count) pairs, as Prometheus expects them
+  def cumulative(self):
+    total = 0
+    for bucket, count in zip(self.buckets + ('+Inf',), self.counts):
+      total += count
+      yield bucket, total
+
+
+class RequestMetrics:
+  __slots__ = ('queries', 'db_time', 'serializer_time')
+
+  def __init__(self):
+    self.queries = 0
+    self.db_time = 0.0
+    self.serializer_time = 0.0
+
+  # connection.execute_wrapper hook, counts and times every query of the request
+  def __call__(self, execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+      return execute(sql, params, many, context)
+    finally:
+      self.db_time += time.perf_counter() - start
+      self.queries += 1
+
+
+class MetricsRegistry:
+  metrics = (
+    ('order_request_duration_seconds', 'Total time to handle the request.', LATENCY_BUCKETS),
+    ('order_request_db_queries', 'Number of SQL queries run by the request.', QUERY_BUCKETS),
+    ('order_request_db_duration_seconds', 'Time spent running SQL queries.', LATENCY_BUCKETS),
+    ('order_request_serializer_duration_seconds', 'Time spent rendering OrderSerializer data.', LATENCY_BUCKETS),
+  )
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._routes = {}
+
+  def observe(self, route, duration, request_metrics):
+    values = (duration, request_metrics.queries, request_metrics.db_time, request_metrics.serializer_time)
+
+    with self._lock:
+      histograms = self._routes.get(route)
+      if histograms is None:
+        histograms = self._routes[route] = [Histogram(buckets) for _, _, buckets in self.metrics]
+
+      for histogram, value in zip(histograms, values):
+        histogram.observe(value)
+
+  def reset(self):
+    with self._lock:
+      self._routes.clear()
+
+  def to_prometheus(self):
+    lines = []
+
+    with self._lock:
+      for index, (name, help_text, _) in enumerate(self.metrics):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+
+        for route, histograms in sorted(self._routes.items()):
+          histogram = histograms[index]
+          label = f'route="{_escape(route)}"'
+
+          for bucket, count in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{label},le="{bucket}"}} {count}')
+          lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+          lines.append(f'{name}_count{{{label}}} {histogram.count}')
+
+    cache = cache_stats.as_dict()
+    lines.append('# HELP order_cache_requests_total Lookups in the customer order lists cache.')
+    lines.append('# TYPE order_cache_requests_total counter')
+    lines.append(f'order_cache_requests_total{{result="hit"}} {cache["hits"]}')
+    lines.append(f'order_cache_requests_total{{result="miss"}} {cache["misses"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+# Used around OrderSerializer rendering, adds the time to the current request if it is measured
+class serializer_timer:
+
+  def __enter__(self):
+    self.metrics = _current.get()
+    if self.metrics is not None:
+      self.start = time.perf_counter()
+
+  def __exit__(self, *exc_info):
+    if self.metrics is not None:
+      self.metrics.serializer_time += time.perf_counter() - self.start
+
+
+# Installs the execute_wrapper of the request being measured on the connections of the
+# current thread. Used by the middleware, and by the async views around the work they
+# run in other threads, which have connections of their own
+@contextmanager
+def track_queries():
+  request_metrics = _current.get()
+
+  with ExitStack() as stack:
+    if request_metrics is not None:
+      for connection in connections.all():
+        if request_metrics not in connection.execute_wrappers: # already installed on this thread
+          stack.enter_context(connection.execute_wrapper(request_metrics))
+
+    yield
+
+
+# Works both ways: under ASGI it stays async, so the async views are not adapted to sync
+class RequestMetricsMiddleware:
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    self.enabled = getattr(settings, 'METRICS_ENABLED', True)
+    self.sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+
+    if iscoroutinefunction(get_response):
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if iscoroutinefunction(self):
+      return self.__acall__(request)
+
+    if not self._sampled():
+      return self.get_response(request)
+
+    request_metrics = RequestMetrics()
+    token = _current.set(request_metrics)
+    start = time.perf_counter()
+
+    try:
+      with track_queries():
+        response = self.get_response(request)
+    finally:
+      _current.reset(token)
+
+    self._observe(request, start, request_metrics)
+    return response
+
+  async def __acall__(self, request):
+    if not self._sampled():
+      return await self.get_response(request)
+
+    request_metrics = RequestMetrics()
+    token = _current.set(request_metrics)
+    start = time.perf_counter()
+
+    # The sync views run in the thread of the ThreadSensitiveContext of the request, the
+    # wrapper is installed on the connections of that thread, and removed there
+    queries = ExitStack()
+    try:
+      await sync_to_async(queries.enter_context)(track_queries())
+      try:
+        response = await self.get_response(request)
+      finally:
+        await sync_to_async(queries.close)()
+    finally:
+      _current.reset(token)
+
+    self._observe(request, start, request_metrics)
+    return response
+
+  def _sampled(self):
+    return self.enabled and random.random() < self.sample_rate
+
+  def _observe(self, request, start, request_metrics):
+    match = getattr(request, 'resolver_match', None)
+    route = match.route if match is not None else 'unmatched'
+    registry.observe(route, time.perf_counter() - start, request_metrics)
+
+
+@require_GET
+def metrics_view(request):
+  return HttpResponse(registry.to_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:37
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+# One summary per customer with orders, from the orders already in the table. The same
+# aggregate as CustomerOrderSummaryManager.rebuild, there is no archive yet
+def create_summaries(apps, schema_editor):
+    Order = apps.get_model('main', 'Order')
+    CustomerOrderSummary = apps.get_model('main', 'CustomerOrderSummary')
+    statuses = {1: 'received', 2: 'processing', 3: 'payment_complete', 4: 'shipping', 5: 'completed', 6: 'cancelled'}
+
+    rows = Order.objects.order_by().values('order_customer_id').annotate(
+        orders=Count('id'),
+        lifetime_totals=Coalesce(Sum('totals', filter=~Q(status=6)), Value(Decimal(0))),
+        last_order_at=Max('created_at'),
+        **{field: Count('id', filter=Q(status=status)) for status, field in statuses.items()})
+
+    batch = []
+    for row in rows.iterator(chunk_size=2000):
+        batch.append(CustomerOrderSummary(customer_id=row.pop('order_customer_id'), **row))
+        if len(batch) >= 2000:
+            CustomerOrderSummary.objects.bulk_create(batch)
+            batch = []
+    CustomerOrderSummary.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerOrderSummary',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='main.ordercustomer')),
+                ('orders', models.IntegerField(default=0)),
+                ('received', models.IntegerField(default=0)),
+                ('processing', models.IntegerField(default=0)),
+                ('payment_complete', models.IntegerField(default=0)),
+                ('shipping', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('lifetime_totals', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('last_order_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.RunPython(create_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:39
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# One row per status, starting from the orders already in the table
+def create_counters(apps, schema_editor):
+    Order = apps.get_model('main', 'Order')
+    StatusCounter = apps.get_model('main', 'StatusCounter')
+
+    counts = dict(Order.objects.order_by().values('status').annotate(count=Count('id')).values_list('status', 'count'))
+    StatusCounter.objects.bulk_create([
+        StatusCounter(status=status, count=counts.get(status, 0))
+        for status, _ in StatusCounter._meta.get_field('status').choices
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_customer_order_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusCounter',
+            fields=[
+                ('status', models.IntegerField(choices=[(1, 'Received'), (2, 'Processing'), (3, 'Payment complete'), (4, 'Shipping'), (5, 'Completed'), (6, 'Cancelled')], primary_key=True, serialize=False)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_order_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrderCustomer',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('customer_id', models.IntegerField()),
+                ('name', models.CharField(max_length=100)),
+                ('email', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('totals', models.DecimalField(decimal_places=2, default=0, max_digits=9)),
+                ('created_at', models.DateTimeField()),
+                ('last_updated', models.DateTimeField()),
+                ('status', models.IntegerField(choices=[(1, 'Received'), (2, 'Processing'), (3, 'Payment complete'), (4, 'Shipping'), (5, 'Completed'), (6, 'Cancelled')])),
+                ('archived_at', models.DateTimeField()),
+                ('order_customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.archivedordercustomer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItems',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('product_id', models.IntegerField()),
+                ('name', models.CharField(max_length=200)),
+                ('quantity', models.IntegerField()),
+                ('price_per_unit', models.DecimalField(decimal_places=2, default=0, max_digits=9)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='main.archivedorder')),
+            ],
+            options={
+                'verbose_name_plural': 'Archived Order Items',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['order_customer', 'status', '-created_at'], name='archived_customer_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['status', '-created_at'], name='archived_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['created_at'], name='archived_created_at_idx'),
+        ),
+    ]
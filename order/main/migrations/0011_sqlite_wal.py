@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:10
+
+from django.db import migrations
+
+
+# WAL lets the readers run while a write is in progress. The journal mode is stored in
+# the database file, so it is set here once rather than by every new connection, and
+# it can't be changed inside a transaction
+def enable_wal(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+
+def disable_wal(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=DELETE')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('main', '0010_order_status_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.db import models
-from .managers import OrderManager
+from django.utils import timezone
+from .managers import ArchivedOrderManager, CustomerOrderSummaryManager, OrderChangeManager, OrderManager, StatusCounterManager
 
 ## Model that stores info about ordering customer 
 class OrderCustomer(models.Model):
@@ -24,18 +26,154 @@ class Order(models.Model):
   totals = models.DecimalField(max_digits=9, decimal_places=2, default=0)
   created_at = models.DateTimeField(auto_now_add=True) #auto_now_add, this adds timezone info
   last_updated = models.DateTimeField(auto_now=True)
-  status = models.IntegerField(choices=ORDER_STATUS, default='1')
+  status = models.IntegerField(choices=ORDER_STATUS, default=1)
 
   # access all methods defined in the OrderManager through Order.objects
   objects = OrderManager()
 
+  # Indexes matching the filters and orderings used in the OrderManager
+  class Meta:
+    indexes = [
+      # customer lists, all of them filter by customer and order by status/created_at
+      models.Index(fields=['order_customer', 'status', '-created_at'], name='order_customer_status_idx'),
+      # get_orders_by_status, newest first
+      models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+      # get_orders_by_period range scan
+      models.Index(fields=['created_at'], name='order_created_at_idx'),
+    ]
+
 ## Holds items belonging to an Order
 class OrderItems(models.Model):
   class Meta: #Set metadata information on our Model class
     verbose_name_plural = 'Order Items'
+    indexes = [
+      models.Index(fields=['product_id'], name='orderitems_product_idx'),
+    ]
 
   product_id = models.IntegerField()
   name = models.CharField(max_length=200)
   quantity = models.IntegerField()
   price_per_unit = models.DecimalField(max_digits=9, decimal_places=2, default=0)
   order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+
+## Denormalized per-customer counters, maintained by the OrderManager in the same
+## transaction as the orders (see CustomerOrderSummaryManager)
+class CustomerOrderSummary(models.Model):
+  customer = models.OneToOneField(OrderCustomer, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+  orders = models.IntegerField(default=0)
+  # one counter per Status, named after it
+  received = models.IntegerField(default=0)
+  processing = models.IntegerField(default=0)
+  payment_complete = models.IntegerField(default=0)
+  shipping = models.IntegerField(default=0)
+  completed = models.IntegerField(default=0)
+  cancelled = models.IntegerField(default=0)
+  lifetime_totals = models.DecimalField(max_digits=12, decimal_places=2, default=0) # cancelled orders excluded
+  last_order_at = models.DateTimeField(null=True)
+
+  objects = CustomerOrderSummaryManager()
+
+## Number of orders at every status (the fulfilment queue depths), one row per Status,
+## maintained by the OrderManager in the same transaction as the orders (see StatusCounterManager)
+class StatusCounter(models.Model):
+  status = models.IntegerField(choices=Order.ORDER_STATUS, primary_key=True)
+  count = models.IntegerField(default=0)
+
+  objects = StatusCounterManager()
+
+## Order volume and revenue per time bucket and status, refreshed from the orders by the
+## refresh_order_rollups command (see rollups.py)
+class OrderRollup(models.Model):
+  bucket = models.DateTimeField() # start of the hour/day, UTC
+  status = models.IntegerField(choices=Order.ORDER_STATUS)
+  orders = models.IntegerField(default=0)
+  revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0) # sum of the order totals
+  items = models.IntegerField(default=0) # units ordered, the sum of the item quantities
+
+  class Meta:
+    abstract = True
+
+class HourlyOrderRollup(OrderRollup):
+  class Meta:
+    constraints = [models.UniqueConstraint(fields=['bucket', 'status'], name='hourly_rollup_bucket_status_uniq')]
+
+class DailyOrderRollup(OrderRollup):
+  class Meta:
+    constraints = [models.UniqueConstraint(fields=['bucket', 'status'], name='daily_rollup_bucket_status_uniq')]
+
+## Orders last updated before this time are reflected in the rollups
+class RollupWatermark(models.Model):
+  name = models.CharField(max_length=50, primary_key=True)
+  value = models.DateTimeField()
+
+## Cold storage of the Completed and Cancelled orders, moved there by the archive_orders
+## command (see ArchivedOrderManager). The rows keep their ids and field names, so the
+## archived orders can be listed and serialized like the live ones.
+class ArchivedOrderCustomer(models.Model):
+  id = models.IntegerField(primary_key=True) # id of the OrderCustomer
+  customer_id = models.IntegerField()
+  name = models.CharField(max_length=100)
+  email = models.CharField(max_length=100)
+
+class ArchivedOrder(models.Model):
+  id = models.IntegerField(primary_key=True) # id of the Order
+  order_customer = models.ForeignKey(ArchivedOrderCustomer, on_delete=models.CASCADE)
+  totals = models.DecimalField(max_digits=9, decimal_places=2, default=0)
+  created_at = models.DateTimeField()
+  last_updated = models.DateTimeField()
+  status = models.IntegerField(choices=Order.ORDER_STATUS)
+  archived_at = models.DateTimeField()
+
+  objects = ArchivedOrderManager()
+
+  # the same as Order, for the read methods of OrderQueries (see ArchivedOrderManager)
+  class Meta:
+    indexes = [
+      models.Index(fields=['order_customer', 'status', '-created_at'], name='archived_customer_status_idx'),
+      models.Index(fields=['status', '-created_at'], name='archived_status_created_idx'),
+      models.Index(fields=['created_at'], name='archived_created_at_idx'),
+    ]
+
+class ArchivedOrderItems(models.Model):
+  class Meta:
+    verbose_name_plural = 'Archived Order Items'
+
+  id = models.IntegerField(primary_key=True) # id of the OrderItems
+  product_id = models.IntegerField()
+  name = models.CharField(max_length=200)
+  quantity = models.IntegerField()
+  price_per_unit = models.DecimalField(max_digits=9, decimal_places=2, default=0)
+  order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+
+## Stored response of a create order request, replayed when the client retries it with
+## the same key (see idempotency.py)
+class IdempotencyKey(models.Model):
+  user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+  key = models.CharField(max_length=255)
+  fingerprint = models.CharField(max_length=64) # sha256 of the request body
+  status_code = models.IntegerField()
+  response = models.TextField() # JSON body
+  expires_at = models.DateTimeField(db_index=True)
+
+  class Meta:
+    constraints = [models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq')]
+
+## Change feed of the orders: one row per order created and per status transition,
+## written in the same transaction. The id is the cursor of the order/changes/ endpoint
+class OrderChange(models.Model):
+  order_id = models.IntegerField() # not a foreign key, the order may be archived since
+  customer_id = models.IntegerField() # id of the OrderCustomer
+  previous_status = models.IntegerField(choices=Order.ORDER_STATUS, null=True) # None when the order was created
+  status = models.IntegerField(choices=Order.ORDER_STATUS)
+  changed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+  objects = OrderChangeManager()
+
+## Progress of an import_orders run, saved in the transaction of every chunk it writes
+## (see importer.py)
+class ImportCheckpoint(models.Model):
+  name = models.CharField(max_length=255, primary_key=True)
+  position = models.IntegerField(default=0) # input records consumed, imported or rejected
+  imported = models.IntegerField(default=0)
+  rejected = models.IntegerField(default=0)
+  updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,215 @@
+"""
+  Keyset (cursor) pagination for the order list endpoints.
+
+  Instead of OFFSET, every page is fetched with a WHERE clause that starts right
+  after the last row of the previous page, using the ordering of the queryset
+  returned by the OrderManager (e.g. status, -created_at, id). The cost of a page
+  is therefore the same whether the client is on page 1 or page 10 000.
+
+  The cursor handed to the client is opaque: a base64 encoded JSON document with
+  the ordering values of the boundary row and the direction we are paging in.
+"""
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from functools import cmp_to_key
+
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .exceptions import InvalidArgumentError
+from .managers import OrdersWithArchive
+
+
+class OrderKeysetPagination(BasePagination):
+  cursor_query_param = 'cursor'
+  page_size = api_settings.PAGE_SIZE or 50
+  page_size_query_param = 'page_size'
+  max_page_size = 500
+
+  # queryset can also be an OrdersWithArchive (see OrderManager.with_archive), a page is
+  # fetched from the live and from the archived orders and the two are merged
+  def paginate_queryset(self, queryset, request, view=None):
+    self.request = request
+    self.page_size = self.get_page_size(request)
+    sources = queryset.sources if isinstance(queryset, OrdersWithArchive) else (queryset,)
+    self.ordering = self.get_ordering(sources[0])
+
+    position, reverse = self.decode_cursor(request, sources[0].model)
+
+    # When paging backwards we walk the index in the opposite direction
+    # and flip the rows back afterwards
+    ordering = self.ordering if not reverse else [self._invert(field) for field in self.ordering]
+
+    rows = []
+    for source in sources:
+      source = source.order_by(*ordering)
+
+      if position is not None:
+        source = source.filter(self._keyset_filter(ordering, position))
+
+      # Fetch one extra row, this tells us if there is a page after this one
+      rows.extend(source[:self.page_size + 1])
+
+    if len(sources) > 1:
+      rows.sort(key=cmp_to_key(lambda row, other: self._compare(ordering, row, other)))
+      rows = rows[:self.page_size + 1]
+
+    has_more = len(rows) > self.page_size
+    self.page = rows[:self.page_size]
+
+    if reverse:
+      self.page.reverse()
+      self.has_next = position is not None
+      self.has_previous = has_more
+    else:
+      self.has_next = has_more
+      self.has_previous = position is not None
+
+    return self.page
+
+  def get_paginated_response(self, data):
+    return Response(OrderedDict([
+      ('next', self.get_next_link()),
+      ('previous', self.get_previous_link()),
+      ('results', data),
+    ]))
+
+  def get_paginated_response_schema(self, schema):
+    return {
+      'type': 'object',
+      'properties': {
+        'next': {'type': 'string', 'nullable': True},
+        'previous': {'type': 'string', 'nullable': True},
+        'results': schema,
+      },
+    }
+
+  def get_page_size(self, request):
+    value = request.query_params.get(self.page_size_query_param)
+    if value is None:
+      return self.page_size
+
+    try:
+      page_size = int(value)
+    except ValueError:
+      raise InvalidArgumentError(self.page_size_query_param)
+
+    if page_size <= 0:
+      raise InvalidArgumentError(self.page_size_query_param)
+
+    return min(page_size, self.max_page_size)
+
+  # The ordering comes from the manager method, the primary key is appended
+  # as a tie-breaker so every row has a unique position
+  def get_ordering(self, queryset):
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+
+    if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+      ordering.append('id')
+
+    return ordering
+
+  def get_next_link(self):
+    if not self.has_next or not self.page:
+      return None
+
+    return self.encode_cursor(self.page[-1], reverse=False)
+
+  def get_previous_link(self):
+    if not self.has_previous or not self.page:
+      return None
+
+    return self.encode_cursor(self.page[0], reverse=True)
+
+  # rows are model instances, or dicts for querysets that use values()
+  def encode_cursor(self, row, reverse):
+    position = [self._value(row, field) for field in self.ordering]
+
+    payload = json.dumps({'p': position, 'r': reverse}, default=self._json_default)
+    cursor = b64encode(payload.encode('ascii'), altchars=b'-_').decode('ascii')
+
+    url = self.request.build_absolute_uri()
+    return replace_query_param(url, self.cursor_query_param, cursor)
+
+  def decode_cursor(self, request, model):
+    cursor = request.query_params.get(self.cursor_query_param)
+    if cursor is None:
+      return None, False
+
+    try:
+      payload = json.loads(b64decode(cursor.encode('ascii'), altchars=b'-_').decode('ascii'))
+      position = payload['p']
+      reverse = bool(payload['r'])
+
+      if len(position) != len(self.ordering):
+        raise ValueError(cursor)
+
+      # Convert the JSON values back to python values (datetime, Decimal...)
+      position = [
+        model._meta.get_field(self._field_name(field)).to_python(value)
+        for field, value in zip(self.ordering, position)
+      ]
+    except Exception:
+      raise InvalidArgumentError(self.cursor_query_param)
+
+    return position, reverse
+
+  @staticmethod
+  def _field_name(field):
+    name = field.lstrip('-')
+    return 'id' if name == 'pk' else name
+
+  @classmethod
+  def _value(cls, row, field):
+    if isinstance(row, dict):
+      return row[cls._field_name(field)]
+    return getattr(row, row._meta.get_field(cls._field_name(field)).attname)
+
+  # Compares two rows in the given ordering, like the ORDER BY of the database
+  @classmethod
+  def _compare(cls, ordering, row, other):
+    for field in ordering:
+      value, other_value = cls._value(row, field), cls._value(other, field)
+      if value != other_value:
+        result = -1 if value < other_value else 1
+        return -result if field.startswith('-') else result
+    return 0
+
+  # Full precision values, DjangoJSONEncoder truncates datetimes to milliseconds
+  # which would make the cursor skip or repeat rows
+  @staticmethod
+  def _json_default(value):
+    if hasattr(value, 'isoformat'):
+      return value.isoformat()
+    return str(value)
+
+  @staticmethod
+  def _invert(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+  # Builds a >= x AND ((a > x) OR (a = x AND b < y) OR (a = x AND b = y AND c > z) ...)
+  # for an ordering of (a, -b, c), so the rows after the cursor are returned. The first
+  # bound is redundant but SQLite can't seek the index with the OR alone: it would read
+  # every row of the equality prefix of the filter before the cursor, so a deep page
+  # would cost as much as all the pages before it
+  @classmethod
+  def _keyset_filter(cls, ordering, position):
+    first = ordering[0]
+    condition = Q()
+
+    for index, field in enumerate(ordering):
+      name = cls._field_name(field)
+      lookup = 'lt' if field.startswith('-') else 'gt'
+
+      branch = Q(**{f'{name}__{lookup}': position[index]})
+      for previous_field, value in zip(ordering[:index], position[:index]):
+        branch &= Q(**{cls._field_name(previous_field): value})
+
+      condition |= branch
+
+    bound = Q(**{f'{cls._field_name(first)}__{"lte" if first.startswith("-") else "gte"}': position[0]})
+    return bound & condition
@@ -0,0 +1,40 @@
+"""
+  Renderers of the order list endpoints.
+
+  Besides JSON, the lists can be rendered as MessagePack, a binary encoding that is
+  smaller and faster to parse on mobile clients. It is selected by content
+  negotiation: the Accept: application/msgpack header, or ?format=msgpack. The
+  msgpack package is optional; without it the endpoints only offer the default
+  renderers and a msgpack request gets 406 Not Acceptable.
+"""
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+
+class MessagePackRenderer(BaseRenderer):
+  media_type = 'application/msgpack'
+  format = 'msgpack'
+  charset = None
+  render_style = 'binary'
+
+  # datetimes, Decimals, UUIDs... as the JSON renderer writes them
+  _encoder = JSONEncoder()
+
+  def render(self, data, accepted_media_type=None, renderer_context=None):
+    if data is None:
+      return b''
+
+    return msgpack.packb(data, default=self._encoder.default)
+
+
+def order_renderers():
+  renderers = list(api_settings.DEFAULT_RENDERER_CLASSES)
+  if msgpack is not None:
+    renderers.append(MessagePackRenderer)
+  return renderers
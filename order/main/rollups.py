@@ -0,0 +1,228 @@
+"""
+  Hourly and daily rollups of the order volume and revenue, per status.
+
+  refresh() recomputes from the raw rows the hours that have orders created or
+  transitioned since the last refresh (last_updated at or after the watermark),
+  then the days containing them from the hourly rollups. Recomputing a bucket is
+  idempotent, so a refresh overlapping the previous one is harmless.
+
+  order_volume() answers a created_at range query from the rollups: the daily table
+  for the whole days, the hourly table for the whole hours, and the raw rows only for
+  the partial hours at the edges of the range and for the tail created after the
+  watermark. The status breakdown of the rolled part is the one of the last refresh.
+
+  All the buckets are in UTC.
+"""
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .exceptions import InvalidArgumentError
+from .models import ArchivedOrder, ArchivedOrderItems, DailyOrderRollup, HourlyOrderRollup, Order, OrderItems, RollupWatermark
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+GRANULARITIES = {
+  'hour': (HOUR, TruncHour),
+  'day': (DAY, TruncDay),
+}
+
+WATERMARK = 'orders'
+
+# Buckets recomputed per transaction, a month of hours
+REFRESH_CHUNK_SIZE = 744
+
+
+def _floor(value, step):
+  value = value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+  return value.replace(hour=0) if step == DAY else value
+
+
+def _ceil(value, step):
+  floor = _floor(value, step)
+  return floor if floor == value else floor + step
+
+
+# Half-open [start, end) ranges as one filter
+def _in_ranges(field, ranges):
+  condition = Q()
+  for start, end in ranges:
+    condition |= Q(**{f'{field}__gte': start, f'{field}__lt': end})
+  return condition
+
+
+# Sorted bucket starts -> ranges of consecutive buckets
+def _merge_buckets(buckets, step):
+  ranges = []
+  for bucket in buckets:
+    if ranges and ranges[-1][1] == bucket:
+      ranges[-1][1] = bucket + step
+    else:
+      ranges.append([bucket, bucket + step])
+  return ranges
+
+
+def _chunks(values, size):
+  for index in range(0, len(values), size):
+    yield values[index:index + size]
+
+
+def _totals():
+  return defaultdict(lambda: [0, Decimal(0), 0])
+
+
+# Adds [orders, revenue, items] per (bucket, status) of the orders created in the ranges,
+# live and archived
+def _aggregate_orders(totals, ranges, trunc):
+  if not ranges:
+    return totals
+
+  for order_model, items_model in ((Order, OrderItems), (ArchivedOrder, ArchivedOrderItems)):
+    orders = order_model.objects.filter(_in_ranges('created_at', ranges)).order_by().annotate(
+      bucket=trunc('created_at', tzinfo=dt_timezone.utc)
+    ).values('bucket', 'status').annotate(count=Count('id'), revenue=Sum('totals'))
+
+    for row in orders:
+      values = totals[(row['bucket'], row['status'])]
+      values[0] += row['count']
+      values[1] += row['revenue']
+
+    # in a query of their own, joining the items would count every order once per item
+    items = items_model.objects.filter(_in_ranges('order__created_at', ranges)).order_by().annotate(
+      bucket=trunc('order__created_at', tzinfo=dt_timezone.utc)
+    ).values('bucket', 'order__status').annotate(units=Sum('quantity'))
+
+    for row in items:
+      totals[(row['bucket'], row['order__status'])][2] += row['units']
+
+  return totals
+
+
+# Adds the rollup rows in the ranges, with their buckets truncated to step
+def _aggregate_rollups(totals, model, ranges, step):
+  if not ranges:
+    return totals
+
+  rows = model.objects.filter(_in_ranges('bucket', ranges)).values_list('bucket', 'status', 'orders', 'revenue', 'items')
+
+  for bucket, status, orders, revenue, items in rows:
+    values = totals[(_floor(bucket, step), status)]
+    values[0] += orders
+    values[1] += revenue
+    values[2] += items
+
+  return totals
+
+
+def get_watermark():
+  return RollupWatermark.objects.filter(name=WATERMARK).values_list('value', flat=True).first()
+
+
+# The distinct hours in which the orders were created
+def _created_hours(orders):
+  return orders.order_by().annotate(hour=TruncHour('created_at', tzinfo=dt_timezone.utc)).values_list('hour', flat=True).distinct()
+
+
+"""
+  Recomputes the buckets changed since the last refresh and moves the watermark to
+  the start of this one minus lag, so that orders committed by transactions that
+  were still open when we read are picked up next time. full=True recomputes
+  every bucket. Returns the number of hours and days recomputed.
+"""
+def refresh(lag=timedelta(seconds=60), full=False):
+  started = timezone.now()
+  watermark = None if full else get_watermark()
+
+  if watermark is not None:
+    changed = _created_hours(Order.objects.filter(last_updated__gte=watermark))
+  else:
+    # every bucket is built, the ones whose orders are all archived too
+    changed = _created_hours(Order.objects.all()).union(_created_hours(ArchivedOrder.objects.all()))
+
+  hours = list(changed.order_by('hour'))
+  days = sorted({_floor(hour, DAY) for hour in hours})
+
+  if full:
+    HourlyOrderRollup.objects.all().delete()
+    DailyOrderRollup.objects.all().delete()
+
+  for chunk in _chunks(hours, REFRESH_CHUNK_SIZE):
+    ranges = _merge_buckets(chunk, HOUR)
+
+    with transaction.atomic():
+      HourlyOrderRollup.objects.filter(_in_ranges('bucket', ranges)).delete()
+      HourlyOrderRollup.objects.bulk_create([
+        HourlyOrderRollup(bucket=bucket, status=status, orders=orders, revenue=revenue, items=items)
+        for (bucket, status), (orders, revenue, items) in _aggregate_orders(_totals(), ranges, TruncHour).items()
+      ])
+
+  # the days from the hourly rollups, the other hours of a day are still up to date
+  for chunk in _chunks(days, REFRESH_CHUNK_SIZE):
+    ranges = _merge_buckets(chunk, DAY)
+
+    with transaction.atomic():
+      DailyOrderRollup.objects.filter(_in_ranges('bucket', ranges)).delete()
+      DailyOrderRollup.objects.bulk_create([
+        DailyOrderRollup(bucket=bucket, status=status, orders=orders, revenue=revenue, items=items)
+        for (bucket, status), (orders, revenue, items) in _aggregate_rollups(_totals(), HourlyOrderRollup, ranges, DAY).items()
+      ])
+
+  value = started - lag
+  if watermark is not None:
+    value = max(value, watermark)
+  RollupWatermark.objects.update_or_create(name=WATERMARK, defaults={'value': value})
+
+  return len(hours), len(days)
+
+
+"""
+  Orders, revenue and items per bucket of the given granularity ('hour' or 'day')
+  for the orders created between start and end, both included. Returns the buckets
+  in order as (bucket start, {status: [orders, revenue, items]}) pairs.
+"""
+def order_volume(start, end, granularity):
+  if granularity not in GRANULARITIES:
+    raise InvalidArgumentError('granularity')
+
+  if end < start:
+    raise InvalidArgumentError('end_date')
+
+  step, trunc = GRANULARITIES[granularity]
+  end = end + timedelta(microseconds=1) # exclusive from here on
+  watermark = get_watermark()
+
+  # whole hours of the range that are covered by the rollups
+  first_hour = _ceil(start, HOUR)
+  last_hour = _floor(end, HOUR)
+  if watermark is not None:
+    last_hour = min(last_hour, _floor(watermark, HOUR))
+
+  if watermark is None or first_hour >= last_hour:
+    daily, hourly, raw = [], [], [(start, end)]
+  else:
+    first_day, last_day = _ceil(first_hour, DAY), _floor(last_hour, DAY)
+    if step == DAY and first_day < last_day: # an hourly report can't use the daily rollups
+      daily, hourly = [(first_day, last_day)], [(first_hour, first_day), (last_day, last_hour)]
+    else:
+      daily, hourly = [], [(first_hour, last_hour)]
+    raw = [(start, first_hour), (last_hour, end)]
+
+  def non_empty(ranges):
+    return [(range_start, range_end) for range_start, range_end in ranges if range_start < range_end]
+
+  totals = _totals()
+  _aggregate_rollups(totals, DailyOrderRollup, non_empty(daily), step)
+  _aggregate_rollups(totals, HourlyOrderRollup, non_empty(hourly), step)
+  _aggregate_orders(totals, non_empty(raw), trunc)
+
+  buckets = defaultdict(dict)
+  for (bucket, status), values in sorted(totals.items()):
+    buckets[bucket][status] = values
+
+  return sorted(buckets.items())
@@ -0,0 +1,62 @@
+"""
+  Query planning of the order search (OrderManager.search, order/search/).
+
+  A search combines a customer, a set of statuses, a created_at range and a totals
+  range. plan() picks the composite index of Order (see its Meta) that the criteria
+  lead with, and orders the rows the way that index stores them, so the page query is
+  a range scan that stops after page_size + 1 rows:
+    customer: order_customer_status_idx (order_customer, status, -created_at)
+    statuses: order_status_created_idx (status, -created_at)
+    created_at range: order_created_at_idx (created_at)
+  The index also gives the direction of the id tie-breaker: SQLite keeps the rowid
+  ascending inside every index entry, so -created_at goes with id on the first two and
+  with -id on the third. The totals range is not indexed, it only filters the rows
+  that the index scan reads.
+
+  With several statuses, or a customer and no status, the rows are not in created_at
+  order in the index and are sorted before the first page is returned. For a customer
+  the sort is bounded by their orders; without one it covers every order of the
+  statuses in the date range, and the plan carries a warning. A search without a
+  customer, status or date criterion would scan the whole table and is rejected.
+"""
+from .exceptions import SearchPlanError
+
+CUSTOMER_INDEX = 'order_customer_status_idx'
+STATUS_INDEX = 'order_status_created_idx'
+CREATED_AT_INDEX = 'order_created_at_idx'
+
+UNBOUNDED_SORT = 'every order of the statuses is sorted, add a customer or a date range or search one status'
+
+
+class SearchPlan:
+
+  def __init__(self, index, ordering, sorts=False, warning=None):
+    self.index = index
+    self.ordering = ordering
+    self.sorts = sorts # the rows are sorted after the index scan
+    self.warning = warning
+
+
+def plan(customer_id=None, statuses=None, start_date=None, end_date=None, newest_first=True):
+  one_status = statuses is not None and len(set(statuses)) == 1
+
+  if customer_id is not None:
+    return SearchPlan(CUSTOMER_INDEX, _ordering(newest_first, index_descending=True), sorts=not one_status)
+
+  if statuses is not None:
+    dated = start_date is not None or end_date is not None
+    return SearchPlan(
+      STATUS_INDEX, _ordering(newest_first, index_descending=True), sorts=not one_status,
+      warning=None if one_status or dated else UNBOUNDED_SORT)
+
+  if start_date is not None or end_date is not None:
+    return SearchPlan(CREATED_AT_INDEX, _ordering(newest_first, index_descending=False))
+
+  raise SearchPlanError('A search needs a customer_id, a status or a date range, it would scan every order')
+
+
+# created_at in the requested direction. The scan of an index keeps its ids ascending
+# when it follows the created_at direction of the index, descending when it goes backwards
+def _ordering(newest_first, index_descending):
+  forward = newest_first == index_descending
+  return ('-created_at' if newest_first else 'created_at', 'id' if forward else '-id')
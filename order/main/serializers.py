@@ -1,7 +1,37 @@
 import functools
+from decimal import Decimal
 
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
 from rest_framework import serializers
-from .models import Order, OrderCustomer, OrderItems
+from .managers import OrdersWithArchive
+from .metrics import serializer_timer
+from .models import ArchivedOrder, ArchivedOrderItems, CustomerOrderSummary, Order, OrderChange, OrderCustomer, OrderItems
+
+class CustomerOrderSummarySerializer(serializers.ModelSerializer):
+  statuses = serializers.SerializerMethodField() # order count of every status, by display name
+
+  class Meta:
+    model = CustomerOrderSummary
+    fields = ('customer', 'orders', 'statuses', 'lifetime_totals', 'last_order_at',)
+
+  def get_statuses(self, obj):
+    return {
+      label: getattr(obj, CustomerOrderSummary.objects.status_field(value))
+      for value, label in Order.ORDER_STATUS
+    }
+
+
+# An entry of the change feed, statuses by display name
+class OrderChangeSerializer(serializers.ModelSerializer):
+  cursor = serializers.IntegerField(source='id')
+  previous_status = serializers.CharField(source='get_previous_status_display') # None for a new order
+  status = serializers.CharField(source='get_status_display')
+
+  class Meta:
+    model = OrderChange
+    fields = ('cursor', 'order_id', 'customer_id', 'previous_status', 'status', 'changed_at',)
+
 
 class OrderCustomerSerializer(serializers.ModelSerializer):
   class Meta:
@@ -15,6 +45,60 @@ class OrderItemSerializer(serializers.ModelSerializer):
     fields = ('name', 'price_per_unit', 'product_id', 'quantity', )
 
 
+# Used when OrderSerializer is instantiated with many=True. Creating a list of orders
+# inserts all the customers, all the orders and all the items with one bulk
+# statement each, in a single transaction, instead of three statements per order
+class OrderListSerializer(serializers.ListSerializer):
+  RESTORE_CHUNK = 500
+
+  def create(self, validated_data):
+    with transaction.atomic():
+      customers = OrderCustomer.objects.bulk_create(
+        [OrderCustomer(**data['order_customer']) for data in validated_data])
+
+      orders = Order.objects.bulk_create([
+        Order(order_customer=customer, **self._order_fields(data))
+        for customer, data in zip(customers, validated_data)
+      ])
+      self._restore_created_at(orders, validated_data)
+
+      OrderItems.objects.bulk_create([
+        OrderItems(order=order, **item)
+        for order, data in zip(orders, validated_data)
+        for item in data['items']
+      ])
+
+      Order.objects.orders_created(orders)
+
+    return orders
+
+  @property
+  def data(self):
+    with serializer_timer():
+      return super().data
+
+  @staticmethod
+  def _order_fields(data):
+    return {key: value for key, value in data.items() if key not in ('order_customer', 'items')}
+
+  # created_at is auto_now_add, the insert overwrites it. Orders imported with their original
+  # creation time (see importer.py) get it back with one UPDATE per RESTORE_CHUNK orders,
+  # before the bookkeeping reads it. The chunks keep the statement under the SQLite variable limit
+  @classmethod
+  def _restore_created_at(cls, orders, validated_data):
+    created_at = {order.pk: data['created_at'] for order, data in zip(orders, validated_data) if data.get('created_at')}
+    pks = list(created_at)
+
+    for start in range(0, len(pks), cls.RESTORE_CHUNK):
+      chunk = pks[start:start + cls.RESTORE_CHUNK]
+      Order.objects.filter(pk__in=chunk).update(created_at=Case(
+        *(When(pk=pk, then=Value(created_at[pk])) for pk in chunk),
+        output_field=DateTimeField()))
+
+    for order in orders:
+      order.created_at = created_at.get(order.pk, order.created_at)
+
+
 class OrderSerializer(serializers.ModelSerializer):
   items = OrderItemSerializer(many=True)
   order_customer=OrderCustomerSerializer()
@@ -22,12 +106,19 @@ class OrderSerializer(serializers.ModelSerializer):
 
   class Meta:
     depth = 1 #depth of the relationships that should be traversed before the serialization
+    list_serializer_class = OrderListSerializer
     model = Order
     fields = ('items', 'totals', 'order_customer', 'created_at', 'id', 'status',)
   
   def get_status(self, obj): # method that will get the display value for the ChoiceField status
     return obj.get_status_display()
 
+  # the rendering time is reported by the metrics middleware
+  @property
+  def data(self):
+    with serializer_timer():
+      return super().data
+
   # helper method which we are going to use to create and prepare  the order item's objects prior to performing a bulk insert
   # The first argument will be a dictionary with the data about the OrderItem and an order argument with an object of type Order
   def _create_order_item(self, item, order):
@@ -35,6 +126,7 @@ class OrderSerializer(serializers.ModelSerializer):
     return OrderItems(**item)
 
   # will be called automatically every time we call the serializer's save method:
+  @transaction.atomic # the order and the data derived from it are written together
   def create(self, validated_data):
     validated_customer = validated_data.pop('order_customer')
     validated_items= validated_data.pop('items') # An array of Items
@@ -62,6 +154,129 @@ class OrderSerializer(serializers.ModelSerializer):
     mapped_items = map(functools.partial(self._create_order_item, order=order), validated_items)
 
     OrderItems.objects.bulk_create(mapped_items)
+    Order.objects.orders_created([order])
 
     return order
   
+
+"""
+  Read-only fast path for the list endpoints.
+
+  Builds exactly the same data as OrderSerializer(many=True), but from values() rows:
+  no model instances are created and the per-field machinery of the nested
+  serializers is skipped. The status label comes from a table computed once.
+  Use prepare() to turn a manager queryset into the rows this serializer expects.
+
+  A sparse fieldset (a subset of FIELDS) keeps only those keys: prepare() reads only
+  the columns they need, without the customer join when order_customer is left
+  out, and the items are not queried when items is left out.
+"""
+class OrderValuesSerializer:
+  FIELDS = ('items', 'totals', 'order_customer', 'created_at', 'id', 'status') # OrderSerializer.Meta.fields
+  CUSTOMER_FIELDS = ('order_customer__customer_id', 'order_customer__email', 'order_customer__name')
+  # the columns of the ordering of every list, the pagination cursor reads them, and
+  # last_updated for the validators of the page (see view_helper.page_validators)
+  KEY_FIELDS = ('id', 'created_at', 'status', 'last_updated')
+  ORDER_FIELDS = KEY_FIELDS + ('totals',) + CUSTOMER_FIELDS
+  ITEM_FIELDS = ('order_id', 'name', 'price_per_unit', 'product_id', 'quantity')
+
+  STATUS_LABELS = dict(Order.ORDER_STATUS)
+  CENTS = Decimal('0.01')
+
+  _datetime_field = serializers.DateTimeField()
+
+  # fields is a set of FIELDS, None for all of them
+  def __init__(self, rows, fields=None):
+    self.rows = rows
+    self.fields = self.FIELDS if fields is None else [field for field in self.FIELDS if field in fields]
+
+  # The queryset keeps its filters and ordering, the relations are read by the serializer.
+  # An OrdersWithArchive gives one of rows querysets, the archived rows are flagged so
+  # their items are read from the archive
+  @classmethod
+  def prepare(cls, queryset, fields=None):
+    if isinstance(queryset, OrdersWithArchive):
+      return queryset.map(lambda source: cls.prepare(source, fields))
+
+    columns = cls.ORDER_FIELDS
+    if fields is not None:
+      columns = cls.KEY_FIELDS + (('totals',) if 'totals' in fields else ()) + \
+        (cls.CUSTOMER_FIELDS if 'order_customer' in fields else ())
+
+    queryset = queryset.select_related(None).prefetch_related(None)
+    if queryset.model is ArchivedOrder:
+      return queryset.annotate(archived=Value(True)).values(*columns, 'archived')
+
+    return queryset.values(*columns)
+
+  @property
+  def data(self):
+    with serializer_timer():
+      items = {}
+      if 'items' in self.fields:
+        items = self._items_by_order(OrderItems, [row['id'] for row in self.rows if not row.get('archived')])
+        items.update(self._items_by_order(ArchivedOrderItems, [row['id'] for row in self.rows if row.get('archived')]))
+
+      if self.fields is self.FIELDS:
+        return [self._order(row, items.get(row['id'], [])) for row in self.rows]
+
+      return [self._sparse_order(row, items.get(row['id'], [])) for row in self.rows]
+
+  def _items_by_order(self, model, order_ids):
+    items = {}
+    if not order_ids:
+      return items
+
+    rows = model.objects.filter(order_id__in=order_ids).order_by('order_id', 'id').values_list(*self.ITEM_FIELDS)
+    for order_id, name, price_per_unit, product_id, quantity in rows:
+      items.setdefault(order_id, []).append({
+        'name': name,
+        'price_per_unit': self._decimal(price_per_unit),
+        'product_id': product_id,
+        'quantity': quantity,
+      })
+
+    return items
+
+  # Same keys, in the same order, as OrderSerializer.Meta.fields
+  def _order(self, row, items):
+    status = row['status']
+    return {
+      'items': items,
+      'totals': self._decimal(row['totals']),
+      'order_customer': {
+        'customer_id': row['order_customer__customer_id'],
+        'email': row['order_customer__email'],
+        'name': row['order_customer__name'],
+      },
+      'created_at': self._datetime_field.to_representation(row['created_at']),
+      'id': row['id'],
+      'status': self.STATUS_LABELS.get(status, status),
+    }
+
+  def _sparse_order(self, row, items):
+    order = {}
+
+    for field in self.fields:
+      if field == 'items':
+        order['items'] = items
+      elif field == 'totals':
+        order['totals'] = self._decimal(row['totals'])
+      elif field == 'order_customer':
+        order['order_customer'] = {
+          'customer_id': row['order_customer__customer_id'],
+          'email': row['order_customer__email'],
+          'name': row['order_customer__name'],
+        }
+      elif field == 'created_at':
+        order['created_at'] = self._datetime_field.to_representation(row['created_at'])
+      elif field == 'id':
+        order['id'] = row['id']
+      else:
+        order['status'] = self.STATUS_LABELS.get(row['status'], row['status'])
+
+    return order
+
+  @classmethod
+  def _decimal(cls, value):
+    return f'{value.quantize(cls.CENTS):f}'
@@ -1,13 +1,61 @@
-from django.test import TestCase
+import csv
+import json
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import QuerySet
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from load_test import histogram, percentile
 
-from .models import OrderCustomer, Order
+from .async_views import run_in_thread
+from .authentication import TokenCache, token_cache
+from . import benchmarks, group_commit, idempotency, rollups, search
+from .renderers import msgpack
+from .cache import ORDERS_CACHE, stats as cache_stats
+from .group_commit import GroupCommitWriter, create_orders
+from .importer import OrderImport, iter_ndjson
+from .managers import OrdersWithArchive
+from .metrics import RequestMetrics, _current as metrics_current, registry as metrics_registry
+from .models import (
+  ArchivedOrder, ArchivedOrderCustomer, ArchivedOrderItems, CustomerOrderSummary, DailyOrderRollup, HourlyOrderRollup,
+  IdempotencyKey, ImportCheckpoint, OrderChange, OrderCustomer, Order, OrderItems, StatusCounter,
+)
+from .pagination import OrderKeysetPagination
+from .serializers import OrderSerializer, OrderValuesSerializer
+from .view_helper import OrderListApiBaseView
 from .status import Status
 
 from .exceptions import OrderAlreadyCompletedError
 from .exceptions import OrderCancellationError
 from .exceptions import InvalidArgumentError
+from .exceptions import OrderConcurrentUpdateError
+
+# Settings for the tests that count queries on the cached endpoints
+NO_ORDERS_CACHE = {
+  'default': { 'BACKEND': 'django.core.cache.backends.locmem.LocMemCache' },
+  ORDERS_CACHE: { 'BACKEND': 'django.core.cache.backends.dummy.DummyCache' },
+}
 
 # Class to Setup data for our Tests
 class OrderModelTestCase(TestCase):
@@ -161,7 +209,7 @@ class OrderModelTestCase(TestCase):
     order = Order.objects.get(pk=1)
 
     Order.objects.set_status(order, Status.Processing)
-      self.assertEqual(Status.Processing.value, order.status)
+    self.assertEqual(Status.Processing.value, order.status)
 
   def test_set_status_on_completed_order(self):
     order = Order.objects.get(pk=2)
@@ -184,4 +232,2077 @@ class OrderModelTestCase(TestCase):
     order = Order.objects.get(pk=1)
 
     with self.assertRaises(InvalidArgumentError):
-      Order.objects.set_status(order, {'status': 1})
\ No newline at end of file
+      Order.objects.set_status(order, {'status': 1})
+
+# Keyset pagination of the order list endpoints
+class OrderPaginationTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='pagination', password='pagination')
+    cls.customer = OrderCustomer.objects.create(customer_id=1, email='customer@mail.com')
+
+    for order_status in (Status.Received, Status.Processing, Status.Received, Status.Shipping, Status.Received):
+      Order.objects.create(order_customer=cls.customer, status=order_status.value)
+
+  def setUp(self):
+    caches[ORDERS_CACHE].clear()
+
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _expected_ids(self):
+    return [order.id for order in Order.objects.get_all_orders_by_customer(self.customer.id)]
+
+  # Following the next cursors visits every order once, in the manager's ordering
+  def test_next_cursor_walks_all_orders(self):
+    url = f'/api/customer/{self.customer.id}/orders/get/?page_size=2'
+    ids = []
+
+    while url:
+      response = self.client.get(url)
+      self.assertEqual(200, response.status_code)
+      self.assertLessEqual(len(response.data['results']), 2)
+
+      ids.extend(order['id'] for order in response.data['results'])
+      url = response.data['next']
+
+    self.assertEqual(self._expected_ids(), ids)
+
+  # The previous cursor returns the page we came from
+  def test_previous_cursor_returns_previous_page(self):
+    first = self.client.get(f'/api/customer/{self.customer.id}/orders/get/?page_size=2')
+    self.assertIsNone(first.data['previous'])
+
+    second = self.client.get(first.data['next'])
+    previous = self.client.get(second.data['previous'])
+
+    self.assertEqual(
+      [order['id'] for order in first.data['results']],
+      [order['id'] for order in previous.data['results']])
+    self.assertIsNone(previous.data['previous'])
+    self.assertEqual(
+      [order['id'] for order in second.data['results']],
+      [order['id'] for order in self.client.get(previous.data['next']).data['results']])
+
+  def test_order_by_status_is_paginated(self):
+    response = self.client.get(f'/api/order/{Status.Received.value}/get/?page_size=2')
+
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(2, len(response.data['results']))
+    self.assertIsNotNone(response.data['next'])
+
+  # The cursor condition starts with a bound on the first ordering column, SQLite seeks
+  # the index to the cursor instead of reading the rows before it
+  def test_cursor_seeks_the_index(self):
+    date_from = timezone.now() - relativedelta(days=1)
+    lists = (
+      (Order.objects.get_orders_by_status(Status.Received), '(status=? AND created_at<?)'),
+      (Order.objects.get_orders_by_period(date_from, timezone.now()), '(created_at>? AND created_at<?)'),
+      (Order.objects.get_all_orders_by_customer(self.customer.id), '(order_customer_id=? AND status>?)'),
+    )
+
+    for queryset, seek in lists:
+      ordering = OrderKeysetPagination().get_ordering(queryset)
+      last = queryset.last()
+      position = [getattr(last, OrderKeysetPagination._field_name(field)) for field in ordering]
+
+      plan = queryset.filter(OrderKeysetPagination._keyset_filter(ordering, position)).explain()
+      self.assertIn(seek, plan)
+      self.assertNotIn('TEMP B-TREE', plan)
+
+  def test_invalid_cursor(self):
+    response = self.client.get(f'/api/customer/{self.customer.id}/orders/get/?cursor=invalid')
+    self.assertEqual(400, response.status_code)
+
+  def test_invalid_page_size(self):
+    response = self.client.get(f'/api/customer/{self.customer.id}/orders/get/?page_size=0')
+    self.assertEqual(400, response.status_code)
+
+
+# The list endpoints must run a constant number of queries however many orders
+# they return: one for the orders joined with their customer, one for the items
+@override_settings(CACHES=NO_ORDERS_CACHE)
+class OrderListQueryCountTestCase(TestCase):
+  LIST_QUERIES = 2
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='queries', password='queries')
+    cls.customer = OrderCustomer.objects.create(customer_id=1, email='customer@mail.com')
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _create_orders(self, count, order_status=Status.Received):
+    for index in range(count):
+      order = Order.objects.create(order_customer=self.customer, status=order_status.value)
+      OrderItems.objects.bulk_create([
+        OrderItems(order=order, product_id=index, name=f'Prod {index}', quantity=1, price_per_unit=10),
+        OrderItems(order=order, product_id=index + 1, name=f'Prod {index + 1}', quantity=2, price_per_unit=5),
+      ])
+
+  def _assert_constant_queries(self, url, order_status=Status.Received):
+    for count in (1, 10):
+      self._create_orders(count, order_status)
+
+      with self.assertNumQueries(self.LIST_QUERIES):
+        response = self.client.get(url)
+
+      self.assertEqual(200, response.status_code)
+      self.assertTrue(all(len(order['items']) == 2 for order in response.data['results']))
+
+  def test_orders_by_customer_queries(self):
+    self._assert_constant_queries(f'/api/customer/{self.customer.id}/orders/get/')
+
+  def test_incomplete_orders_by_customer_queries(self):
+    self._assert_constant_queries(f'/api/customer/{self.customer.id}/orders/incomplet/get')
+
+  def test_completed_orders_by_customer_queries(self):
+    self._assert_constant_queries(f'/api/customer/{self.customer.id}/orders/complete/get', Status.Completed)
+
+  def test_orders_by_status_queries(self):
+    self._assert_constant_queries(f'/api/order/{Status.Received.value}/get/')
+
+  def test_orders_by_period_queries(self):
+    self._create_orders(10)
+    date_from = timezone.now() - relativedelta(days=1)
+    date_to = date_from + relativedelta(days=2)
+
+    with self.assertNumQueries(self.LIST_QUERIES):
+      data = OrderSerializer(Order.objects.get_orders_by_period(date_from, date_to), many=True).data
+
+    self.assertEqual(10, len(data))
+
+
+# Every manager query must be answered from an index: no full table scans and
+# no sorting of the whole result in a temporary b-tree
+@skipUnless(connection.vendor == 'sqlite', 'The query plan assertions use the SQLite EXPLAIN QUERY PLAN output')
+class OrderQueryPlanTestCase(TestCase):
+
+  def assertUsesIndex(self, queryset):
+    plan = queryset.explain()
+
+    self.assertIsNone(re.search(r'\bSCAN main_', plan), msg=f'Full table scan:\n{plan}')
+    self.assertNotIn('TEMP B-TREE', plan, msg=f'Ordering is not served by an index:\n{plan}')
+
+  def test_get_all_orders_by_customer_plan(self):
+    self.assertUsesIndex(Order.objects.get_all_orders_by_customer(1))
+
+  def test_get_customer_incomplete_orders_plan(self):
+    self.assertUsesIndex(Order.objects.get_customer_incomplete_orders(1))
+
+  def test_get_customer_completed_orders_plan(self):
+    self.assertUsesIndex(Order.objects.get_customer_completed_orders(1))
+
+  def test_get_orders_by_status_plan(self):
+    self.assertUsesIndex(Order.objects.get_orders_by_status(Status.Received))
+
+  def test_get_orders_by_period_plan(self):
+    date_from = timezone.now() - relativedelta(days=1)
+    self.assertUsesIndex(Order.objects.get_orders_by_period(date_from, timezone.now()))
+
+  def test_items_by_product_plan(self):
+    self.assertUsesIndex(OrderItems.objects.filter(product_id=1))
+
+
+class OrderExportTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='export', password='export')
+    cls.customer = OrderCustomer.objects.create(customer_id=7, name='Customer', email='customer@mail.com')
+
+    cls.order = Order.objects.create(order_customer=cls.customer, totals=20)
+    OrderItems.objects.bulk_create([
+      OrderItems(order=cls.order, product_id=1, name='Prod 001', quantity=1, price_per_unit=10),
+      OrderItems(order=cls.order, product_id=2, name='Prod 002', quantity=1, price_per_unit=10),
+    ])
+    Order.objects.create(order_customer=cls.customer, status=Status.Processing.value)
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+    self.today = timezone.now().date().isoformat()
+
+  def _export(self, **params):
+    params.setdefault('start_date', self.today)
+    params.setdefault('end_date', self.today)
+    return self.client.get('/api/order/export/', params)
+
+  def test_export_ndjson(self):
+    response = self._export()
+
+    self.assertEqual(200, response.status_code)
+    self.assertTrue(response.streaming)
+
+    lines = b''.join(response.streaming_content).decode().splitlines()
+    orders = [json.loads(line) for line in lines]
+
+    self.assertEqual(2, len(orders))
+    self.assertEqual(self.order.id, orders[0]['id'])
+    self.assertEqual(2, len(orders[0]['items']))
+    self.assertEqual('Processing', orders[1]['status'])
+
+  def test_export_csv(self):
+    response = self._export(output='csv')
+
+    self.assertEqual(200, response.status_code)
+    self.assertEqual('text/csv', response['Content-Type'])
+
+    rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+
+    self.assertEqual('order_id', rows[0][0])
+    self.assertEqual(4, len(rows), msg='Header, two item rows and one row for the order without items')
+    self.assertEqual(['1', 'Prod 001'], rows[1][7:9])
+
+  def test_export_outside_period(self):
+    tomorrow = (timezone.now() + relativedelta(days=1)).date().isoformat()
+    response = self._export(start_date=tomorrow, end_date=tomorrow)
+
+    self.assertEqual(b'', b''.join(response.streaming_content))
+
+  def test_export_with_invalid_arguments(self):
+    self.assertEqual(400, self._export(start_date='yesterday').status_code)
+    self.assertEqual(400, self.client.get('/api/order/export/').status_code)
+    self.assertEqual(400, self._export(output='xml').status_code)
+
+
+class CreateOrderBatchTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='batch', password='batch')
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _order(self, customer_id):
+    return {
+      'items': [
+        { 'name': 'Prod 001', 'price_per_unit': 10, 'product_id': 1, 'quantity': 2 },
+        { 'name': 'Prod 002', 'price_per_unit': 12, 'product_id': 2, 'quantity': 2 },
+      ],
+      'order_customer': { 'customer_id': customer_id, 'email': 'test@test.com', 'name': 'Test User' },
+      'totals': '44.00',
+    }
+
+  def _post(self, orders):
+    return self.client.post('/api/order/batch/add/', orders, format='json')
+
+  def test_create_batch(self):
+    response = self._post([self._order(1), self._order(2)])
+
+    self.assertEqual(201, response.status_code)
+    self.assertEqual(2, len(response.data))
+
+    order = Order.objects.get(pk=response.data[1]['order_id'])
+    self.assertEqual(2, order.order_customer.customer_id)
+    self.assertEqual(2, order.items.count())
+    self.assertEqual(Status.Received.value, order.status)
+
+  # Valid orders are created, the invalid ones report their errors at the same position
+  def test_create_batch_with_invalid_order(self):
+    invalid = self._order(2)
+    del invalid['order_customer']
+
+    response = self._post([self._order(1), invalid, self._order(3)])
+
+    self.assertEqual(207, response.status_code)
+    self.assertIn('order_id', response.data[0])
+    self.assertIn('order_customer', response.data[1]['errors'])
+    self.assertIn('order_id', response.data[2])
+    self.assertEqual(2, Order.objects.count())
+    self.assertEqual(4, OrderItems.objects.count())
+
+  # Savepoint, customers, orders, items, customer summaries (SELECT + INSERT), status counters,
+  # change feed, release: the same whatever the batch size
+  def test_create_batch_queries(self):
+    for size in (1, 50):
+      with self.assertNumQueries(9):
+        self._post([self._order(customer_id) for customer_id in range(size)])
+
+  def test_create_batch_with_invalid_payload(self):
+    self.assertEqual(400, self._post(self._order(1)).status_code)
+    self.assertEqual(400, self._post([]).status_code)
+    self.assertEqual(400, self._post([{}]).status_code)
+
+
+class BulkStatusTransitionTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='bulk', password='bulk')
+    cls.customer = OrderCustomer.objects.create(customer_id=1, email='customer@mail.com')
+
+    cls.received = Order.objects.create(order_customer=cls.customer).id
+    cls.shipping = Order.objects.create(order_customer=cls.customer, status=Status.Shipping.value).id
+    cls.completed = Order.objects.create(order_customer=cls.customer, status=Status.Completed.value).id
+    cls.cancelled = Order.objects.create(order_customer=cls.customer, status=Status.Cancelled.value).id
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+    self.all_ids = [self.received, self.shipping, self.completed, self.cancelled]
+
+  def _status(self, order_id):
+    return Order.objects.get(pk=order_id).status
+
+  def test_concurrent_change_rolls_back_the_bulk_transition(self):
+    orders = Order.objects.select_for_transition(order_ids=self.all_ids)
+    now = timezone.now
+
+    # another request moves an order between the SELECT and the UPDATE
+    def concurrent_change():
+      Order.objects.filter(pk=self.shipping).update(status=Status.Completed.value)
+      return now()
+
+    with mock.patch('main.managers.timezone.now', side_effect=concurrent_change):
+      with self.assertRaises(OrderConcurrentUpdateError) as raised:
+        Order.objects.bulk_set_next_status(orders)
+
+    self.assertIn(f'ID {self.shipping}', str(raised.exception))
+    self.assertEqual(Status.Received.value, self._status(self.received))
+    self.assertEqual(0, OrderChange.objects.filter(order_id=self.received).count())
+
+  def test_bulk_set_status(self):
+    orders = Order.objects.select_for_transition(order_ids=self.all_ids)
+
+    # savepoint, SELECT, UPDATE, customer summary UPDATE, status counters UPDATE, change feed INSERT, release
+    with self.assertNumQueries(7):
+      transitioned, rejected = Order.objects.bulk_set_status(orders, Status.Shipping)
+
+    self.assertEqual([self.received, self.shipping], sorted(transitioned))
+    self.assertEqual([self.completed, self.cancelled], sorted(rejected))
+    self.assertEqual(Status.Shipping.value, self._status(self.received))
+    self.assertEqual(Status.Completed.value, self._status(self.completed))
+
+  def test_bulk_set_next_status(self):
+    transitioned, rejected = Order.objects.bulk_set_next_status(Order.objects.select_for_transition(order_ids=self.all_ids))
+
+    self.assertEqual([self.received, self.shipping], sorted(transitioned))
+    self.assertEqual(Status.Processing.value, self._status(self.received))
+    self.assertEqual(Status.Completed.value, self._status(self.shipping))
+    self.assertEqual(Status.Cancelled.value, self._status(self.cancelled))
+
+  # Only Received orders can be cancelled
+  def test_bulk_cancel_orders(self):
+    transitioned, rejected = Order.objects.bulk_cancel_orders(Order.objects.select_for_transition(order_ids=self.all_ids))
+
+    self.assertEqual([self.received], transitioned)
+    self.assertEqual(Status.Cancelled.value, self._status(self.received))
+    self.assertEqual(Status.Shipping.value, self._status(self.shipping))
+
+  def test_select_for_transition_with_invalid_arguments(self):
+    with self.assertRaises(InvalidArgumentError):
+      Order.objects.select_for_transition()
+
+    with self.assertRaises(InvalidArgumentError):
+      Order.objects.select_for_transition(order_ids=['1'])
+
+  def test_bulk_set_status_endpoint_by_filter(self):
+    today = timezone.now().date().isoformat()
+    response = self.client.post(
+      f'/api/order/bulk/status/{Status.Completed.value}/set/',
+      { 'status': Status.Shipping.value, 'start_date': today, 'end_date': today },
+      format='json')
+
+    self.assertEqual(200, response.status_code)
+    self.assertEqual({ 'transitioned': [self.shipping], 'rejected': [] }, response.data)
+
+  # Unknown ids are reported as rejected
+  def test_bulk_cancel_endpoint_by_ids(self):
+    response = self.client.post('/api/order/bulk/cancel/', { 'order_ids': [self.received, self.completed, 999] }, format='json')
+
+    self.assertEqual(200, response.status_code)
+    self.assertEqual([self.received], response.data['transitioned'])
+    self.assertEqual([self.completed, 999], response.data['rejected'])
+
+  def test_bulk_endpoint_with_invalid_body(self):
+    self.assertEqual(400, self.client.post('/api/order/bulk/status/next/', {}, format='json').status_code)
+    self.assertEqual(400, self.client.post('/api/order/bulk/status/next/', { 'status': 42 }, format='json').status_code)
+    self.assertEqual(400, self.client.post('/api/order/bulk/status/9/set/', { 'order_ids': [1] }, format='json').status_code)
+
+
+# Status transitions are a single conditional UPDATE on status and last_updated
+class OrderCompareAndSetTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='transition', password='transition')
+    cls.customer = OrderCustomer.objects.create(customer_id=1, email='customer@mail.com')
+    cls.order_id = Order.objects.create(order_customer=cls.customer).id
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  # One UPDATE for the order, one for the customer summary, one for the status counters and
+  # the change feed INSERT, in a savepoint
+  def test_set_status_queries(self):
+    order = Order.objects.get(pk=self.order_id)
+
+    with self.assertNumQueries(6):
+      Order.objects.set_status(order, Status.Shipping)
+
+    self.assertEqual(Status.Shipping.value, Order.objects.get(pk=self.order_id).status)
+
+  # The second worker read the order before the first one changed it
+  def test_set_next_status_conflict(self):
+    first = Order.objects.get(pk=self.order_id)
+    second = Order.objects.get(pk=self.order_id)
+
+    Order.objects.set_next_status(first)
+
+    with self.assertRaises(OrderConcurrentUpdateError):
+      Order.objects.set_next_status(second)
+
+    self.assertEqual(Status.Processing.value, Order.objects.get(pk=self.order_id).status)
+
+  def test_transitions_after_refresh(self):
+    order = Order.objects.get(pk=self.order_id)
+
+    Order.objects.set_next_status(order)
+    Order.objects.set_next_status(order)
+
+    self.assertEqual(Status.Payment_Complete.value, Order.objects.get(pk=self.order_id).status)
+
+  def test_set_status_endpoint_conflict(self):
+    stale = Order.objects.get(pk=self.order_id)
+    Order.objects.set_next_status(Order.objects.get(pk=self.order_id))
+
+    # the view reads the order just before another request changes it
+    with mock.patch('main.views.get_object_or_404', return_value=stale):
+      response = self.client.post(f'/api/order/{self.order_id}/status/next/')
+
+    self.assertEqual(409, response.status_code)
+    self.assertEqual(Status.Processing.value, Order.objects.get(pk=self.order_id).status)
+
+  def test_set_status_endpoint(self):
+    response = self.client.post(f'/api/order/{self.order_id}/status/{Status.Shipping.value}/set/')
+
+    self.assertEqual(204, response.status_code)
+    self.assertEqual(Status.Shipping.value, Order.objects.get(pk=self.order_id).status)
+
+  def test_set_status_endpoint_requires_authentication(self):
+    response = APIClient().post(f'/api/order/{self.order_id}/status/next/')
+    self.assertEqual(401, response.status_code)
+
+
+class OrderListCacheTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='cache', password='cache')
+    cls.customer = OrderCustomer.objects.create(customer_id=1, email='customer@mail.com')
+    cls.order = Order.objects.create(order_customer=cls.customer)
+
+  def setUp(self):
+    caches[ORDERS_CACHE].clear()
+    cache_stats.reset()
+
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+    self.url = f'/api/customer/{self.customer.id}/orders/get/'
+
+  def test_second_request_is_served_from_cache(self):
+    first = self.client.get(self.url)
+
+    with self.assertNumQueries(0):
+      second = self.client.get(self.url)
+
+    self.assertEqual(first.data, second.data)
+    self.assertEqual({ 'hits': 1, 'misses': 1, 'hit_ratio': 0.5 }, cache_stats.as_dict())
+
+  # Pages are cached on their own
+  def test_query_string_is_part_of_the_key(self):
+    self.client.get(self.url)
+    self.client.get(f'{self.url}?page_size=1')
+
+    self.assertEqual(2, cache_stats.misses)
+
+  def test_status_transition_invalidates_customer_lists(self):
+    self.client.get(self.url)
+    self.client.get(f'/api/customer/{self.customer.id}/orders/incomplet/get')
+
+    with self.captureOnCommitCallbacks(execute=True):
+      Order.objects.set_next_status(Order.objects.get(pk=self.order.id))
+
+    response = self.client.get(self.url)
+    self.assertEqual('Processing', response.data['results'][0]['status'])
+
+    response = self.client.get(f'/api/customer/{self.customer.id}/orders/incomplet/get')
+    self.assertEqual('Processing', response.data['results'][0]['status'])
+    self.assertEqual(0, cache_stats.hits)
+
+  def test_bulk_transition_invalidates_customer_lists(self):
+    self.client.get(self.url)
+
+    with self.captureOnCommitCallbacks(execute=True):
+      Order.objects.bulk_cancel_orders(Order.objects.select_for_transition(order_ids=[self.order.id]))
+
+    self.assertEqual('Cancelled', self.client.get(self.url).data['results'][0]['status'])
+
+  # A transition commits while the list is read: the stale response isn't cached under
+  # the new version
+  def test_change_committed_during_the_read(self):
+    paginate = OrderListApiBaseView.paginate_queryset
+
+    def paginate_then_transition(view, queryset):
+      page = paginate(view, queryset)
+      with self.captureOnCommitCallbacks(execute=True):
+        Order.objects.set_next_status(Order.objects.get(pk=self.order.id))
+      return page
+
+    with mock.patch.object(OrderListApiBaseView, 'paginate_queryset', paginate_then_transition):
+      self.assertEqual('Received', self.client.get(self.url).data['results'][0]['status'])
+
+    self.assertEqual('Processing', self.client.get(self.url).data['results'][0]['status'])
+    self.assertEqual(0, cache_stats.hits)
+
+  def test_stats_endpoint(self):
+    self.client.get(self.url)
+    self.client.get(self.url)
+
+    response = self.client.get('/api/cache/orders/stats/')
+    self.assertEqual({ 'hits': 1, 'misses': 1, 'hit_ratio': 0.5 }, response.data)
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='token', password='token')
+
+  def setUp(self):
+    token_cache.clear()
+    self.token = Token.objects.create(user=self.user)
+    self.url = '/api/cache/orders/stats/' # runs no query of its own
+
+  def _get(self, token=None):
+    return self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {token or self.token.key}')
+
+  # TokenAuthentication costs one query on every request, the cached version only on the first one
+  def test_saved_query_per_request(self):
+    for _ in range(3):
+      with self.assertNumQueries(1):
+        TokenAuthentication().authenticate_credentials(self.token.key)
+
+    with self.assertNumQueries(1):
+      self.assertEqual(200, self._get().status_code)
+
+    for _ in range(3):
+      with self.assertNumQueries(0):
+        self.assertEqual(200, self._get().status_code)
+
+  def test_deleted_token_is_rejected(self):
+    self._get()
+    self.token.delete()
+
+    self.assertEqual(401, self._get(self.token.key).status_code)
+
+  def test_inactive_user_is_rejected(self):
+    self._get()
+    self.user.is_active = False
+    self.user.save()
+
+    self.assertEqual(401, self._get().status_code)
+
+  def test_expired_entry(self):
+    cache = TokenCache(size=10, ttl=0)
+    cache.set('key', (self.user, self.token))
+
+    self.assertIsNone(cache.get('key'))
+
+  def test_least_recently_used_entry_is_evicted(self):
+    cache = TokenCache(size=2, ttl=60)
+    cache.set('first', (self.user, self.token))
+    cache.set('second', (self.user, self.token))
+    cache.get('first')
+    cache.set('third', (self.user, self.token))
+
+    self.assertIsNone(cache.get('second'))
+    self.assertIsNotNone(cache.get('first'))
+
+  def test_shared_cache(self):
+    cache = TokenCache(size=10, ttl=60, shared_cache='default')
+    cache.set('key', (self.user, self.token))
+    cache.clear()
+
+    user, token = cache.get('key')
+    self.assertEqual(self.user.pk, user.pk)
+
+    cache.delete_user(self.user.pk)
+    self.assertIsNone(caches['default'].get('auth:token:key'))
+
+
+class RequestMetricsTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='metrics', password='metrics')
+    cls.customer = OrderCustomer.objects.create(customer_id=1, email='customer@mail.com')
+    Order.objects.create(order_customer=cls.customer)
+
+  def setUp(self):
+    metrics_registry.reset()
+    caches[ORDERS_CACHE].clear()
+
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _metrics(self):
+    response = self.client.get('/api/metrics')
+    self.assertEqual(200, response.status_code)
+    return response.content.decode()
+
+  def test_request_is_recorded_by_route(self):
+    self.client.get(f'/api/customer/{self.customer.id}/orders/get/')
+    self.client.get(f'/api/customer/{self.customer.id + 1}/orders/get/')
+
+    metrics = self._metrics()
+    label = 'route="api/customer/<int:customer_id>/orders/get/"'
+
+    self.assertIn(f'order_request_duration_seconds_count{{{label}}} 2', metrics)
+    # orders and items for the first customer, the second one has no orders to prefetch for
+    self.assertIn(f'order_request_db_queries_sum{{{label}}} 3', metrics)
+    self.assertIn(f'order_request_db_queries_bucket{{{label},le="+Inf"}} 2', metrics)
+    self.assertIn(f'order_request_serializer_duration_seconds_count{{{label}}} 2', metrics)
+    self.assertIn('order_cache_requests_total{result="miss"} 2', metrics)
+
+  def test_serializer_time_is_measured(self):
+    request_metrics = RequestMetrics()
+    token = metrics_current.set(request_metrics)
+    try:
+      OrderSerializer(Order.objects.with_details(), many=True).data
+    finally:
+      metrics_current.reset(token)
+
+    self.assertGreater(request_metrics.serializer_time, 0)
+
+  @override_settings(METRICS_SAMPLE_RATE=0)
+  def test_sampled_out_requests_are_not_recorded(self):
+    self.client.get(f'/api/customer/{self.customer.id}/orders/get/')
+
+    self.assertNotIn('route=', self._metrics())
+
+
+class OrderValuesSerializerTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    customer = OrderCustomer.objects.create(customer_id=3, name='Customer', email='customer@mail.com')
+
+    for index, order_status in enumerate(Status):
+      order = Order.objects.create(order_customer=customer, status=order_status.value, totals=f'{index}9.5')
+      OrderItems.objects.bulk_create([
+        OrderItems(order=order, product_id=product_id, name=f'Prod {product_id}', quantity=product_id, price_per_unit='1.1')
+        for product_id in range(index)
+      ])
+
+  # Must render exactly the same JSON as OrderSerializer
+  def test_output_is_identical(self):
+    renderer = JSONRenderer()
+    orders = Order.objects.get_all_orders_by_customer(OrderCustomer.objects.get().id)
+
+    expected = renderer.render(OrderSerializer(orders, many=True).data)
+    output = renderer.render(OrderValuesSerializer(list(OrderValuesSerializer.prepare(orders))).data)
+
+    self.assertEqual(expected, output)
+
+  def test_two_queries(self):
+    orders = Order.objects.get_orders_by_status(Status.Received)
+
+    with self.assertNumQueries(2):
+      data = OrderValuesSerializer(list(OrderValuesSerializer.prepare(orders))).data
+
+    self.assertEqual('Received', data[0]['status'])
+
+  def test_empty_list(self):
+    with self.assertNumQueries(0):
+      self.assertEqual([], OrderValuesSerializer([]).data)
+
+
+class CustomerOrderSummaryTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='summary', password='summary')
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _create_order(self, totals='10.00'):
+    serializer = OrderSerializer(data={
+      'items': [{ 'name': 'Prod 001', 'price_per_unit': totals, 'product_id': 1, 'quantity': 1 }],
+      'order_customer': { 'customer_id': 1, 'email': 'test@test.com', 'name': 'Test User' },
+      'totals': totals,
+    })
+    self.assertTrue(serializer.is_valid())
+    return serializer.save()
+
+  def _summary(self, customer_id):
+    return CustomerOrderSummary.objects.get(pk=customer_id)
+
+  def test_created_order_is_counted(self):
+    order = self._create_order('12.50')
+    summary = self._summary(order.order_customer_id)
+
+    self.assertEqual(1, summary.orders)
+    self.assertEqual(1, summary.received)
+    self.assertEqual(Decimal('12.50'), summary.lifetime_totals)
+    self.assertEqual(order.created_at, summary.last_order_at)
+
+  def test_transitions_move_the_counters(self):
+    order = self._create_order()
+
+    Order.objects.set_next_status(order)
+    Order.objects.set_status(order, Status.Shipping)
+    summary = self._summary(order.order_customer_id)
+
+    self.assertEqual((0, 0, 1), (summary.received, summary.processing, summary.shipping))
+
+  def test_cancelled_orders_are_not_in_the_totals(self):
+    order = self._create_order('10.00')
+    Order.objects.bulk_cancel_orders(Order.objects.select_for_transition(order_ids=[order.id]))
+    summary = self._summary(order.order_customer_id)
+
+    self.assertEqual((0, 1), (summary.received, summary.cancelled))
+    self.assertEqual(Decimal('0.00'), summary.lifetime_totals)
+
+  # Orders created directly in the database are added to an existing summary
+  def test_existing_summary_is_updated(self):
+    order = self._create_order('5.00')
+    second = Order.objects.create(order_customer_id=order.order_customer_id, totals=Decimal('7.00'))
+    Order.objects.orders_created([second])
+    summary = self._summary(order.order_customer_id)
+
+    self.assertEqual((2, 2), (summary.orders, summary.received))
+    self.assertEqual(Decimal('12.00'), summary.lifetime_totals)
+    self.assertEqual(second.created_at, summary.last_order_at)
+
+  # One summary UPDATE however many customers the orders belong to
+  def test_bulk_transition_across_customers(self):
+    customers = OrderCustomer.objects.bulk_create([
+      OrderCustomer(customer_id=number, email=f'customer{number}@mail.com') for number in range(150)])
+    orders = Order.objects.bulk_create([Order(order_customer=customer, totals=Decimal('2.50')) for customer in customers])
+    Order.objects.orders_created(orders)
+
+    # savepoint, SELECT, UPDATE, customer summary UPDATE, status counters UPDATE, change feed INSERT, release
+    with self.assertNumQueries(7):
+      transitioned, _ = Order.objects.bulk_cancel_orders(Order.objects.select_for_transition(order_ids=[order.id for order in orders]))
+
+    self.assertEqual(150, len(transitioned))
+    summaries = CustomerOrderSummary.objects.filter(pk__in=[customer.id for customer in customers])
+    self.assertEqual({(1, 0, 1, Decimal('0.00'))}, {
+      (summary.orders, summary.received, summary.cancelled, summary.lifetime_totals) for summary in summaries})
+
+  def test_orders_created_for_existing_summaries(self):
+    customers = OrderCustomer.objects.bulk_create([
+      OrderCustomer(customer_id=number, email=f'customer{number}@mail.com') for number in range(3)])
+    Order.objects.orders_created(Order.objects.bulk_create([Order(order_customer=customer) for customer in customers]))
+    orders = Order.objects.bulk_create([
+      Order(order_customer=customer, totals=Decimal(index + 1), status=Status.Processing.value)
+      for index, customer in enumerate(customers)])
+
+    # SELECT of the existing summaries and one UPDATE of them
+    with self.assertNumQueries(2):
+      CustomerOrderSummary.objects.record_created(orders)
+
+    for index, (customer, order) in enumerate(zip(customers, orders)):
+      summary = self._summary(customer.id)
+      self.assertEqual((2, 1, 1), (summary.orders, summary.received, summary.processing))
+      self.assertEqual(Decimal(index + 1), summary.lifetime_totals)
+      self.assertEqual(order.created_at, summary.last_order_at)
+
+  def test_rebuild_matches_incremental_summary(self):
+    orders = [self._create_order(totals) for totals in ('1.00', '2.00', '3.00')]
+    Order.objects.set_next_status(orders[0])
+    Order.objects.cancel_order(orders[1])
+    Order.objects.filter(pk=orders[2].pk).update(status=Status.Completed.value) # bypasses the bookkeeping
+
+    expected = {
+      orders[0].order_customer_id: (1, 0, 1, 0, 0, Decimal('1.00')),
+      orders[1].order_customer_id: (1, 0, 0, 0, 1, Decimal('0.00')),
+      orders[2].order_customer_id: (1, 0, 0, 1, 0, Decimal('3.00')),
+    }
+
+    out = StringIO()
+    call_command('rebuild_customer_summaries', stdout=out)
+    self.assertIn('Rebuilt 3 customer summaries', out.getvalue())
+
+    for customer_id, values in expected.items():
+      summary = self._summary(customer_id)
+      self.assertEqual(values, (
+        summary.orders, summary.received, summary.processing, summary.completed, summary.cancelled, summary.lifetime_totals))
+
+  def test_summary_endpoint(self):
+    order = self._create_order('10.00')
+
+    with self.assertNumQueries(1):
+      response = self.client.get(f'/api/customer/{order.order_customer_id}/summary')
+
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(1, response.data['orders'])
+    self.assertEqual(1, response.data['statuses']['Received'])
+    self.assertEqual(0, response.data['statuses']['Payment complete'])
+    self.assertEqual('10.00', response.data['lifetime_totals'])
+
+  def test_summary_endpoint_unknown_customer(self):
+    self.assertEqual(404, self.client.get('/api/customer/999/summary').status_code)
+
+
+class StatusCounterTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='counters', password='counters')
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _create_orders(self, count):
+    serializer = OrderSerializer(data=[{
+      'items': [{ 'name': 'Prod 001', 'price_per_unit': 10, 'product_id': 1, 'quantity': 1 }],
+      'order_customer': { 'customer_id': 1, 'email': 'test@test.com', 'name': 'Test User' },
+      'totals': 10,
+    } for _ in range(count)], many=True)
+    self.assertTrue(serializer.is_valid())
+    return serializer.save()
+
+  def test_counters_follow_creations_and_transitions(self):
+    orders = self._create_orders(4)
+    Order.objects.set_next_status(orders[0])
+    Order.objects.cancel_order(orders[1])
+    Order.objects.bulk_set_status(Order.objects.select_for_transition(order_ids=[orders[2].id]), Status.Shipping)
+
+    depths = StatusCounter.objects.depths()
+
+    self.assertEqual(1, depths[Status.Received])
+    self.assertEqual(1, depths[Status.Processing])
+    self.assertEqual(1, depths[Status.Shipping])
+    self.assertEqual(1, depths[Status.Cancelled])
+    self.assertEqual(0, depths[Status.Completed])
+    self.assertEqual([], StatusCounter.objects.reconcile(repair=False))
+
+  def test_status_counts_endpoint(self):
+    self._create_orders(3)
+
+    with self.assertNumQueries(1):
+      response = self.client.get('/api/order/status/counts/')
+
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(6, len(response.data['statuses']))
+    self.assertEqual(3, response.data['statuses']['Received'])
+    self.assertEqual(0, response.data['statuses']['Payment complete'])
+    self.assertEqual(3, response.data['total'])
+
+  def test_reconcile_repairs_drift(self):
+    orders = self._create_orders(2)
+    Order.objects.filter(pk=orders[0].pk).update(status=Status.Completed.value) # bypasses the bookkeeping
+    StatusCounter.objects.filter(status=Status.Shipping.value).delete()
+
+    out = StringIO()
+    call_command('reconcile_status_counters', '--dry-run', stdout=out)
+    self.assertIn('Received: counter 2, orders 1', out.getvalue())
+    self.assertIn('Completed: counter 0, orders 1', out.getvalue())
+    self.assertEqual(2, StatusCounter.objects.depths()[Status.Received])
+
+    out = StringIO()
+    call_command('reconcile_status_counters', stdout=out)
+    self.assertIn('Shipping: counter missing, orders 0', out.getvalue())
+    self.assertIn('Repaired 3 status counters', out.getvalue())
+    self.assertEqual([], StatusCounter.objects.reconcile(repair=False))
+    self.assertEqual(6, StatusCounter.objects.count())
+
+
+class OrderRollupTestCase(TestCase):
+  CREATED = (
+    (2019, 1, 1, 10, 15), (2019, 1, 1, 23, 59), (2019, 1, 2, 0, 30),
+    (2019, 1, 3, 12, 0), (2019, 1, 3, 12, 45), (2019, 1, 5, 8, 0),
+  )
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='rollups', password='rollups')
+    customer = OrderCustomer.objects.create(customer_id=1, email='customer001@mail.com')
+
+    for index, created in enumerate(cls.CREATED):
+      created_at = datetime(*created, tzinfo=dt_timezone.utc)
+      order = Order.objects.create(order_customer=customer, totals=Decimal(index + 1) * 10)
+      OrderItems.objects.create(order=order, product_id=1, name='Prod 001', quantity=2, price_per_unit=5)
+      Order.objects.filter(pk=order.pk).update(created_at=created_at, last_updated=created_at)
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _volume(self, start, end, granularity):
+    return rollups.order_volume(
+      datetime.fromisoformat(start).replace(tzinfo=dt_timezone.utc),
+      datetime.fromisoformat(end).replace(tzinfo=dt_timezone.utc), granularity)
+
+  # The same ranges answered from the raw rows only, then from the rollups
+  def test_rollups_match_raw_rows(self):
+    ranges = [
+      ('2019-01-01T10:30:00', '2019-01-03T23:59:59.999999'),
+      ('2019-01-01T00:00:00', '2019-01-31T23:59:59.999999'),
+      ('2019-01-03T12:10:00', '2019-01-03T12:50:00'),
+    ]
+    expected = [self._volume(start, end, granularity) for start, end in ranges for granularity in ('hour', 'day')]
+
+    self.assertEqual((5, 4), rollups.refresh(lag=timedelta(0)))
+    self.assertEqual(5, HourlyOrderRollup.objects.count())
+    self.assertEqual(4, DailyOrderRollup.objects.count())
+
+    self.assertEqual(expected, [self._volume(start, end, granularity) for start, end in ranges for granularity in ('hour', 'day')])
+
+  def test_day_buckets(self):
+    rollups.refresh(lag=timedelta(0))
+
+    buckets = dict(self._volume('2019-01-01T00:00:00', '2019-01-05T23:59:59.999999', 'day'))
+
+    self.assertEqual({Status.Received.value: [2, Decimal('30.00'), 4]}, buckets[datetime(2019, 1, 1, tzinfo=dt_timezone.utc)])
+    self.assertEqual({Status.Received.value: [2, Decimal('90.00'), 4]}, buckets[datetime(2019, 1, 3, tzinfo=dt_timezone.utc)])
+    self.assertEqual(4, len(buckets))
+
+  # Only the hours with changed orders are recomputed, and the new status shows in the report
+  def test_incremental_refresh(self):
+    rollups.refresh(lag=timedelta(0))
+    self.assertEqual((0, 0), rollups.refresh(lag=timedelta(0)))
+
+    order = Order.objects.order_by('created_at').first()
+    Order.objects.set_next_status(order)
+
+    self.assertEqual((1, 1), rollups.refresh(lag=timedelta(0)))
+    buckets = dict(self._volume('2019-01-01T00:00:00', '2019-01-01T23:59:59.999999', 'day'))
+    self.assertEqual({
+      Status.Received.value: [1, Decimal('20.00'), 2],
+      Status.Processing.value: [1, Decimal('10.00'), 2],
+    }, buckets[datetime(2019, 1, 1, tzinfo=dt_timezone.utc)])
+
+  # The changed hours are deduplicated by the database, one row per hour whatever the
+  # number of changed orders in it
+  def test_changed_hours_are_distinct(self):
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual((5, 4), rollups.refresh(lag=timedelta(0)))
+
+    hours = next(query['sql'] for query in queries.captured_queries if 'DISTINCT' in query['sql'])
+    self.assertIn('FROM "main_order"', hours)
+    self.assertIn('ORDER BY', hours)
+
+  # Orders created after the watermark are read from the raw rows
+  def test_unrolled_tail(self):
+    rollups.refresh(lag=timedelta(0))
+    customer = OrderCustomer.objects.get()
+    order = Order.objects.create(order_customer=customer, totals=Decimal('5.00'))
+
+    buckets = rollups.order_volume(order.created_at - timedelta(days=400), order.created_at + timedelta(hours=1), 'day')
+
+    self.assertEqual({Status.Received.value: [1, Decimal('5.00'), 0]}, buckets[-1][1])
+
+  def test_report_endpoint(self):
+    rollups.refresh(lag=timedelta(0))
+
+    # watermark and daily rollups, the range is made of whole days
+    with self.assertNumQueries(2):
+      response = self.client.get('/api/report/orders/?start_date=2019-01-01&end_date=2019-01-03&granularity=day')
+
+    self.assertEqual(200, response.status_code)
+    self.assertEqual({'orders': 5, 'revenue': '150.00', 'items': 10}, response.data['totals'])
+    self.assertEqual(3, len(response.data['buckets']))
+    self.assertEqual({'orders': 1, 'revenue': '30.00', 'items': 2}, response.data['buckets'][1]['statuses']['Received'])
+
+  def test_report_endpoint_invalid_arguments(self):
+    self.assertEqual(400, self.client.get('/api/report/orders/?start_date=2019-01-01&end_date=2019-01-03&granularity=week').status_code)
+    self.assertEqual(400, self.client.get('/api/report/orders/?start_date=2019-01-03&end_date=2019-01-01').status_code)
+    self.assertEqual(400, self.client.get('/api/report/orders/?start_date=2019-01-01').status_code)
+
+  def test_refresh_command(self):
+    out = StringIO()
+    call_command('refresh_order_rollups', '--lag', '0', stdout=out)
+
+    self.assertIn('Refreshed 5 hourly and 4 daily buckets', out.getvalue())
+
+
+class OrderArchiveTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='archive', password='archive')
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+    # one customer row with 5 orders: 2 old Completed, 1 old Cancelled, 1 recent Completed, 1 old Received
+    self.customer = OrderCustomer.objects.create(customer_id=1, name='Test User', email='test@test.com')
+    self.orders = []
+    for index, status in enumerate((Status.Completed, Status.Completed, Status.Cancelled, Status.Completed, Status.Received)):
+      order = Order.objects.create(order_customer=self.customer, totals=Decimal(index + 1))
+      OrderItems.objects.create(order=order, product_id=index, name=f'Prod {index}', quantity=1, price_per_unit=index + 1)
+      Order.objects.orders_created([order])
+      if status is not Status.Received:
+        Order.objects.set_status(order, status)
+      self.orders.append(order)
+
+    old = timezone.now() - timedelta(days=100)
+    Order.objects.exclude(pk=self.orders[3].pk).update(last_updated=old)
+
+  def _archive(self):
+    return ArchivedOrder.objects.archive(timezone.now() - timedelta(days=90), chunk_size=2)
+
+  def test_archive_moves_old_terminal_orders(self):
+    self.assertEqual(3, self._archive())
+
+    archived_ids = [order.id for order in self.orders[:3]]
+    self.assertEqual(archived_ids, sorted(ArchivedOrder.objects.values_list('id', flat=True)))
+    self.assertEqual(archived_ids, sorted(ArchivedOrderItems.objects.values_list('order_id', flat=True)))
+    self.assertFalse(Order.objects.filter(id__in=archived_ids).exists())
+    self.assertFalse(OrderItems.objects.filter(order_id__in=archived_ids).exists())
+    self.assertEqual('Test User', ArchivedOrder.objects.get(pk=archived_ids[0]).order_customer.name)
+
+    # the customer still has live orders
+    self.assertTrue(OrderCustomer.objects.filter(pk=self.customer.pk).exists())
+    self.assertEqual(0, self._archive())
+
+  def test_counters_and_summaries_still_count_archived_orders(self):
+    summary = CustomerOrderSummary.objects.get(pk=self.customer.pk)
+    self._archive()
+
+    self.assertEqual([], StatusCounter.objects.reconcile(repair=False))
+    self.assertEqual(3, StatusCounter.objects.depths()[Status.Completed])
+
+    CustomerOrderSummary.objects.rebuild()
+    rebuilt = CustomerOrderSummary.objects.get(pk=self.customer.pk)
+    self.assertEqual((summary.orders, summary.completed, summary.lifetime_totals), (rebuilt.orders, rebuilt.completed, rebuilt.lifetime_totals))
+
+  # The live customer row goes away with its last order, unless a summary points to it
+  def test_customer_row_without_live_orders(self):
+    Order.objects.filter(pk__in=[self.orders[3].pk, self.orders[4].pk]).delete()
+    CustomerOrderSummary.objects.filter(pk=self.customer.pk).delete()
+
+    self._archive()
+
+    self.assertFalse(OrderCustomer.objects.filter(pk=self.customer.pk).exists())
+    self.assertTrue(ArchivedOrderCustomer.objects.filter(pk=self.customer.pk).exists())
+
+  @override_settings(CACHES=NO_ORDERS_CACHE)
+  def test_lists_include_archived_orders_when_asked(self):
+    self._archive()
+    url = f'/api/customer/{self.customer.pk}/orders/get/'
+
+    live = self.client.get(url).data['results']
+    self.assertEqual([self.orders[4].id, self.orders[3].id], [order['id'] for order in live])
+
+    # status, -created_at: Received, then the Completed ones newest first, then Cancelled
+    expected = [self.orders[index].id for index in (4, 3, 1, 0, 2)]
+    response = self.client.get(f'{url}?include_archived=true')
+    self.assertEqual(expected, [order['id'] for order in response.data['results']])
+    self.assertEqual('Prod 0', response.data['results'][3]['items'][0]['name'])
+    self.assertEqual('Completed', response.data['results'][3]['status'])
+
+    # the pages are merged from both tables
+    ids, next_url = [], f'{url}?include_archived=1&page_size=2'
+    while next_url:
+      page = self.client.get(next_url).data
+      ids.extend(order['id'] for order in page['results'])
+      next_url = page['next']
+    self.assertEqual(expected, ids)
+
+    completed = self.client.get(f'/api/customer/{self.customer.pk}/orders/complete/get?include_archived=true').data['results']
+    self.assertEqual([self.orders[index].id for index in (3, 1, 0)], [order['id'] for order in completed])
+
+    self.assertEqual(400, self.client.get(f'{url}?include_archived=maybe').status_code)
+
+  def test_manager_reads_the_archive_separately(self):
+    self._archive()
+
+    live = Order.objects.get_all_orders_by_customer(self.customer.pk)
+    self.assertIsInstance(live, QuerySet)
+    self.assertEqual([self.orders[4].id, self.orders[3].id], [order.id for order in live])
+
+    orders = Order.objects.with_archive('get_customer_completed_orders', self.customer.pk)
+    self.assertIsInstance(orders, OrdersWithArchive)
+    self.assertEqual(([self.orders[3].id], [self.orders[1].id, self.orders[0].id]),
+                     tuple([order.id for order in source] for source in orders.sources))
+
+    with self.assertRaises(InvalidArgumentError):
+      Order.objects.with_archive('set_status', self.orders[4], Status.Shipping)
+
+  def test_export_includes_archived_orders_when_asked(self):
+    self._archive()
+    url = '/api/order/export/?start_date=2000-01-01&end_date=2100-01-01'
+
+    live = [json.loads(line)['id'] for line in b''.join(self.client.get(url).streaming_content).splitlines()]
+    everything = [json.loads(line)['id'] for line in b''.join(self.client.get(f'{url}&include_archived=true').streaming_content).splitlines()]
+
+    self.assertEqual([self.orders[3].id, self.orders[4].id], live)
+    self.assertEqual([order.id for order in self.orders], everything)
+
+  # The buckets whose orders are all archived are rebuilt too
+  def test_full_rollup_refresh_after_archiving(self):
+    created_at = datetime(2019, 1, 1, 10, 30, tzinfo=dt_timezone.utc)
+    Order.objects.filter(pk__in=[order.pk for order in self.orders[:3]]).update(created_at=created_at)
+    self._archive()
+
+    self.assertEqual((2, 2), rollups.refresh(lag=timedelta(0), full=True))
+
+    buckets = dict(rollups.order_volume(created_at - timedelta(hours=10, minutes=30), created_at + timedelta(hours=12), 'day'))
+    self.assertEqual({
+      Status.Completed.value: [2, Decimal('3.00'), 2],
+      Status.Cancelled.value: [1, Decimal('3.00'), 1],
+    }, buckets[datetime(2019, 1, 1, tzinfo=dt_timezone.utc)])
+    self.assertTrue(HourlyOrderRollup.objects.filter(bucket=datetime(2019, 1, 1, 10, tzinfo=dt_timezone.utc)).exists())
+
+  def test_archive_command(self):
+    out = StringIO()
+    call_command('archive_orders', '--days', '90', stdout=out)
+
+    self.assertIn('Archived 3 orders', out.getvalue())
+
+
+@override_settings(ROOT_URLCONF='order.urls_asgi', ASYNC_VIEW_THREADS=0, CACHES=NO_ORDERS_CACHE)
+class AsyncOrderListViewTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='async', password='async')
+    cls.token = Token.objects.create(user=cls.user)
+    cls.customer = OrderCustomer.objects.create(customer_id=1, email='customer@mail.com')
+
+    for status in (Status.Received, Status.Completed, Status.Received):
+      order = Order.objects.create(order_customer=cls.customer, status=status.value)
+      OrderItems.objects.create(order=order, product_id=1, name='Prod 001', quantity=1, price_per_unit=10)
+
+  def setUp(self):
+    token_cache.clear()
+    metrics_registry.reset()
+    self.headers = {'Authorization': f'Token {self.token.key}'}
+
+  async def test_same_responses_as_the_sync_views(self):
+    urls = [
+      f'/api/customer/{self.customer.id}/orders/get/?page_size=2',
+      f'/api/customer/{self.customer.id}/orders/incomplet/get',
+      f'/api/customer/{self.customer.id}/orders/complete/get',
+      f'/api/order/{Status.Received.value}/get/',
+    ]
+
+    for url in urls:
+      response = await self.async_client.get(url, headers=self.headers)
+      expected = await sync_to_async(self.client.get)(url, headers=self.headers)
+
+      self.assertEqual(200, response.status_code)
+      self.assertEqual('application/json', response['Content-Type'])
+      self.assertEqual(json.loads(expected.content), json.loads(response.content))
+
+  async def test_errors_and_authentication(self):
+    url = f'/api/customer/{self.customer.id}/orders/get/'
+
+    self.assertEqual(401, (await self.async_client.get(url)).status_code)
+    self.assertEqual(400, (await self.async_client.get(f'{url}?cursor=nope', headers=self.headers)).status_code)
+    self.assertEqual(405, (await self.async_client.post(url, headers=self.headers)).status_code)
+
+  async def test_queries_are_measured(self):
+    await self.async_client.get(f'/api/customer/{self.customer.id}/orders/get/', headers=self.headers)
+
+    metrics = metrics_registry.to_prometheus()
+    label = 'route="api/customer/<int:customer_id>/orders/get/"'
+    # token, orders, items, each counted once: the list runs in the request thread too
+    # with ASYNC_VIEW_THREADS = 0
+    self.assertIn(f'order_request_db_queries_sum{{{label}}} 3', metrics)
+
+  # The views that are not async run in the thread of the request under ASGI
+  async def test_sync_view_queries_are_measured(self):
+    await self.async_client.get(f'/api/customer/{self.customer.id}/summary', headers=self.headers)
+
+    metrics = metrics_registry.to_prometheus()
+    label = 'route="api/customer/<int:customer_id>/summary"'
+    # token, summary
+    self.assertIn(f'order_request_db_queries_sum{{{label}}} 2', metrics)
+    db_time = re.search(rf'order_request_db_duration_seconds_sum{{{re.escape(label)}}} (\S+)', metrics).group(1)
+    self.assertGreater(float(db_time), 0)
+
+  @override_settings(ASYNC_VIEW_THREADS=2)
+  async def test_work_runs_in_the_pool(self):
+    name = await run_in_thread(lambda: threading.current_thread().name)
+
+    self.assertTrue(name.startswith('order-async-view'))
+
+
+class GroupCommitTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='group', password='group')
+
+  # Fake flush recording the batches, the result of an order is its data doubled
+  def _writer(self, **kwargs):
+    batches = []
+
+    def flush(batch):
+      batches.append(list(batch))
+      if 'bad' in batch:
+        raise ValueError('bad order')
+      return [data * 2 for data in batch]
+
+    return GroupCommitWriter(flush=flush, enabled=True, **kwargs), batches
+
+  def _submit_concurrently(self, writer, values):
+    results = {}
+
+    def submit(value):
+      try:
+        results[value] = writer.submit(value)
+      except ValueError as err:
+        results[value] = err
+
+    threads = [threading.Thread(target=submit, args=(value,)) for value in values]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    return results
+
+  def test_concurrent_orders_share_a_flush(self):
+    writer, batches = self._writer(max_batch=100, max_delay_ms=200)
+
+    results = self._submit_concurrently(writer, [str(value) for value in range(20)])
+
+    self.assertEqual({str(value): str(value) * 2 for value in range(20)}, results)
+    self.assertLess(len(batches), 20)
+    self.assertEqual(20, sum(len(batch) for batch in batches))
+
+  def test_batches_are_bounded(self):
+    writer, batches = self._writer(max_batch=3, max_delay_ms=200)
+
+    self._submit_concurrently(writer, [str(value) for value in range(10)])
+
+    self.assertTrue(all(len(batch) <= 3 for batch in batches))
+
+  # The orders of a failed batch are retried one at a time
+  def test_failing_order_does_not_fail_the_batch(self):
+    writer, batches = self._writer(max_batch=100, max_delay_ms=200)
+
+    results = self._submit_concurrently(writer, ['a', 'bad', 'c'])
+
+    self.assertEqual(('aa', 'cc'), (results['a'], results['c']))
+    self.assertIsInstance(results['bad'], ValueError)
+
+  # A flush blocked until release is set, recording what it wrote
+  def _blocking_writer(self, release, **kwargs):
+    written = []
+
+    def flush(batch):
+      release.wait(5)
+      written.extend(batch)
+      return [data * 2 for data in batch]
+
+    return GroupCommitWriter(flush=flush, enabled=True, max_delay_ms=0, **kwargs), written
+
+  # The order still queued when its request times out is never written
+  def test_timed_out_order_is_not_written(self):
+    release = threading.Event()
+    writer, written = self._blocking_writer(release, timeout=0.2)
+    first = threading.Thread(target=writer.submit, args=('a',))
+    first.start()
+    time.sleep(0.05) # the writer is blocked on 'a'
+
+    with self.assertRaises(TimeoutError):
+      writer.submit('b')
+
+    release.set()
+    first.join()
+    self.assertEqual('cc', writer.submit('c'))
+    self.assertEqual(['a', 'c'], written)
+
+  # The writer finishes the order after the timeout: the request gets its result, not a 503
+  def test_order_taken_by_the_writer_is_waited_for(self):
+    release = threading.Event()
+    writer, written = self._blocking_writer(release, timeout=0.1)
+    threading.Timer(0.3, release.set).start()
+
+    self.assertEqual('aa', writer.submit('a'))
+    self.assertEqual(['a'], written)
+
+  def test_create_orders_returns_the_ids_in_order(self):
+    validated = []
+    for totals in ('1.00', '2.00', '3.00'):
+      serializer = OrderSerializer(data={
+        'items': [{ 'name': 'Prod 001', 'price_per_unit': totals, 'product_id': 1, 'quantity': 1 }],
+        'order_customer': { 'customer_id': 1, 'email': 'test@test.com', 'name': 'Test User' },
+        'totals': totals,
+      })
+      self.assertTrue(serializer.is_valid())
+      validated.append(serializer.validated_data)
+
+    order_ids = create_orders([(data, None) for data in validated])
+
+    self.assertEqual([Decimal('1.00'), Decimal('2.00'), Decimal('3.00')], [Order.objects.get(pk=order_id).totals for order_id in order_ids])
+
+  def test_create_view_uses_the_writer_when_enabled(self):
+    client = APIClient()
+    client.force_authenticate(user=self.user)
+    writer = GroupCommitWriter(flush=lambda batch: [42] * len(batch), enabled=True)
+
+    with mock.patch.object(group_commit, 'writer', writer):
+      response = client.post('/api/order/add/', {
+        'items': [{ 'name': 'Prod 001', 'price_per_unit': 10, 'product_id': 1, 'quantity': 1 }],
+        'order_customer': { 'customer_id': 1, 'email': 'test@test.com', 'name': 'Test User' },
+        'totals': 10,
+      }, format='json')
+
+    self.assertEqual(201, response.status_code)
+    self.assertEqual({'order_id': 42}, response.data)
+
+  def test_sqlite_pragmas(self):
+    if connection.vendor != 'sqlite':
+      self.skipTest('SQLite only')
+
+    with connection.cursor() as cursor:
+      cursor.execute('PRAGMA synchronous')
+      self.assertEqual(1, cursor.fetchone()[0]) # NORMAL
+
+
+class IdempotencyKeyTestCase(TestCase):
+  ORDER = {
+    'items': [{ 'name': 'Prod 001', 'price_per_unit': 10, 'product_id': 1, 'quantity': 1 }],
+    'order_customer': { 'customer_id': 1, 'email': 'test@test.com', 'name': 'Test User' },
+    'totals': 10,
+  }
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='idempotency', password='idempotency')
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _post(self, data=None, key='key-1'):
+    headers = {'Idempotency-Key': key} if key is not None else {}
+    return self.client.post('/api/order/add/', data or self.ORDER, format='json', headers=headers)
+
+  def test_retry_is_answered_from_the_stored_response(self):
+    first = self._post()
+
+    # one SELECT, no validation and no insert
+    with self.assertNumQueries(1):
+      retry = self._post()
+
+    self.assertEqual(201, retry.status_code)
+    self.assertEqual(first.data, retry.data)
+    self.assertEqual('true', retry['Idempotent-Replayed'])
+    self.assertEqual(1, Order.objects.count())
+
+  # send_order.py sends its order_id in the body
+  def test_order_id_of_the_body_is_the_key(self):
+    first = self._post(dict(self.ORDER, order_id=7), key=None)
+    retry = self._post(dict(self.ORDER, order_id=7), key=None)
+    other = self._post(dict(self.ORDER, order_id=8), key=None)
+
+    self.assertEqual(first.data, retry.data)
+    self.assertNotEqual(first.data, other.data)
+    self.assertEqual(2, Order.objects.count())
+
+  def test_key_reused_for_another_request(self):
+    self._post()
+
+    response = self._post(dict(self.ORDER, totals=20))
+
+    self.assertEqual(422, response.status_code)
+    self.assertEqual(1, Order.objects.count())
+
+  def test_keys_are_per_user(self):
+    self._post()
+    self.client.force_authenticate(user=User.objects.create_user(username='other', password='other'))
+
+    self.assertNotIn('Idempotent-Replayed', self._post())
+    self.assertEqual(2, Order.objects.count())
+
+  def test_failed_requests_are_not_stored(self):
+    self.assertEqual(400, self._post({'totals': 10}).status_code)
+
+    self.assertEqual(201, self._post().status_code)
+
+  def test_expired_key_is_replaced(self):
+    first = self._post()
+    IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    second = self._post()
+
+    self.assertNotIn('Idempotent-Replayed', second)
+    self.assertNotEqual(first.data, second.data)
+    self.assertEqual(1, IdempotencyKey.objects.count())
+
+  # The unique index rejects the second order when both requests got past the replay check
+  def test_concurrent_duplicate_is_rolled_back(self):
+    first = self._post()
+
+    stored = Response({'order_id': first.data['order_id']}, status=201)
+    with mock.patch.object(idempotency, 'replay', side_effect=[None, stored]):
+      second = self._post()
+
+    self.assertEqual(first.data, second.data)
+    self.assertEqual(1, Order.objects.count())
+
+  def test_key_is_saved_with_the_group_commit_batch(self):
+    serializer = OrderSerializer(data=self.ORDER)
+    self.assertTrue(serializer.is_valid())
+    key = idempotency.new_key(self.user, 'batched', 'fingerprint')
+
+    [order_id] = create_orders([(serializer.validated_data, key)])
+
+    self.assertEqual({'order_id': order_id}, json.loads(IdempotencyKey.objects.get(key='batched').response))
+
+  def test_purge_command(self):
+    self._post()
+    self._post(key='key-2')
+    IdempotencyKey.objects.filter(key='key-1').update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    out = StringIO()
+    call_command('purge_idempotency_keys', stdout=out)
+
+    self.assertIn('Deleted 1 expired idempotency keys', out.getvalue())
+    self.assertEqual(['key-2'], list(IdempotencyKey.objects.values_list('key', flat=True)))
+
+  def test_key_too_long(self):
+    self.assertEqual(400, self._post(key='k' * 256).status_code)
+
+
+class ConditionalOrderListTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='conditional', password='conditional')
+    cls.customer = OrderCustomer.objects.create(customer_id=1, email='customer@mail.com')
+    cls.order = Order.objects.create(order_customer=cls.customer)
+    OrderItems.objects.create(order=cls.order, product_id=1, name='Prod 001', quantity=1, price_per_unit=10)
+
+  def setUp(self):
+    caches[ORDERS_CACHE].clear()
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+    self.url = f'/api/order/{Status.Received.value}/get/'
+
+  def test_unchanged_list_is_not_modified(self):
+    first = self.client.get(self.url)
+    self.assertTrue(first['ETag'].startswith('W/"json-1-'))
+
+    with self.assertNumQueries(1):
+      second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    self.assertEqual(304, second.status_code)
+    self.assertEqual(b'', second.content)
+    self.assertEqual(first['ETag'], second['ETag'])
+    self.assertEqual(first['Last-Modified'], second['Last-Modified'])
+
+  # the validators come from the page rows, a plain GET doesn't aggregate the whole list
+  def test_plain_get_runs_only_the_page_query(self):
+    for index in range(5):
+      Order.objects.create(order_customer=self.customer)
+
+    with self.assertNumQueries(1) as queries:
+      response = self.client.get(f'{self.url}?fields=id&page_size=2')
+
+    self.assertEqual(200, response.status_code)
+    self.assertTrue(response['ETag'].startswith('W/"json-2-'))
+    self.assertNotIn('COUNT(', queries.captured_queries[0]['sql'])
+    self.assertIn('LIMIT 3', queries.captured_queries[0]['sql'])
+
+  # an order beyond the page changes neither the rows nor the links of the page
+  def test_change_after_the_page_keeps_the_etag(self):
+    for index in range(3):
+      Order.objects.create(order_customer=self.customer)
+    url = f'{self.url}?page_size=2'
+    etag = self.client.get(url)['ETag']
+
+    Order.objects.set_next_status(Order.objects.get(pk=self.order.id))
+
+    self.assertEqual(304, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+
+  def test_if_modified_since(self):
+    first = self.client.get(self.url)
+
+    self.assertEqual(304, self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code)
+    self.assertEqual(200, self.client.get(self.url, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT').status_code)
+
+  def test_new_order_changes_the_etag(self):
+    etag = self.client.get(self.url)['ETag']
+    Order.objects.create(order_customer=self.customer)
+
+    response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(2, len(response.data['results']))
+    self.assertNotEqual(etag, response['ETag'])
+
+  # The order leaves the Received list, its count changes even if the newest order doesn't
+  def test_transition_out_of_the_list_changes_the_etag(self):
+    newer = Order.objects.create(order_customer=self.customer)
+    Order.objects.filter(pk=newer.id).update(last_updated=timezone.now() + timedelta(hours=1))
+    etag = self.client.get(self.url)['ETag']
+
+    Order.objects.set_next_status(Order.objects.get(pk=self.order.id))
+
+    self.assertEqual(200, self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code)
+
+  def test_empty_list(self):
+    url = f'/api/order/{Status.Cancelled.value}/get/'
+    response = self.client.get(url)
+
+    self.assertEqual('W/"json-0"', response['ETag'])
+    self.assertFalse(response.has_header('Last-Modified'))
+    self.assertEqual(304, self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code)
+
+  def test_cached_list_is_not_modified_without_queries(self):
+    url = f'/api/customer/{self.customer.id}/orders/get/'
+    first = self.client.get(url)
+
+    with self.assertNumQueries(0):
+      cached = self.client.get(url)
+      not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    self.assertEqual(first['ETag'], cached['ETag'])
+    self.assertEqual(first.data, cached.data)
+    self.assertEqual(304, not_modified.status_code)
+
+  @override_settings(ROOT_URLCONF='order.urls_asgi', ASYNC_VIEW_THREADS=0)
+  async def test_async_view(self):
+    token = await sync_to_async(Token.objects.create)(user=self.user)
+    headers = {'Authorization': f'Token {token.key}'}
+    first = await self.async_client.get(self.url, headers=headers)
+
+    second = await self.async_client.get(self.url, headers={**headers, 'If-None-Match': first['ETag']})
+    self.assertEqual(304, second.status_code)
+    self.assertEqual(first['ETag'], second['ETag'])
+
+
+class OrderChangeFeedTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='changes', password='changes')
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _create(self, customer_id=1):
+    response = self.client.post('/api/order/add/', {
+      'order_customer': {'customer_id': customer_id, 'email': 'customer@mail.com', 'name': 'Customer'},
+      'items': [{'name': 'Prod 001', 'price_per_unit': 10, 'product_id': 1, 'quantity': 1}],
+    }, format='json')
+    return Order.objects.get(pk=response.data['order_id'])
+
+  def _changes(self, **params):
+    return self.client.get('/api/order/changes/', params)
+
+  def test_creation_and_transitions_are_recorded(self):
+    order = self._create()
+    Order.objects.set_next_status(order)
+    Order.objects.set_status(order, Status.Shipping)
+    Order.objects.bulk_set_next_status(Order.objects.select_for_transition(order_ids=[order.id]))
+    Order.objects.cancel_order(self._create())
+
+    changes = self._changes().data['changes']
+
+    self.assertEqual(
+      [(None, 'Received'), ('Received', 'Processing'), ('Processing', 'Shipping'), ('Shipping', 'Completed'),
+       (None, 'Received'), ('Received', 'Cancelled')],
+      [(change['previous_status'], change['status']) for change in changes])
+    self.assertEqual([order.id] * 4, [change['order_id'] for change in changes[:4]])
+    self.assertEqual(order.order_customer_id, changes[0]['customer_id'])
+    self.assertEqual(sorted(change['cursor'] for change in changes), [change['cursor'] for change in changes])
+
+  def test_rejected_transition_is_not_recorded(self):
+    order = self._create()
+    stale = Order.objects.get(pk=order.id)
+    Order.objects.set_next_status(order)
+
+    with self.assertRaises(OrderConcurrentUpdateError):
+      Order.objects.set_next_status(stale)
+
+    self.assertEqual(2, OrderChange.objects.count())
+
+  def test_pages_follow_the_cursor(self):
+    for customer_id in range(5):
+      self._create(customer_id)
+
+    first = self._changes(limit=3).data
+    self.assertEqual(3, len(first['changes']))
+    self.assertTrue(first['more'])
+
+    second = self._changes(since=first['next'], limit=3).data
+    self.assertEqual(2, len(second['changes']))
+    self.assertFalse(second['more'])
+
+    # nothing new: the same cursor back
+    third = self._changes(since=second['next']).data
+    self.assertEqual({'changes': [], 'next': second['next'], 'more': False}, third)
+
+  def test_invalid_arguments(self):
+    self.assertEqual(400, self._changes(since='nope').status_code)
+    self.assertEqual(400, self._changes(since=-1).status_code)
+    self.assertEqual(400, self._changes(limit=0).status_code)
+
+  def test_compaction(self):
+    for customer_id in range(3):
+      self._create(customer_id)
+    cursors = list(OrderChange.objects.order_by('id').values_list('id', flat=True))
+    OrderChange.objects.update(changed_at=timezone.now() - timedelta(days=8))
+
+    out = StringIO()
+    call_command('compact_order_changes', stdout=out)
+
+    self.assertIn('Deleted 2 order changes', out.getvalue()) # the newest one is kept
+    self.assertEqual(410, self._changes(since=cursors[0]).status_code)
+    self.assertEqual([cursors[2]], [change['cursor'] for change in self._changes(since=cursors[1]).data['changes']])
+    self.assertEqual(200, self._changes().status_code) # a new consumer starts from the oldest change kept
+
+
+class ImportOrdersTestCase(TestCase):
+
+  def _order(self, customer_id=1, status='Completed', created_at='2019-03-04T05:06:07Z'):
+    return {
+      'id': 99, 'created_at': created_at, 'status': status, 'totals': '20.00',
+      'order_customer': {'customer_id': customer_id, 'email': 'customer@mail.com', 'name': 'Customer'},
+      'items': [{'name': 'Prod 001', 'price_per_unit': '10.00', 'product_id': 1, 'quantity': 2}],
+    }
+
+  def _import(self, text, *args):
+    out, err = StringIO(), StringIO()
+    with mock.patch('sys.stdin', StringIO(text)):
+      call_command('import_orders', '-', *args, stdout=out, stderr=err)
+    return out.getvalue(), err.getvalue()
+
+  def _ndjson(self, orders):
+    return ''.join(json.dumps(order) + '\n' for order in orders)
+
+  def test_ndjson_keeps_status_and_creation_time(self):
+    out, _ = self._import(self._ndjson([self._order(), self._order(2, status=2)]))
+
+    self.assertIn('Imported 2 orders, rejected 0 of 2 records', out)
+    first, second = Order.objects.with_details().order_by('id')
+    self.assertNotEqual(99, first.id)
+    self.assertEqual((Status.Completed.value, datetime(2019, 3, 4, 5, 6, 7, tzinfo=dt_timezone.utc)), (first.status, first.created_at))
+    self.assertEqual(Status.Processing.value, second.status)
+    self.assertEqual([(1, 'Prod 001', 2)], [(item.product_id, item.name, item.quantity) for item in first.items.all()])
+
+    # the bookkeeping of new orders is done
+    self.assertEqual(datetime(2019, 3, 4, 5, 6, 7, tzinfo=dt_timezone.utc), CustomerOrderSummary.objects.get(pk=first.order_customer_id).last_order_at)
+    self.assertEqual(1, StatusCounter.objects.get(status=Status.Completed.value).count)
+    self.assertEqual(2, OrderChange.objects.count())
+
+  def test_creation_times_are_restored_in_chunks(self):
+    created_at = [datetime(2019, 3, 4, 5, 6, index % 60, tzinfo=dt_timezone.utc) for index in range(1200)]
+    chunk = [{
+      'created_at': value, 'status': Status.Completed.value, 'totals': Decimal('20.00'),
+      'order_customer': {'customer_id': index, 'email': 'customer@mail.com', 'name': 'Customer'}, 'items': [],
+    } for index, value in enumerate(created_at)]
+
+    with CaptureQueriesContext(connection) as queries:
+      OrderSerializer(many=True).create(chunk)
+
+    restores = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE "main_order" SET "created_at"')]
+    self.assertEqual(3, len(restores)) # 500, 500 and 200 orders
+    self.assertEqual(created_at, list(Order.objects.order_by('id').values_list('created_at', flat=True)))
+
+  def test_csv_export_round_trip(self):
+    customer = OrderCustomer.objects.create(customer_id=7, email='customer@mail.com', name='Customer')
+    order = Order.objects.create(order_customer=customer, totals=Decimal('25.00'), status=Status.Shipping.value)
+    OrderItems.objects.create(order=order, product_id=1, name='Prod 001', quantity=1, price_per_unit=10)
+    OrderItems.objects.create(order=order, product_id=2, name='Prod 002', quantity=3, price_per_unit=5)
+    Order.objects.create(order_customer=OrderCustomer.objects.create(customer_id=8, email='other@mail.com', name='Other'))
+
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create_user(username='import', password='import'))
+    exported = b''.join(client.get('/api/order/export/?start_date=2000-01-01&end_date=2100-01-01&output=csv').streaming_content).decode()
+
+    out, _ = self._import(exported, '--format', 'csv')
+
+    self.assertIn('Imported 2 orders', out)
+    imported = Order.objects.with_details().exclude(id__in=[order.id, order.id + 1]).order_by('created_at', 'id')
+    self.assertEqual([(7, Status.Shipping.value, 2), (8, Status.Received.value, 0)],
+      [(copy.order_customer.customer_id, copy.status, copy.items.count()) for copy in imported])
+    self.assertEqual(order.created_at, imported[0].created_at)
+
+  def test_invalid_records_are_rejected(self):
+    invalid = self._order()
+    invalid['items'][0]['quantity'] = 'many'
+    text = self._ndjson([self._order(), invalid, self._order(status='Lost')]) + 'not json\n'
+
+    out, err = self._import(text)
+
+    self.assertIn('Imported 1 orders, rejected 3 of 4 records', out)
+    self.assertIn('Record 2 rejected: {"items": {"0": {"quantity"', err)
+    self.assertIn('Record 3 rejected: {"status"', err)
+    self.assertIn('Record 4 rejected: "invalid JSON"', err)
+    self.assertEqual(1, Order.objects.count())
+
+  def test_progress_is_reported_per_chunk(self):
+    out, _ = self._import(self._ndjson([self._order(customer_id) for customer_id in range(5)]), '--chunk-size', '2')
+
+    self.assertEqual(3, len(re.findall(r'records read, \d+ imported, 0 rejected, \d+ orders/s', out)))
+
+  # The process died after committing the first chunk: the second run carries on after it
+  def test_resume_from_checkpoint(self):
+    text = self._ndjson([self._order(customer_id) for customer_id in range(5)])
+    job = OrderImport('stdin', chunk_size=2)
+
+    def interrupt(job):
+      raise KeyboardInterrupt
+
+    with self.assertRaises(KeyboardInterrupt):
+      job.run(iter_ndjson(StringIO(text)), on_chunk=interrupt)
+
+    self.assertEqual(2, ImportCheckpoint.objects.get(name='stdin').position)
+
+    out, _ = self._import(text)
+
+    self.assertIn('Resuming stdin after record 2', out)
+    self.assertIn('Imported 5 orders, rejected 0 of 5 records', out)
+    self.assertEqual(list(range(5)), sorted(Order.objects.values_list('order_customer__customer_id', flat=True)))
+
+    # run again: nothing left to import, unless restarted
+    self._import(text)
+    self.assertEqual(5, Order.objects.count())
+    self._import(text, '--restart')
+    self.assertEqual(10, Order.objects.count())
+
+  def test_csv_without_the_export_columns(self):
+    with self.assertRaisesMessage(CommandError, 'Missing CSV columns: order_id'):
+      self._import('created_at,status\n', '--format', 'csv')
+
+
+class DatasetBenchmarkTestCase(TestCase):
+
+  def _generate(self, *args):
+    call_command(
+      'generate_orders', '--orders', '400', '--customers', '30', '--products', '50', '--days', '30',
+      '--end-date', '2030-01-01', '--batch-size', '150', *args, stdout=StringIO())
+
+  def _rows(self):
+    return list(Order.objects.order_by('created_at', 'id').values_list(
+      'order_customer__customer_id', 'created_at', 'last_updated', 'status', 'totals'))
+
+  def test_dataset_is_deterministic(self):
+    self._generate()
+    first = self._rows()
+    self._generate('--clear')
+
+    self.assertEqual(400, len(first))
+    self.assertEqual(first, self._rows())
+
+  def test_refuses_to_add_to_existing_orders(self):
+    self._generate()
+    with self.assertRaises(CommandError):
+      self._generate()
+
+  def test_dataset_is_skewed(self):
+    self._generate()
+
+    counts = sorted(CustomerOrderSummary.objects.values_list('orders', flat=True), reverse=True)
+    self.assertGreater(counts[0], 5 * counts[len(counts) // 2])
+
+    end = datetime(2030, 1, 1, tzinfo=dt_timezone.utc)
+    old = Order.objects.filter(created_at__lt=end - timedelta(days=14))
+    self.assertFalse(old.exclude(status__in=(Status.Completed.value, Status.Cancelled.value)).exists())
+    self.assertTrue(Order.objects.filter(status=Status.Received.value).exists())
+    self.assertFalse(Order.objects.filter(created_at__gte=end).exists())
+
+    for order in Order.objects.with_details()[:20]:
+      self.assertEqual(order.totals, sum(item.quantity * item.price_per_unit for item in order.items.all()))
+
+  def test_derived_data_is_rebuilt(self):
+    self._generate()
+
+    self.assertEqual([], StatusCounter.objects.reconcile(repair=False))
+    self.assertEqual(400, sum(CustomerOrderSummary.objects.values_list('orders', flat=True)))
+    self.assertEqual(400, sum(DailyOrderRollup.objects.values_list('orders', flat=True)))
+
+  def test_every_manager_method_and_route_has_a_case(self):
+    self.assertEqual([], benchmarks.uncovered())
+
+  def test_benchmark_report_and_baseline(self):
+    self._generate()
+    orders = self._rows()
+
+    with tempfile.TemporaryDirectory() as directory:
+      baseline = f'{directory}/baseline.json'
+      call_command('benchmark', '--repeat', '1', '--output', baseline, stderr=StringIO())
+
+      with open(baseline) as source:
+        report = json.load(source)
+      self.assertEqual({case.name for case in benchmarks.cases()}, set(report['cases']))
+      self.assertEqual(400, report['dataset']['orders'])
+      self.assertTrue(all(result['queries'] > 0 for name, result in report['cases'].items() if name.startswith('manager.')))
+      self.assertEqual(orders, self._rows()) # the writes were rolled back
+
+      for result in report['cases'].values():
+        result['median_ms'] = 0.001
+      with open(baseline, 'w') as output:
+        json.dump(report, output)
+
+      with self.assertRaisesMessage(CommandError, 'slower than the baseline'):
+        call_command('benchmark', '--repeat', '1', '--only', 'url.order/export/', '--baseline', baseline,
+          '--min-delta-ms', '0', '--output', f'{directory}/current.json', stderr=StringIO())
+
+  def test_compare(self):
+    baseline = {'cases': {'fast': {'median_ms': 10.0}, 'noise': {'median_ms': 0.1}, 'gone': {'median_ms': 1.0}}}
+    report = {'cases': {'fast': {'median_ms': 14.0}, 'noise': {'median_ms': 0.5}, 'new': {'median_ms': 100.0}}}
+
+    self.assertEqual(
+      [{'case': 'fast', 'baseline_ms': 10.0, 'median_ms': 14.0, 'change': 0.4}],
+      benchmarks.compare(report, baseline, threshold=0.25, min_delta_ms=1.0))
+    self.assertEqual([], benchmarks.compare(report, baseline, threshold=0.5))
+
+  def test_baseline_without_a_median(self):
+    baseline = {'cases': {'zero': {'median_ms': 0.0}, 'partial': {'queries': 3}}}
+    report = {'dataset': {}, 'cases': {'zero': {'median_ms': 5.0}, 'partial': {'median_ms': 5.0}}}
+
+    self.assertEqual(
+      [{'case': 'zero', 'baseline_ms': 0.0, 'median_ms': 5.0, 'change': None}],
+      benchmarks.compare(report, baseline))
+
+    with tempfile.TemporaryDirectory() as directory:
+      with open(f'{directory}/baseline.json', 'w') as output:
+        json.dump(baseline, output)
+
+      err = StringIO()
+      with mock.patch('main.benchmarks.run', return_value=report), mock.patch('main.benchmarks.uncovered', return_value=[]):
+        with self.assertRaisesMessage(CommandError, '1 cases are slower than the baseline'):
+          call_command('benchmark', '--baseline', f'{directory}/baseline.json', stdout=StringIO(), stderr=err)
+      self.assertIn('zero: 0.0 ms -> 5.0 ms (n/a)', err.getvalue())
+
+
+class LoadTestReportTestCase(TestCase):
+
+  def test_percentile(self):
+    self.assertIsNone(percentile([], 50))
+    self.assertEqual(7, percentile([7], 0))
+    self.assertEqual(7, percentile([7], 99))
+    self.assertEqual(1, percentile([1, 2], 50)) # nearest rank, not rounded half to even
+    self.assertEqual(19, percentile(list(range(1, 21)), 95))
+    self.assertEqual(20, percentile(list(range(1, 21)), 100))
+    self.assertEqual(1, percentile(list(range(1, 21)), 0))
+
+  def test_histogram(self):
+    self.assertEqual(0, sum(histogram([]).values()))
+
+    counts = histogram([0.5, 1, 1.5, 5, 5000, 12000])
+    self.assertEqual(2, counts['le_1']) # the upper bound is inclusive
+    self.assertEqual(1, counts['le_2'])
+    self.assertEqual(1, counts['le_5'])
+    self.assertEqual(1, counts['le_5000'])
+    self.assertEqual(1, counts['+Inf'])
+    self.assertEqual(6, sum(counts.values()))
+
+
+class SparseFieldsetTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='fields', password='fields')
+    cls.customer = OrderCustomer.objects.create(customer_id=1, email='customer@mail.com', name='Customer')
+
+    for index in range(3):
+      order = Order.objects.create(order_customer=cls.customer, totals=Decimal('12.50'))
+      OrderItems.objects.create(order=order, product_id=index, name=f'Prod {index}', quantity=1, price_per_unit=10)
+
+  def setUp(self):
+    caches[ORDERS_CACHE].clear()
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+    self.url = f'/api/customer/{self.customer.id}/orders/get/'
+
+  def test_only_the_requested_fields(self):
+    response = self.client.get(f'{self.url}?fields=status,id,totals')
+
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(['totals', 'id', 'status'], list(response.data['results'][0]))
+    self.assertEqual('12.50', response.data['results'][0]['totals'])
+
+  # only the page, without the customer join nor the items query
+  def test_query_is_pruned(self):
+    with self.assertNumQueries(1) as queries:
+      self.client.get(f'/api/order/{Status.Received.value}/get/?fields=id,status,totals')
+
+    page = queries.captured_queries[-1]['sql']
+    self.assertNotIn('JOIN', page)
+    self.assertNotIn('"email"', page)
+
+  def test_items_and_customer(self):
+    full = self.client.get(self.url).data['results']
+    sparse = self.client.get(f'{self.url}?fields=items,order_customer').data['results']
+
+    self.assertEqual([{'items': order['items'], 'order_customer': order['order_customer']} for order in full], sparse)
+
+  def test_pages_with_fields(self):
+    first = self.client.get(f'{self.url}?fields=id&page_size=2').data
+    second = self.client.get(first['next']).data
+
+    ids = [order['id'] for order in first['results'] + second['results']]
+    self.assertEqual(sorted(Order.objects.values_list('id', flat=True), reverse=True), ids)
+    self.assertEqual([{'id': ids[2]}], second['results'])
+
+  def test_with_archived_orders(self):
+    Order.objects.filter(pk=Order.objects.order_by('id').first().id).update(status=Status.Completed.value)
+    ArchivedOrder.objects.archive(timezone.now() + timedelta(seconds=1))
+
+    response = self.client.get(f'{self.url}?fields=id,items&include_archived=true')
+
+    self.assertEqual(3, len(response.data['results']))
+    self.assertTrue(all(len(order['items']) == 1 for order in response.data['results']))
+
+  def test_invalid_fields(self):
+    self.assertEqual(400, self.client.get(f'{self.url}?fields=id,secret').status_code)
+    self.assertEqual(400, self.client.get(f'{self.url}?fields=').status_code)
+
+  @skipUnless(msgpack, 'msgpack is not installed')
+  def test_msgpack_renderer(self):
+    json_response = self.client.get(self.url)
+    response = self.client.get(self.url, HTTP_ACCEPT='application/msgpack')
+
+    self.assertEqual('application/msgpack', response['Content-Type'])
+    self.assertEqual(json.loads(json_response.content), msgpack.unpackb(response.content))
+    self.assertLess(len(response.content), len(json_response.content))
+    self.assertNotEqual(json_response['ETag'], response['ETag'])
+
+    by_format = self.client.get(f'{self.url}?format=msgpack&fields=id')
+    self.assertEqual([{'id': order['id']} for order in json_response.data['results']], msgpack.unpackb(by_format.content)['results'])
+
+  @skipUnless(msgpack, 'msgpack is not installed')
+  def test_msgpack_error(self):
+    response = self.client.get(f'{self.url}?fields=nope', HTTP_ACCEPT='application/msgpack')
+
+    self.assertEqual(400, response.status_code)
+    self.assertEqual('The argument fields is invalid', msgpack.unpackb(response.content))
+
+
+class OrderSearchTestCase(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = User.objects.create_user(username='search', password='search')
+    cls.customers = [
+      OrderCustomer.objects.create(customer_id=number, email=f'customer{number}@mail.com', name=f'Customer {number}')
+      for number in (1, 2)
+    ]
+
+    # 12 orders a day apart, newest first: customers alternate, statuses cycle, totals 1..12
+    statuses = [Status.Received, Status.Processing, Status.Shipping]
+    now = timezone.now()
+    for index in range(12):
+      order = Order.objects.create(
+        order_customer=cls.customers[index % 2], totals=Decimal(index + 1), status=statuses[index % 3].value)
+      Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(days=index))
+
+    cls.orders = list(Order.objects.order_by('-created_at'))
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _search(self, query):
+    return self.client.get(f'/api/order/search/?{query}')
+
+  def _ids(self, orders):
+    return [order.id for order in orders]
+
+  def test_combined_criteria(self):
+    customer = self.customers[0]
+    start_date = (timezone.now() - timedelta(days=7)).date().isoformat()
+    response = self._search(f'customer_id={customer.id}&status=1,2&start_date={start_date}&max_totals=6')
+
+    expected = [
+      order for order in self.orders
+      if order.order_customer_id == customer.id and order.status in (1, 2)
+      and order.created_at.date().isoformat() >= start_date and order.totals <= 6
+    ]
+    self.assertEqual(200, response.status_code)
+    self.assertTrue(expected)
+    self.assertEqual(self._ids(expected), [order['id'] for order in response.data['results']])
+    self.assertEqual(search.CUSTOMER_INDEX, response['X-Search-Index'])
+    self.assertNotIn('Warning', response)
+
+  def test_pages_oldest_first(self):
+    ids = []
+    url = '/api/order/search/?status=1&order=oldest&page_size=2&fields=id'
+    while url:
+      data = self.client.get(url).data
+      ids += [order['id'] for order in data['results']]
+      url = data['next']
+
+    self.assertEqual(self._ids(reversed([order for order in self.orders if order.status == 1])), ids)
+
+  def test_date_range_newest_first(self):
+    start_date = (timezone.now() - timedelta(days=3, hours=12)).isoformat()
+    response = self.client.get('/api/order/search/', {'start_date': start_date, 'min_totals': '2'})
+
+    self.assertEqual(self._ids(self.orders[1:4]), [order['id'] for order in response.data['results']])
+    self.assertEqual(search.CREATED_AT_INDEX, response['X-Search-Index'])
+
+  def test_unbounded_sort_warns(self):
+    response = self._search('status=1,4')
+
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(8, len(response.data['results']))
+    self.assertEqual(search.STATUS_INDEX, response['X-Search-Index'])
+    self.assertIn('299', response['Warning'])
+
+    self.assertNotIn('Warning', self._search('status=1,4&end_date=2100-01-01'))
+
+  def test_full_scan_rejected(self):
+    for query in ('', 'min_totals=1&max_totals=10', 'order=oldest'):
+      response = self._search(query)
+      self.assertEqual(400, response.status_code)
+      self.assertIn('scan every order', response.data)
+
+  def test_invalid_arguments(self):
+    for query in ('status=1,9', 'status=', 'customer_id=x', 'status=1&min_totals=ten', 'status=1&max_totals=NaN',
+                  'status=1&order=random', 'start_date=yesterday'):
+      self.assertEqual(400, self._search(query).status_code, msg=query)
+
+  def test_include_archived(self):
+    Order.objects.filter(pk=self.orders[0].pk).update(status=Status.Completed.value)
+    ArchivedOrder.objects.archive(timezone.now() + timedelta(seconds=1))
+
+    response = self._search(f'customer_id={self.customers[0].id}&status=5&include_archived=true')
+    self.assertEqual([self.orders[0].id], [order['id'] for order in response.data['results']])
+    self.assertEqual([], self._search(f'customer_id={self.customers[0].id}&status=5').data['results'])
+
+  def test_manager_arguments(self):
+    with self.assertRaises(InvalidArgumentError):
+      Order.objects.search(statuses=[1])
+    with self.assertRaises(InvalidArgumentError):
+      Order.objects.search(statuses=[Status.Received], min_totals=10)
+    with self.assertRaises(InvalidArgumentError):
+      Order.objects.search(start_date='2019-01-01')
+
+  # the plans that don't sort are a range scan of their index in its own order
+  def test_query_plans(self):
+    week_ago = timezone.now() - timedelta(days=7)
+    searches = [
+      {'customer_id': 1, 'statuses': [Status.Received], 'start_date': week_ago},
+      {'statuses': [Status.Received]},
+      {'statuses': [Status.Received], 'newest_first': False},
+      {'start_date': week_ago, 'min_totals': Decimal(1)},
+      {'start_date': week_ago, 'newest_first': False},
+    ]
+
+    for criteria in searches:
+      plan = search.plan(**{name: value for name, value in criteria.items() if name != 'min_totals'})
+      sql = Order.objects.search(**criteria).explain()
+
+      self.assertFalse(plan.sorts)
+      self.assertIn(f'USING INDEX {plan.index}', sql, msg=criteria)
+      self.assertNotIn('TEMP B-TREE', sql, msg=criteria)
+      self.assertIsNone(re.search(r'\bSCAN main_order\b', sql), msg=criteria)
+
+    self.assertTrue(search.plan(customer_id=1).sorts)
+    self.assertTrue(search.plan(statuses=[Status.Received, Status.Shipping]).sorts)
@@ -1,23 +1,65 @@
 from django.urls import path
 
+from .async_views import (
+  AsyncCompletedOrdersByCustomerView,
+  AsyncIncompleteOrdersByCustomerView,
+  AsyncOrderByStatusView,
+  AsyncOrderSearchView,
+  AsyncOrdersByCustomerView,
+)
+from .metrics import metrics_view
+
 from .views import (
+  bulk_cancel_orders,
+  bulk_set_next_status,
+  bulk_set_status,
   cancel_order,
+  customer_summary,
+  order_changes,
+  order_status_counts,
+  orders_cache_stats,
   set_next_status,
   set_status,
   OrdersByCustomerView,
   OrderByStatusView,
+  OrderSearchView,
   IncompleteOrdersByCustomerView,
   CompletedOrdersByCustomerView,
-  CreateOrderView
+  CreateOrderView,
+  CreateOrderBatchView,
+  OrderExportView,
+  OrderVolumeReportView
 )
 
 urlpatterns = [
   path(r'order/add/', CreateOrderView.as_view()),
+  path(r'order/batch/add/', CreateOrderBatchView.as_view()),
   path(r'customer/<int:customer_id>/orders/get/', OrdersByCustomerView.as_view()),
   path(r'customer/<int:customer_id>/orders/incomplet/get', IncompleteOrdersByCustomerView.as_view()),
   path(r'customer/<int:customer_id>/orders/complete/get', CompletedOrdersByCustomerView.as_view()),
+  path(r'customer/<int:customer_id>/summary', customer_summary),
   path(r'order/<int:order_id>/cancel', cancel_order),
   path(r'order/<int:status_id>/get/', OrderByStatusView.as_view()),
   path(r'order/<int:order_id>/status/<int:status_id>/set/', set_status),
   path(r'order/<int:order_id>/status/next/', set_next_status),
-]
\ No newline at end of file
+  path(r'order/status/counts/', order_status_counts),
+  path(r'order/search/', OrderSearchView.as_view()),
+  path(r'order/changes/', order_changes),
+  path(r'order/export/', OrderExportView.as_view()),
+  path(r'report/orders/', OrderVolumeReportView.as_view()),
+  path(r'order/bulk/cancel/', bulk_cancel_orders),
+  path(r'order/bulk/status/<int:status_id>/set/', bulk_set_status),
+  path(r'order/bulk/status/next/', bulk_set_next_status),
+  path(r'cache/orders/stats/', orders_cache_stats),
+  path(r'metrics', metrics_view),
+]
+
+# Used by order/urls_asgi.py: the list endpoints are served by their async versions,
+# they come first so they take precedence over the same paths in urlpatterns
+async_urlpatterns = [
+  path(r'customer/<int:customer_id>/orders/get/', AsyncOrdersByCustomerView.as_view()),
+  path(r'customer/<int:customer_id>/orders/incomplet/get', AsyncIncompleteOrdersByCustomerView.as_view()),
+  path(r'customer/<int:customer_id>/orders/complete/get', AsyncCompletedOrdersByCustomerView.as_view()),
+  path(r'order/<int:status_id>/get/', AsyncOrderByStatusView.as_view()),
+  path(r'order/search/', AsyncOrderSearchView.as_view()),
+] + urlpatterns
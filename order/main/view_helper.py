@@ -4,43 +4,251 @@
 
   The status contains all the HTTP status code
 """
+import hashlib
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+
 from rest_framework import generics, status
 from rest_framework.response import Response
 from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.dateparse import parse_date, parse_datetime
 
+from . import cache
 from .exceptions import InvalidArgumentError
 from .exceptions import OrderAlreadyCancelledError
 from .exceptions import OrderAlreadyCompletedError
+from .exceptions import OrderCancellationError
+from .exceptions import OrderConcurrentUpdateError
+from .models import Order
+from .pagination import OrderKeysetPagination
+from .renderers import order_renderers
 from .serializers import OrderSerializer # serialization, deserialization, and the validation model.
+from .serializers import OrderValuesSerializer
+from .status import Status
 
 # base class for all the views that will return a list of content to the client
 # ListAPIView, Provide us with get and list methods  which we can override to add functionality
 
 # The idea of this base class is that all the children classes need to implement the
 # get_queryset method
+
+# Results are returned a page at a time (see pagination.py), the queryset ordering
+# defined in the OrderManager is used as the key of the cursor
+
+# Views that set cache_name keep their responses in the orders cache, keyed by customer
+# (the lookup_field must be customer_id). See cache.py for the invalidation.
+
+# Lists answer conditional GETs: the ETag and Last-Modified come from the rows of the
+# page, so a client polling an unchanged page gets a 304 after the page query, without
+# the items query or the serializer, and a plain GET costs no more than the page.
+# Cached lists keep their validators in the cache entry and answer without a query.
+
+# ?fields= keeps only some fields of the orders and reads only what they need (see
+# OrderValuesSerializer). The lists can also be rendered as MessagePack (see renderers.py)
 class OrderListApiBaseView(generics.ListAPIView):
   serializer_class = OrderSerializer
+  pagination_class = OrderKeysetPagination
+  renderer_classes = order_renderers()
   lookup_field = ''
+  cache_name = None
 
   def get_queryset(self, lookup_field):
     pass
 
+  # Order.objects.<name>(*args, **kwargs), with the archived orders as well when the
+  # request has include_archived=true (see OrderManager.with_archive)
+  def get_orders(self, name, *args, **kwargs):
+    if parse_include_archived(self.request):
+      return Order.objects.with_archive(name, *args, **kwargs)
+
+    return getattr(Order.objects, name)(*args, **kwargs)
+
   def list(self, request, *args, **kwargs):
+    lookup_value = kwargs.get(self.lookup_field, None)
+
+    if self.cache_name is not None:
+      cache_key, entry = cache.get_customer_orders(self.cache_name, lookup_value, request)
+      if entry is not None:
+        data, etag, last_modified = entry
+        return self.conditional_response(request, etag, last_modified) or \
+          self.with_validators(Response(data, status=status.HTTP_200_OK), etag, last_modified)
+
     try:
-      result = self.get_queryset(kwargs.get(self.lookup_field, None))
+      result = self.get_queryset(lookup_value)
+      fields = parse_fields(request)
+      page = self.paginate_queryset(OrderValuesSerializer.prepare(result, fields))
     except Exception as err:
-      return Response(err, status=status.HTTP_400_BAD_REQUEST)
+      return Response(str(err), status=status.HTTP_400_BAD_REQUEST)
+
+    etag, last_modified = page_validators(page, self.paginator, request.accepted_renderer.format)
+    not_modified = self.conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+      return not_modified
+
+    # Same output as OrderSerializer(page, many=True), built from values() rows
+    serializer = OrderValuesSerializer(page, fields)
+    response = self.with_validators(self.get_paginated_response(serializer.data), etag, last_modified)
+
+    if self.cache_name is not None:
+      cache.set_customer_orders(cache_key, (response.data, etag, last_modified))
+
+    return response
+
+  # 304 (or 412 for the If-Match headers) when the client's copy is current, otherwise None
+  def conditional_response(self, request, etag, last_modified):
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    return response if response is None else self.with_validators(response, etag, last_modified)
+
+  def with_validators(self, response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+      response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+# (ETag, Last-Modified timestamp or None) of a page of a list, from its rows: creating,
+# transitioning or archiving an order of the page changes the ids, last_updated or
+# archived flags of its rows, or whether there is a page before or after it. The ETag
+# is weak and names the renderer, the same page in another format is another representation
+def page_validators(page, paginator, renderer_format):
+  if not page:
+    return f'W/"{renderer_format}-0"', None
+
+  rows = [(row['id'], row['last_updated'].isoformat(), bool(row.get('archived'))) for row in page]
+  digest = hashlib.md5(repr((rows, paginator.has_next, paginator.has_previous)).encode('utf-8')).hexdigest()
+  newest = max(row['last_updated'] for row in page)
+
+  return f'W/"{renderer_format}-{len(page)}-{digest}"', int(newest.timestamp())
 
-    serializer = OrderSerializer(result, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
 
 # will help us with the methods that will perform POST request.
 # takes a function as an argument. Run the function; if one of the exceptions occurs
-# return 404 or else return 204
+# return 400 (409 when another request changed the order first) or else return 204
 def set_status_handler(set_status_delegate):
   try:
     set_status_delegate()
-  except (InvalidArgumentError, OrderAlreadyCancelledError, OrderAlreadyCompletedError) as err:
+  except (InvalidArgumentError, OrderAlreadyCancelledError, OrderAlreadyCompletedError, OrderCancellationError) as err:
     return HttpResponse(err, status=status.HTTP_400_BAD_REQUEST)
+  except OrderConcurrentUpdateError as err:
+    return HttpResponse(err, status=status.HTTP_409_CONFLICT)
+
+  return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+# Same as set_status_handler() for the bulk transitions. Builds the selection of orders
+# from the request body and passes it to the transition delegate
+def bulk_status_handler(request, transition_delegate):
+  data = request.data
+
+  try:
+    order_ids = data.get('order_ids')
+    selected_status = data.get('status')
+
+    orders = Order.objects.select_for_transition(
+      order_ids=order_ids,
+      status=Status(selected_status) if selected_status is not None else None,
+      start_date=parse_date_argument(data['start_date'], 'start_date', time.min) if 'start_date' in data else None,
+      end_date=parse_date_argument(data['end_date'], 'end_date', time.max) if 'end_date' in data else None)
+
+    transitioned, rejected = transition_delegate(orders)
+  except (AttributeError, ValueError):
+    return Response('The request body is invalid.', status=status.HTTP_400_BAD_REQUEST)
+  except InvalidArgumentError as err:
+    return Response(str(err), status=status.HTTP_400_BAD_REQUEST)
+  except OrderConcurrentUpdateError as err: # nothing was transitioned, the request can be retried
+    return Response(str(err), status=status.HTTP_409_CONFLICT)
+
+  # ids that dont exist are rejected too
+  if order_ids is not None:
+    transitioned_ids = set(transitioned)
+    rejected = [order_id for order_id in order_ids if order_id not in transitioned_ids]
+
+  return Response({ 'transitioned': transitioned, 'rejected': rejected }, status=status.HTTP_200_OK)
+
+# Accepts a datetime or a date, a date covers the whole day (default_time is time.min or time.max)
+def parse_date_argument(value, argument_name, default_time):
+  try:
+    date = parse_date(value)
+    result = datetime.combine(date, default_time) if date else parse_datetime(value)
+  except (TypeError, ValueError):
+    raise InvalidArgumentError(argument_name)
+
+  if result is None:
+    raise InvalidArgumentError(argument_name)
+
+  if timezone.is_naive(result):
+    result = timezone.make_aware(result)
+
+  return result
+
+
+# ?fields=id,status,totals, a sparse fieldset of OrderValuesSerializer. None for all the fields
+def parse_fields(request):
+  value = request.query_params.get('fields')
+  if value is None:
+    return None
+
+  fields = {field.strip() for field in value.split(',') if field.strip()}
+  if not fields or not fields <= set(OrderValuesSerializer.FIELDS):
+    raise InvalidArgumentError('fields')
+
+  return fields
+
+
+# ?status=1,2 as a list of Status items, None when missing
+def parse_statuses(request):
+  value = request.query_params.get('status')
+  if value is None:
+    return None
+
+  try:
+    return [Status(int(status_id)) for status_id in value.split(',')]
+  except ValueError:
+    raise InvalidArgumentError('status')
+
+
+# Decimal query parameter, None when it is missing
+def parse_decimal_argument(request, name):
+  value = request.query_params.get(name)
+  if value is None:
+    return None
+
+  try:
+    value = Decimal(value)
+  except InvalidOperation:
+    raise InvalidArgumentError(name)
+
+  if not value.is_finite():
+    raise InvalidArgumentError(name)
+
+  return value
+
+
+# include_archived=true also lists the archived orders (see ArchivedOrderManager)
+def parse_include_archived(request):
+  value = request.query_params.get('include_archived', 'false').lower()
+
+  if value not in ('true', 'false', '1', '0'):
+    raise InvalidArgumentError('include_archived')
+
+  return value in ('true', '1')
+
+
+# Non negative integer query parameter, default when it is missing
+def parse_int_argument(request, name, default):
+  value = request.query_params.get(name)
+  if value is None:
+    return default
+
+  try:
+    value = int(value)
+  except ValueError:
+    raise InvalidArgumentError(name)
+
+  if value < 0:
+    raise InvalidArgumentError(name)
 
-  return HttpResponse(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+  return value
@@ -1,12 +1,30 @@
-from django.http import HttpResponse
+from datetime import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, status
+from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from .models import Order
-from .serializers import OrderSerializer
+from . import group_commit, idempotency, search
+from .cache import stats as cache_stats
+from .exceptions import InvalidArgumentError
+from .export import iter_csv, iter_ndjson
+from .models import CustomerOrderSummary, Order, OrderChange, StatusCounter
+from .rollups import order_volume
+from .serializers import CustomerOrderSummarySerializer, OrderChangeSerializer, OrderSerializer
 from .status import Status
 from .view_helper import OrderListApiBaseView
+from .view_helper import bulk_status_handler
+from .view_helper import parse_date_argument
+from .view_helper import parse_decimal_argument
+from .view_helper import parse_include_archived
+from .view_helper import parse_int_argument
+from .view_helper import parse_statuses
 from .view_helper import set_status_handler
 
 # Get orders for a given customer
@@ -14,27 +32,30 @@ class OrdersByCustomerView(OrderListApiBaseView):
   # lookup_field will be used to get the value of the keyword argument that is passed
   # on to the kwargs of the list method on the base class.
   lookup_field = 'customer_id'
+  cache_name = 'all'
 
   """
     calls get_all_orders_by_customer that we created in the Order model manager,
     passing the customer_id .
   """
   def get_queryset(self, customer_id):
-    return Order.objects.get_all_orders_by_customer(customer_id)
+    return self.get_orders('get_all_orders_by_customer', customer_id)
 
 
 class IncompleteOrdersByCustomerView(OrderListApiBaseView):
   lookup_field = 'customer_id'
+  cache_name = 'incomplete'
 
   def get_queryset(self, customer_id):
-    return Order.objects.get_customer_incomplete_orders(customer_id)
+    return self.get_orders('get_customer_incomplete_orders', customer_id)
 
 
 class CompletedOrdersByCustomerView(OrderListApiBaseView):
   lookup_field = 'customer_id'
+  cache_name = 'completed'
 
   def get_queryset(self, customer_id):
-    return Order.objects.get_customer_completed_orders(customer_id)
+    return self.get_orders('get_customer_completed_orders', customer_id)
 
 
 # List of orders by specific status
@@ -42,22 +63,215 @@ class OrderByStatusView(OrderListApiBaseView):
   lookup_field = 'status_id'
 
   def get_queryset(self, status_id):
-    return Order.objects.get_orders_by_status(Status(status_id)) # Status ( status_id ), so we pass the Enum item and not only the ID.
+    return self.get_orders('get_orders_by_status', Status(status_id)) # Status ( status_id ), so we pass the Enum item and not only the ID.
+
+
+# Orders matching all the given criteria, e.g.
+# order/search/?customer_id=7&status=1,2&start_date=2019-01-01&min_totals=10&order=newest
+# Also takes end_date, max_totals, order=oldest and the parameters of the other lists.
+# X-Search-Index names the index the query runs on (see search.py), Warning is set when
+# the matching orders are sorted before the first page and the sort isn't bounded by a
+# customer or a date range. 400 when no criterion is indexed
+class OrderSearchView(OrderListApiBaseView):
+  orders = {'newest': True, 'oldest': False}
+
+  def list(self, request, *args, **kwargs):
+    self.plan = None
+    response = super().list(request, *args, **kwargs)
+
+    if self.plan is not None:
+      response['X-Search-Index'] = self.plan.index
+      if self.plan.warning is not None:
+        response['Warning'] = f'299 - "{self.plan.warning}"'
+
+    return response
+
+  def get_queryset(self, lookup_value):
+    params = self.request.query_params
+    if params.get('order', 'newest') not in self.orders:
+      raise InvalidArgumentError('order')
+
+    criteria = {
+      'customer_id': parse_int_argument(self.request, 'customer_id', None),
+      'statuses': parse_statuses(self.request),
+      'start_date': parse_date_argument(params['start_date'], 'start_date', time.min) if 'start_date' in params else None,
+      'end_date': parse_date_argument(params['end_date'], 'end_date', time.max) if 'end_date' in params else None,
+      'newest_first': self.orders[params.get('order', 'newest')],
+    }
+
+    result = self.get_orders(
+      'search',
+      min_totals=parse_decimal_argument(self.request, 'min_totals'),
+      max_totals=parse_decimal_argument(self.request, 'max_totals'),
+      **criteria)
+
+    self.plan = search.plan(**criteria)
+    return result
+
+
+# Order counts per status, lifetime totals and last order time of a customer.
+# One primary key lookup on the summary maintained by the OrderManager
+@api_view(['GET'])
+def customer_summary(request, customer_id):
+  summary = get_object_or_404(CustomerOrderSummary, pk=customer_id)
+  return Response(CustomerOrderSummarySerializer(summary).data, status=status.HTTP_200_OK)
+
+
+# Number of orders at every status (the fulfilment queue depths), by display name.
+# One query on the counters maintained by the OrderManager, not a COUNT over the orders
+@api_view(['GET'])
+def order_status_counts(request):
+  depths = StatusCounter.objects.depths()
+  labels = dict(Order.ORDER_STATUS)
+
+  return Response({
+    'statuses': {labels[status.value]: count for status, count in depths.items()},
+    'total': sum(depths.values()),
+  }, status=status.HTTP_200_OK)
+
+
+# Change feed: the orders created and the status transitions after the since cursor, oldest
+# first, e.g. order/changes/?since=1200&limit=500. Consumers pass the next cursor of a
+# response as since in their next request. 410 when the changes after since were
+# already deleted by the compact_order_changes command, the consumer has to resync
+@api_view(['GET'])
+def order_changes(request):
+  feed = getattr(settings, 'ORDER_CHANGE_FEED', {})
+
+  try:
+    since = parse_int_argument(request, 'since', 0)
+    limit = min(parse_int_argument(request, 'limit', feed.get('LIMIT', 100)), feed.get('MAX_LIMIT', 1000))
+    if limit == 0:
+      raise InvalidArgumentError('limit')
+  except InvalidArgumentError as err:
+    return Response(str(err), status=status.HTTP_400_BAD_REQUEST)
+
+  if OrderChange.objects.expired(since):
+    return Response('The changes after this cursor were compacted.', status=status.HTTP_410_GONE)
+
+  changes, more = OrderChange.objects.since(since, limit)
+  return Response({
+    'changes': OrderChangeSerializer(changes, many=True).data,
+    'next': changes[-1].id if changes else since,
+    'more': more,
+  }, status=status.HTTP_200_OK)
+
+
+# Streams all the orders created in a date range as NDJSON (default) or CSV
+# e.g. order/export/?start_date=2019-01-01&end_date=2019-02-01&output=csv&include_archived=true
+class OrderExportView(APIView):
+  outputs = {
+    'ndjson': ('application/x-ndjson', iter_ndjson),
+    'csv': ('text/csv', iter_csv),
+  }
+
+  def get(self, request, *args, **kwargs):
+    try:
+      start_date = parse_date_argument(request.query_params.get('start_date'), 'start_date', time.min)
+      end_date = parse_date_argument(request.query_params.get('end_date'), 'end_date', time.max)
+      content_type, rows = self.outputs[request.query_params.get('output', 'ndjson')]
+      if parse_include_archived(request):
+        orders = Order.objects.with_archive('get_orders_by_period', start_date, end_date)
+      else:
+        orders = Order.objects.get_orders_by_period(start_date, end_date)
+    except KeyError:
+      return HttpResponse('The output value is invalid.', status=status.HTTP_400_BAD_REQUEST)
+    except InvalidArgumentError as err:
+      return HttpResponse(err, status=status.HTTP_400_BAD_REQUEST)
+
+    return StreamingHttpResponse(rows(orders), content_type=content_type)
+
+
+# Hit/miss counters of the customer order lists cache, since the process started
+@api_view(['GET'])
+def orders_cache_stats(request):
+  return Response(cache_stats.as_dict(), status=status.HTTP_200_OK)
 
 
 ############ POST REquest view
 
 # Base class provides us with post method, 
+# A retried request with the same idempotency key gets the first response back
+# instead of creating the order again (see idempotency.py)
 class CreateOrderView(generics.CreateAPIView):
 
   def post(self, request, *args, **kwargs):
+    try:
+      key = idempotency.get_key(request)
+    except InvalidArgumentError as err:
+      return Response(str(err), status=status.HTTP_400_BAD_REQUEST)
+
+    if key is not None:
+      fingerprint = idempotency.fingerprint(request)
+      replayed = idempotency.replay(request.user, key, fingerprint)
+      if replayed is not None:
+        return replayed
+
     serializer = OrderSerializer(data=request.data)
 
-    if serializer.is_valid():
+    if not serializer.is_valid():
+      return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+      order_id = self._create(serializer, idempotency.new_key(request.user, key, fingerprint) if key is not None else None)
+    except TimeoutError: # the order was cancelled before it was written, a retry is safe
+      return Response('The order could not be written in time.', status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except IntegrityError:
+      # a concurrent request with the same key created the order first
+      replayed = idempotency.replay(request.user, key, fingerprint) if key is not None else None
+      if replayed is None:
+        raise
+      return replayed
+
+    if key is not None:
+      idempotency.start_purger()
+
+    return Response({ 'order_id': order_id}, status=status.HTTP_201_CREATED)
+
+  # with group commit the order is written by the writer thread, with the ones of concurrent requests
+  def _create(self, serializer, idempotency_key):
+    if group_commit.writer.enabled:
+      return group_commit.writer.submit((serializer.validated_data, idempotency_key))
+
+    with transaction.atomic():
       order = serializer.save()
-      return Response({ 'order_id': order.id}, status=status.HTTP_201_CREATED)
-    
-    return Response(status=status.HTTP_400_BAD_REQUEST)
+      if idempotency_key is not None:
+        idempotency.delete_expired([idempotency_key.key])
+        idempotency.record(idempotency_key, status.HTTP_201_CREATED, { 'order_id': order.id }).save()
+
+    return order.id
+
+
+# Creates a list of orders in one request. Every order is validated on its own,
+# the valid ones are inserted together and the response has one entry per order
+# in the payload: either the new order_id or the validation errors
+class CreateOrderBatchView(generics.CreateAPIView):
+  max_batch_size = 1000
+
+  def post(self, request, *args, **kwargs):
+    if not isinstance(request.data, list) or not request.data:
+      return Response('Expected a list of orders.', status=status.HTTP_400_BAD_REQUEST)
+
+    if len(request.data) > self.max_batch_size:
+      return Response(f'A batch can have at most {self.max_batch_size} orders.', status=status.HTTP_400_BAD_REQUEST)
+
+    serializers = [OrderSerializer(data=data) for data in request.data]
+    valid = [serializer for serializer in serializers if serializer.is_valid()]
+
+    orders = iter(OrderSerializer(many=True).create([serializer.validated_data for serializer in valid]) if valid else [])
+    results = [
+      { 'errors': serializer.errors } if serializer.errors else { 'order_id': next(orders).id }
+      for serializer in serializers
+    ]
+
+    if not valid:
+      response_status = status.HTTP_400_BAD_REQUEST
+    elif len(valid) < len(serializers):
+      response_status = status.HTTP_207_MULTI_STATUS
+    else:
+      response_status = status.HTTP_201_CREATED
+
+    return Response(results, status=response_status)
 
 # get_object_or_404 calls get on a given model
 
@@ -65,23 +279,91 @@ class CreateOrderView(generics.CreateAPIView):
   set_status_handler(); geta another function as an argument, we are passing
   a lambda function that will execute the method in the Order model manager that
   we want
+
+  api_view makes them token authenticated like the rest of the API (and exempts
+  them from the CSRF check that rejected every POST from an API client)
 """
+@api_view(['POST'])
 def cancel_order(request, order_id):
-  order = get_object_or_404(Order, order_id=order_id)
+  order = get_object_or_404(Order, pk=order_id)
   return set_status_handler(lambda: Order.objects.cancel_order(order))
 
+@api_view(['POST'])
 def set_next_status(request, order_id):
-  order = get_object_or_404(Order, order_id=order_id)
+  order = get_object_or_404(Order, pk=order_id)
   return set_status_handler(lambda: Order.objects.set_next_status(order))
 
+@api_view(['POST'])
 def set_status(request, order_id, status_id):
-  order = get_object_or_404(Order, order_id=order_id)
+  order = get_object_or_404(Order, pk=order_id)
 
   try:
-    status=Status(status_id)
+    new_status = Status(status_id)
   except:
     return HttpResponse('The status value is invalid.', status=status.HTTP_400_BAD_REQUEST)
   
-  return set_status_handler(lambda: Order.objects.set_status(order, status))
+  return set_status_handler(lambda: Order.objects.set_status(order, new_status))
+
+
+############ Bulk status transitions
+
+"""
+  The body selects the orders, either by ids: { "order_ids": [1, 2, 3] }
+  or by filter: { "status": 1, "start_date": "2019-01-01", "end_date": "2019-01-31" }
+  bulk_status_handler() runs the transition and returns the transitioned and rejected ids
+"""
+@api_view(['POST'])
+def bulk_cancel_orders(request):
+  return bulk_status_handler(request, Order.objects.bulk_cancel_orders)
+
+@api_view(['POST'])
+def bulk_set_next_status(request):
+  return bulk_status_handler(request, Order.objects.bulk_set_next_status)
+
+@api_view(['POST'])
+def bulk_set_status(request, status_id):
+  try:
+    new_status = Status(status_id)
+  except ValueError:
+    return Response('The status value is invalid.', status=status.HTTP_400_BAD_REQUEST)
+
+  return bulk_status_handler(request, lambda orders: Order.objects.bulk_set_status(orders, new_status))
+
+
+# Order volume and revenue per hour or day, broken down by status, answered from the rollups
+# e.g. report/orders/?start_date=2019-01-01&end_date=2019-03-31&granularity=day
+class OrderVolumeReportView(APIView):
+  labels = dict(Order.ORDER_STATUS)
+  cents = Decimal('0.01')
+
+  def get(self, request, *args, **kwargs):
+    try:
+      start_date = parse_date_argument(request.query_params.get('start_date'), 'start_date', time.min)
+      end_date = parse_date_argument(request.query_params.get('end_date'), 'end_date', time.max)
+      buckets = order_volume(start_date, end_date, request.query_params.get('granularity', 'day'))
+    except InvalidArgumentError as err:
+      return HttpResponse(err, status=status.HTTP_400_BAD_REQUEST)
+
+    totals = [0, Decimal(0), 0]
+    rows = []
+
+    for bucket, statuses in buckets:
+      row = {'bucket': bucket, 'orders': 0, 'revenue': Decimal(0), 'items': 0, 'statuses': {}}
+
+      for status_id, (orders, revenue, items) in statuses.items():
+        row['statuses'][self.labels[status_id]] = {'orders': orders, 'revenue': self._money(revenue), 'items': items}
+        row['orders'] += orders
+        row['revenue'] += revenue
+        row['items'] += items
+
+      totals = [totals[0] + row['orders'], totals[1] + row['revenue'], totals[2] + row['items']]
+      row['revenue'] = self._money(row['revenue'])
+      rows.append(row)
 
+    return Response({
+      'buckets': rows,
+      'totals': {'orders': totals[0], 'revenue': self._money(totals[1]), 'items': totals[2]},
+    }, status=status.HTTP_200_OK)
 
+  def _money(self, value):
+    return f'{value.quantize(self.cents):f}'
@@ -0,0 +1,32 @@
+"""
+ASGI config for order project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+e.g. uvicorn order.asgi:application
+
+The requests are resolved with order/urls_asgi.py, where the order list endpoints
+are served by the async views of main/async_views.py.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+from django.core.handlers.asgi import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'order.settings')
+
+ASGI_URLCONF = 'order.urls_asgi'
+
+
+class OrderASGIHandler(ASGIHandler):
+
+    async def get_response_async(self, request):
+        request.urlconf = ASGI_URLCONF
+        return await super().get_response_async(request)
+
+
+django.setup(set_prefix=False)
+application = OrderASGIHandler()
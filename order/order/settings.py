@@ -44,10 +44,25 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.IsAuthenticated',),
-    'DEFAULT_AUTHENTICATION_CLASSES': ('rest_framework.authentication.TokenAuthentication',)
+    'DEFAULT_AUTHENTICATION_CLASSES': ('main.authentication.CachedTokenAuthentication',),
+    'DEFAULT_PAGINATION_CLASS': 'main.pagination.OrderKeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
+# In-process cache of authenticated tokens (see main/authentication.py)
+TOKEN_AUTH_CACHE = {
+    'SIZE': 10000,
+    'TTL': 300,
+    'SHARED_CACHE': None,
+}
+
+# Per-request metrics served at /api/metrics (see main/metrics.py), lower the
+# sample rate to measure only a fraction of the requests
+METRICS_ENABLED = True
+METRICS_SAMPLE_RATE = 1.0
+
 MIDDLEWARE = [
+    'main.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,6 +92,12 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'order.wsgi.application'
 
+ASGI_APPLICATION = 'order.asgi.application'
+
+# Threads running the database work of the async list views under ASGI, i.e. how many
+# of them query the database at once (0 runs them in Django's single sync thread)
+ASYNC_VIEW_THREADS = 16
+
 
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
@@ -85,9 +106,65 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            # The database is in WAL mode (set once by the migration 0011_sqlite_wal), with
+            # synchronous=NORMAL a commit no longer waits for an fsync (only checkpoints do)
+            'init_command': (
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA mmap_size=268435456;'
+            ),
+            # take the write lock when the transaction starts, instead of failing with
+            # "database is locked" when a read transaction tries to write
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
+# Stored responses of the create order requests, replayed on retries (see main/idempotency.py)
+IDEMPOTENCY_KEYS = {
+    'TTL': 86400,
+    'PURGE_INTERVAL': 600,
+}
+
+# Create order requests batched into shared transactions (see main/group_commit.py)
+ORDER_GROUP_COMMIT = {
+    'ENABLED': False,
+    'MAX_BATCH': 100,
+    'MAX_DELAY_MS': 5,
+    'TIMEOUT': 30,
+}
+
+# Change feed of the order creations and status transitions (see order/changes/)
+ORDER_CHANGE_FEED = {
+    'LIMIT': 100,
+    'MAX_LIMIT': 1000,
+    'RETENTION_DAYS': 7,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# 'orders' holds the per-customer order list responses (see main/cache.py). Local memory
+# is per process, use django.core.cache.backends.filebased.FileBasedCache to share the
+# entries and invalidations between several worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'orders': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'orders',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -0,0 +1,13 @@
+"""order URL Configuration under ASGI (see asgi.py)
+
+The same as urls.py, with the order list endpoints served by async views.
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+from main.urls import async_urlpatterns
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('api/', include(async_urlpatterns))
+]
@@ -4,6 +4,9 @@ import argparse
 import requests
 from http import HTTPStatus
 
+API_URL = 'http://127.0.0.1:8000/api'
+TOKEN = 'fc16a8d9e120567d7f0e811d2920b9542eaaf39e'
+
 def setUpData(order_id):
   data = {
     "items": [
@@ -32,17 +35,42 @@ def setUpData(order_id):
 
   return data
 
-def send_order(data):
+# Random order with the same shape as setUpData, used by load_test.py
+def random_order(rng, order_id):
+  items = [
+    {
+      "name": f"Prod {product_id:03}",
+      "price_per_unit": rng.randint(1, 500),
+      "product_id": product_id,
+      "quantity": rng.randint(1, 10)
+    }
+    for product_id in rng.sample(range(1, 1000), rng.randint(1, 5))
+  ]
+  customer_id = rng.randint(1, 100000)
+
+  return {
+    "items": items,
+    "order_customer": {
+      "customer_id": customer_id,
+      "email": f"customer{customer_id}@test.com",
+      "name": f"Customer {customer_id}"
+    },
+    "order_id": order_id,
+    "status": 1,
+    "totals": f"{sum(item['price_per_unit'] * item['quantity'] for item in items):.2f}"
+  }
 
-  token = 'fc16a8d9e120567d7f0e811d2920b9542eaaf39e'
-  headers = {
+def get_headers(token=TOKEN):
+  return {
     'Authorization': f'Token {token}',
     'Content-type': 'application/json'
   }
 
+def send_order(data):
+
   response = requests.post(
-    'http://127.0.0.1:8000/api/order/add/',
-    headers=headers,
+    f'{API_URL}/order/add/',
+    headers=get_headers(),
     data=json.dumps(data))
 
   print(response.status_code, HTTPStatus) 